@@ -0,0 +1,282 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+from configs import pixmob_conversion_funcs as conversion
+from configs import pixmob_conversion_funcs_np as conversion_np
+from configs.effect_table import load_effect_table
+from configs.offline_analysis import ANALYZERS
+from configs.packet_cache import get_packet
+from configs.silence_gate import SilenceGate
+from configs.pixmob_conversion_funcs import bits_to_arduino_packet
+from benchmarks.startup import STUB_AUDIO_DIR
+
+# Microbenchmarks for the hot paths: the bit conversion functions, building the packet for send_effect, and every
+# analyzer the controller scripts run once per beat. Run from the repository root:
+#     python -m benchmarks.micro                              # run everything and print the timings
+#     python -m benchmarks.micro --save-baseline              # ...and store them as the baseline
+#     python -m benchmarks.micro --compare                    # ...and compare against the stored baseline
+#     python -m benchmarks.micro --audio set.wav -k analyze   # analyzers on a recording as well as synthetic audio
+#
+# --compare exits with status 1 if anything got more than --threshold slower, so it can gate a change before a show.
+# Baselines are only comparable on the same machine. The committed benchmarks/baseline.json is from a development
+# machine (its "machine" entry says which). On the machine that runs the show, delete it and save one of your own with
+# --save-baseline before comparing against it (saving keeps the stored results for cases that weren't run). The
+# scripts only need sounddevice to import, so without it the stand-in in stub_audio/ (see startup.py) is used; cases
+# whose other dependencies aren't installed (librosa) are skipped.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+SAMPLE_RATE = 44100
+
+
+def synthetic_audio(seconds=10, seed=0):
+    # Kick drum at 120 BPM, a chord and some noise: has beats, energy in every band and isn't silent
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    y = 0.05 * rng.standard_normal(len(t))
+    y += 0.1 * sum(np.sin(2 * np.pi * f * t) for f in (220, 277, 330, 3520))
+    kick = np.sin(2 * np.pi * 60 * t[:4000]) * np.exp(-np.arange(4000) / 800)
+    for start in range(0, len(t) - 4000, SAMPLE_RATE // 2):
+        y[start:start + 4000] += 0.8 * kick
+    return y.astype(np.float32)
+
+
+def recorded_audio(path, seconds=30):
+    from configs.audio_file import read_audio_blocks
+    sample_rate, blocks = read_audio_blocks(path)
+    if sample_rate != SAMPLE_RATE:
+        print(f"Note: {path} is {sample_rate} Hz, the analyzers assume {SAMPLE_RATE} Hz")
+    audio = []
+    for block in blocks:
+        audio.append(block)
+        if sum(len(b) for b in audio) >= seconds * sample_rate:
+            break
+    return np.concatenate(audio)
+
+
+def middle_window(audio, samples):
+    start = max((len(audio) - samples) // 2, 0)
+    return np.ascontiguousarray(audio[start:start + samples])
+
+
+def load_script(filename):
+    # Import one of the controller scripts by path (some names aren't valid module names, and test.py would shadow
+    # the standard library's test package). Their side effects are under if __name__ == "__main__", so this only
+    # defines the functions.
+    name = "_bench_" + os.path.splitext(filename)[0].replace(".", "_").replace(" ", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Cases
+
+def conversion_cases():
+    effects = load_effect_table()
+    bits = effects.base_color_effects["RED"] + effects.tail_codes["FADE_2"]
+    microseconds = conversion.bits_to_run_lengths_microseconds(bits)
+    yield "conversion/bits_to_hex", lambda: conversion.bits_to_hex(bits)
+    yield "conversion/bits_to_run_lengths_pulses", lambda: conversion.bits_to_run_lengths_pulses(bits)
+    yield "conversion/bits_to_run_lengths_microseconds", lambda: conversion.bits_to_run_lengths_microseconds(bits)
+    yield "conversion/run_lengths_to_bits", lambda: conversion.run_lengths_to_bits(microseconds)
+    yield "conversion/bits_to_hex_np", lambda: conversion_np.bits_to_hex_np(bits)
+    yield "conversion/bits_to_run_lengths_pulses_np", lambda: conversion_np.bits_to_run_lengths_pulses_np(bits)
+    yield ("conversion/bits_to_run_lengths_microseconds_np",
+           lambda: conversion_np.bits_to_run_lengths_microseconds_np(bits))
+    yield "conversion/run_lengths_to_bits_np", lambda: conversion_np.run_lengths_to_bits_np(microseconds)
+
+
+def packet_cases():
+    effects = load_effect_table()
+    base_color_effects, tail_codes = effects.base_color_effects, effects.tail_codes
+    # What send_effect used to do on every call, against the lookup it does now
+    yield ("packets/build_from_bits",
+           lambda: bits_to_arduino_packet(base_color_effects["RED"] + tail_codes["FADE_2"]))
+    # A special effect that isn't also a base color, so this times the special effect lookup and not a miss
+    special = next(name for name in effects.special_effects if name not in base_color_effects and get_packet(name))
+    for name, tail_code in (("RED", "FADE_2"), (special, None)):
+        assert get_packet(name, tail_code) is not None, f"{name} isn't in the packet cache"
+    yield "packets/get_packet", lambda: get_packet("RED", "FADE_2")
+    yield "packets/get_packet_special", lambda: get_packet(special)
+    # Joining an effect and a tail code as lists and as Packets, and reading run lengths from each
+    red, fade = base_color_effects["RED"], tail_codes["FADE_2"]
+    red_packet, fade_packet = base_color_effects.packet("RED"), tail_codes.packet("FADE_2")
+    yield "packets/compose_list", lambda: red + fade
+    yield "packets/compose_packet", lambda: red_packet + fade_packet
+    yield "packets/run_lengths_list", lambda: conversion.bits_to_run_lengths_pulses(red + fade)
+    yield "packets/run_lengths_packet", lambda: conversion.bits_to_run_lengths_pulses(red_packet + fade_packet)
+
+
+def analyzer_cases(audio_sets):
+    # Each live analyzer on one window of the length its script analyses, with the arguments its control loop passes
+    if importlib.util.find_spec("sounddevice") is None:
+        # Nothing here records audio, the scripts just import it at the top
+        print("sounddevice isn't installed, loading the scripts with the stand-in from benchmarks/stub_audio")
+        sys.path.insert(0, STUB_AUDIO_DIR)
+    scripts = {}
+    for filename in ("main.py", "pixmob.py", "test.py", "pixmob3.1.py"):
+        try:
+            scripts[filename] = load_script(filename)
+        except ImportError as e:
+            print(f"Skipping {filename} analyzers: {e}")
+
+    for audio_name, audio in audio_sets.items():
+        if "main.py" in scripts:
+            script = scripts["main.py"]
+            window = middle_window(audio, int(script.SAMPLE_RATE * script.CHUNK_DURATION))
+            yield f"analyzers/main.analyze_audio[{audio_name}]", lambda s=script, w=window: s.analyze_audio(w, 120.0)
+        if "pixmob.py" in scripts:
+            script = scripts["pixmob.py"]
+            window = middle_window(audio, int(script.sample_rate * script.chunk_size))
+            yield f"analyzers/pixmob.analyze_audio[{audio_name}]", lambda s=script, w=window: s.analyze_audio(w)
+        if "test.py" in scripts:
+            script = scripts["test.py"]
+            window = middle_window(audio, int(script.sample_rate * script.chunk_size)).astype(np.float64)
+            yield (f"analyzers/test.analyze_audio[{audio_name}]",
+                   lambda s=script, w=window: s.analyze_audio(w, 120.0, [0.1]))
+        if "pixmob3.1.py" in scripts:
+            script = scripts["pixmob3.1.py"]
+            window = middle_window(audio, int(script.SAMPLE_RATE * script.CHUNK_DURATION))
+            yield (f"analyzers/pixmob3.1.advanced_audio_analysis[{audio_name}]",
+                   lambda s=script, w=window: s.advanced_audio_analysis(w, None, 120.0))
+
+        # What the control loops run on every audio callback's worth of samples before deciding to analyse at all
+        gate, block = SilenceGate(SAMPLE_RATE), middle_window(audio, 1024)
+        yield f"analyzers/silence_gate.feed[{audio_name}]", lambda g=gate, b=block: g.feed(b)
+
+        # The batch versions render_cues.py uses, per 64 windows
+        window_samples = int(SAMPLE_RATE * 0.2)
+        starts = np.linspace(0, len(audio) - window_samples, 64).astype(int)
+        windows = np.stack([audio[s:s + window_samples] for s in starts])
+        for name, analyze in ANALYZERS.items():
+            yield (f"analyzers/offline.{name}_batch64[{audio_name}]",
+                   lambda a=analyze, w=windows: a(w, SAMPLE_RATE, np.random.default_rng(0)))
+
+
+# Timing
+
+def time_case(fn, repeats=5, min_time=0.05):
+    # Median and best time per call in microseconds. The loop count is picked so one repeat takes at least min_time.
+    random.seed(0)
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+
+    results = [elapsed / loops]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        results.append((time.perf_counter() - start) / loops)
+    return {"median_us": float(np.median(results)) * 1e6, "min_us": min(results) * 1e6, "loops": loops}
+
+
+def run(cases, pattern=None, repeats=5, min_time=0.05):
+    results = {}
+    for name, fn in cases:
+        if pattern and pattern not in name:
+            continue
+        try:
+            results[name] = time_case(fn, repeats, min_time)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+    return results
+
+
+def report(results, baseline=None, threshold=0.2, filtered=False):
+    # Prints the table and returns the names that got slower than the baseline by more than threshold
+    regressions = []
+    header = f"{'case':<62}{'median us':>12}{'min us':>12}"
+    if baseline is not None:
+        header += f"{'baseline us':>13}{'ratio':>8}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:<62}{result['median_us']:>12.2f}{result['min_us']:>12.2f}"
+        if baseline is not None:
+            previous = baseline.get(name)
+            if previous is None:
+                line += f"{'new':>13}"
+            else:
+                ratio = result["median_us"] / previous["median_us"]
+                line += f"{previous['median_us']:>13.2f}{ratio:>7.2f}x"
+                if ratio > 1 + threshold:
+                    line += "  SLOWER"
+                    regressions.append(name)
+                elif ratio < 1 / (1 + threshold):
+                    line += "  faster"
+        print(line)
+    if baseline is not None and not filtered:
+        missing = [name for name in baseline if name not in results]
+        if missing:
+            print(f"Not run this time: {', '.join(missing)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for conversion, packet building and analyzers")
+    parser.add_argument("-k", "--filter", help="Only run cases whose name contains this")
+    parser.add_argument("--audio", help="Also run the analyzers on up to 30 s of this recording")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum seconds per repeat")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH",
+                        help=f"Store the results as a baseline (default {os.path.relpath(DEFAULT_BASELINE)})")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, metavar="PATH",
+                        help="Compare against a stored baseline, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown that counts as a regression, as a fraction (default 0.2, 20%%)")
+    args = parser.parse_args()
+    if args.compare and not os.path.exists(args.compare):
+        sys.exit(f"No baseline at {args.compare}, create one with: python -m benchmarks.micro --save-baseline")
+
+    audio_sets = {"synthetic": synthetic_audio()}
+    if args.audio:
+        audio_sets["recorded"] = recorded_audio(args.audio)
+
+    def cases():
+        yield from conversion_cases()
+        yield from packet_cases()
+        yield from analyzer_cases(audio_sets)
+
+    results = run(cases(), args.filter, args.repeats, args.min_time)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    regressions = report(results, baseline, args.threshold, filtered=bool(args.filter))
+
+    if args.save_baseline:
+        # Keep results for cases that weren't run this time (filtered out or skipped)
+        saved = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline) as f:
+                saved = json.load(f)["results"]
+        saved.update(results)
+        with open(args.save_baseline, "w") as f:
+            json.dump({"machine": {"python": platform.python_version(), "numpy": np.__version__,
+                                   "platform": platform.platform(), "processor": platform.processor()},
+                       "saved": time.strftime("%Y-%m-%d %H:%M:%S"), "results": saved}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} case(s) more than {args.threshold:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
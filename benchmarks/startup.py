@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+# Startup benchmark: how long from launching the controller until the first packet reaches the Arduino.
+#
+# Each run is a fresh Python process that runs main.py itself, against the fake Arduino with the Arduino's reset delay
+# simulated. sounddevice is replaced by the stand-in in stub_audio/, which plays a synthetic track into main.py's audio
+# callback, so the first packet goes out the way it would with music playing: after the stream starts, librosa loads,
+# the silence gate opens and the first window is analysed. Run from the repository root:
+#     python -m benchmarks.startup
+#     python -m benchmarks.startup --runs 20 --reset-delay 0
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(REPO_ROOT, "main.py")
+STUB_AUDIO_DIR = os.path.join(REPO_ROOT, "benchmarks", "stub_audio")
+# Starts the line the child prints its timestamps on, main.py prints its own lines around it
+MARKS_PREFIX = "startup marks: "
+
+
+def child(args):
+    # Timestamps are time.monotonic(), which is shared between processes, so the parent can include interpreter start
+    marks = {"interpreter_ready": time.monotonic()}
+
+    # First on the path so main.py (and its analysis worker process, if that's on) imports the stand-in sounddevice
+    sys.path.insert(0, STUB_AUDIO_DIR)
+    from configs import config as cfg
+    from configs import transport
+
+    # main.py calls open_transport() with ARDUINO_TRANSPORT, this opens the benchmark's transport in its place and
+    # keeps hold of it to see when the first packet arrives
+    reset_delay = cfg.ARDUINO_RESET_DELAY if args.reset_delay is None else args.reset_delay
+    opened = []
+    open_transport = transport.open_transport
+
+    def open_benchmark_transport(*_args, **_kwargs):
+        arduino = open_transport(args.transport, reset_delay=reset_delay)
+        marks["transport_opened"] = time.monotonic()
+        opened.append(arduino)
+        return arduino
+
+    transport.open_transport = open_benchmark_transport
+    cfg.ARDUINO_TRANSPORT = args.transport
+
+    def report_first_packet():
+        while not opened:
+            time.sleep(0.0005)
+        arduino = opened[0]
+        if args.transport == "fake":
+            while not arduino.frame_log:
+                time.sleep(0.0005)
+            marks["first_packet"] = arduino.frame_log[0][0] / 1e9
+        else:
+            while not arduino.writes:
+                time.sleep(0.0005)
+            marks["first_packet"] = time.monotonic()
+        # One write straight to the file descriptor, on a line of its own, so it can't get mixed up with a line
+        # main.py is printing at the same moment
+        os.write(sys.stdout.fileno(), f"\n{MARKS_PREFIX}{json.dumps(marks)}\n".encode())
+        # main.py runs until it's interrupted, there's nothing to shut down cleanly
+        os._exit(0)
+
+    threading.Thread(target=report_first_packet, daemon=True).start()
+    runpy.run_path(MAIN_PATH, run_name="__main__")
+
+
+def run_once(args):
+    command = [sys.executable, "-m", "benchmarks.startup", "--child", "--transport", args.transport]
+    if args.reset_delay is not None:
+        command += ["--reset-delay", str(args.reset_delay)]
+    started = time.monotonic()
+    output = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+                            timeout=args.timeout).stdout
+    line = next(line for line in output.splitlines() if line.startswith(MARKS_PREFIX))
+    marks = json.loads(line[len(MARKS_PREFIX):])
+    # Seconds since the process was launched
+    return {name: stamp - started for name, stamp in marks.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure controller startup time up to the first packet sent")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--transport", choices=["fake", "null"], default="fake")
+    parser.add_argument("--reset-delay", type=float, default=None,
+                        help="Simulated Arduino reset delay in seconds (default: ARDUINO_RESET_DELAY from config.py)")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the first packet per run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    runs = [run_once(args) for _ in range(args.runs)]
+    reset_delay = "ARDUINO_RESET_DELAY" if args.reset_delay is None else f"{args.reset_delay} s"
+    print(f"{args.runs} runs of main.py, transport={args.transport}, reset delay={reset_delay}")
+    print(f"{'milestone':<22}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for name in runs[0]:
+        values = [run[name] * 1000 for run in runs]
+        print(f"{name:<22}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
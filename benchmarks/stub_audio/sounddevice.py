@@ -0,0 +1,62 @@
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+
+# Stands in for the sounddevice package when benchmarks/startup.py runs main.py, so startup can be timed without a
+# microphone. InputStream plays a synthetic track (a kick drum at 120 BPM over a chord and some noise) into the
+# callback one block at a time, paced like a real input stream. Only what main.py uses is here.
+
+_LOOP_SECONDS = 2.0
+
+
+def _synthetic_loop(sample_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(_LOOP_SECONDS * sample_rate)) / sample_rate
+    y = 0.05 * rng.standard_normal(len(t))
+    y += 0.1 * sum(np.sin(2 * np.pi * f * t) for f in (220, 277, 330, 3520))
+    kick = np.sin(2 * np.pi * 60 * t[:4000]) * np.exp(-np.arange(4000) / 800)
+    for start in range(0, len(t) - 4000, int(sample_rate) // 2):
+        y[start:start + 4000] += 0.8 * kick
+    return y.astype(np.float32)
+
+
+class InputStream:
+    def __init__(self, samplerate=None, blocksize=None, channels=1, callback=None, **kwargs):
+        self.samplerate = samplerate or 44100
+        self.blocksize = blocksize or 1024
+        self.channels = channels
+        self.callback = callback
+        self.latency = self.blocksize / self.samplerate
+        self._loop = np.repeat(_synthetic_loop(self.samplerate)[:, None], channels, axis=1)
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Deadlines from the start, like the cue player, so the stream doesn't drift behind real time
+        block_ns = int(self.blocksize * 1e9 / self.samplerate)
+        # The host API timestamps are left at 0, CaptureClock falls back to the callback time for those
+        time_info = SimpleNamespace(inputBufferAdcTime=0.0, currentTime=0.0)
+        position = 0
+        deadline = time.monotonic_ns()
+        while not self._stopping:
+            deadline += block_ns
+            remaining = deadline - time.monotonic_ns()
+            if remaining > 0:
+                time.sleep(remaining / 1e9)
+            indexes = (position + np.arange(self.blocksize)) % len(self._loop)
+            self.callback(self._loop[indexes], self.blocksize, time_info, None)
+            position += self.blocksize
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        self.stop()
@@ -0,0 +1,57 @@
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from configs.audio_buffer import AudioRingBuffer
+
+
+# Runs an analysis function in a separate process so the audio callback, the analysis and the serial writes stop
+# competing for one interpreter's GIL, and a second core actually gets used. The worker reads audio straight out of
+# the capture ring buffer through shared memory; only the function's arguments and its (small) result are pickled.
+#
+# The worker is started with "forkserver" ("spawn" where that's missing, on Windows), never "fork": forking a process
+# that already has the audio stream and serial writer threads running can copy a lock one of them holds into the
+# worker, which then hangs on it. Either way the worker imports the script that created it, so keep that script's
+# startup under if __name__ == "__main__". The analysis function has to be picklable, so a module-level function.
+
+# The worker process's view of the capture buffer, set up once when it starts
+_audio_buffer = None
+
+
+def _start_worker(buffer_name, capacity, preload_modules):
+    global _audio_buffer
+    _audio_buffer = AudioRingBuffer.attach(buffer_name, capacity)
+    for name in preload_modules:
+        importlib.import_module(name)
+
+
+def _run_analysis(analyze, window_samples, end, args):
+    # Returns the write count the window ends at along with the result, so the caller knows how fresh it is
+    written = _audio_buffer.written if end is None else end
+    audio_data = _audio_buffer.latest(window_samples, end=written)
+    return written, analyze(audio_data, *args)
+
+
+class AnalysisWorker:
+    """
+    submit(*args) runs analyze(<latest window_samples of audio>, *args) in the worker and returns a Future whose
+    result is (samples written when the window was taken, analyze's return value). With end (a write count) the window
+    is the one ending there instead, for a caller that has to know which audio gets analysed before it's submitted.
+    audio_buffer must have been made with AudioRingBuffer.create_shared().
+    """
+
+    def __init__(self, audio_buffer, analyze, window_samples, preload_modules=()):
+        if audio_buffer.shared_name is None:
+            raise ValueError("The analysis worker needs an AudioRingBuffer made with create_shared()")
+        self.analyze = analyze
+        self.window_samples = int(window_samples)
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(start_method),
+                                             initializer=_start_worker,
+                                             initargs=(audio_buffer.shared_name, audio_buffer.capacity,
+                                                       tuple(preload_modules)))
+
+    def submit(self, *args, end=None):
+        return self._executor.submit(_run_analysis, self.analyze, self.window_samples, end, args)
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
@@ -0,0 +1,107 @@
+from configs.pixmob_conversion_funcs import crc8, V2_START_BYTE, V2_FLAG_WIDE, V2_FLAG_CRC
+
+
+# Host side reference decoder for what the Arduino receives over serial. It understands both the version 1 ASCII
+# frames ("[3]341,") and the version 2 binary frames, so it can be used to check the encoders and to stand in for the
+# Arduino when there's no hardware around.
+
+
+def run_lengths_pulses_to_bits(run_lengths):
+    # Example: [3, 4, 1] -> [1, 1, 1, 0, 0, 0, 0, 1]
+    bit_list = []
+    bit = 1
+    for pulses in run_lengths:
+        bit_list += [bit] * pulses
+        bit = 1 - bit
+    return bit_list
+
+
+class ArduinoEmulator:
+    """
+    Feed it bytes in whatever chunks they arrive, get back the packets they contain as run lengths in pulses.
+    Incomplete frames are kept until the rest arrives. Malformed frames and failed CRCs are counted and skipped the same
+    way the sketch would, by resynchronising on the next start byte.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.bytes_received = 0
+        self.bad_frames = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self.bytes_received += len(data)
+        self.buffer += data
+        packets = []
+        while self.buffer:
+            start = self.buffer[0]
+            if start == ord("["):
+                consumed, run_lengths = self._parse_v1()
+            elif start == V2_START_BYTE:
+                consumed, run_lengths = self._parse_v2()
+            else:
+                # Not the start of any frame, drop bytes until one starts
+                self.bad_frames += 1
+                consumed, run_lengths = self._skip_to_next_start(1), None
+            if consumed == 0:
+                break  # Wait for more data
+            del self.buffer[:consumed]
+            if run_lengths is not None:
+                self.frames += 1
+                packets.append(run_lengths)
+        return packets
+
+    def feed_bits(self, data):
+        # Same as feed, but returns each packet as a bit list
+        return [run_lengths_pulses_to_bits(run_lengths) for run_lengths in self.feed(data)]
+
+    def _skip_to_next_start(self, offset):
+        for i in range(offset, len(self.buffer)):
+            if self.buffer[i] in (ord("["), V2_START_BYTE):
+                return i
+        return len(self.buffer)
+
+    def _parse_v1(self):
+        end = self.buffer.find(b",")
+        if end == -1:
+            # A v1 frame is short, so a lot of data without a comma means we are looking at garbage
+            return (self._skip_to_next_start(1), None) if len(self.buffer) > 300 else (0, None)
+        frame = bytes(self.buffer[:end])
+        close = frame.find(b"]")
+        try:
+            count = int(frame[1:close])
+            run_lengths = [int(chr(digit)) for digit in frame[close + 1:]]
+        except ValueError:
+            count, run_lengths = -1, []
+        if close == -1 or count != len(run_lengths) or 0 in run_lengths:
+            self.bad_frames += 1
+            return end + 1, None
+        return end + 1, run_lengths
+
+    def _parse_v2(self):
+        if len(self.buffer) < 3:
+            return 0, None
+        flags, count = self.buffer[1], self.buffer[2]
+        payload_length = count if flags & V2_FLAG_WIDE else (count + 1) // 2
+        frame_length = 3 + payload_length + (1 if flags & V2_FLAG_CRC else 0)
+        if len(self.buffer) < frame_length:
+            return 0, None
+
+        if flags & V2_FLAG_CRC and crc8(self.buffer[:frame_length - 1]) != self.buffer[frame_length - 1]:
+            # The length byte itself may be what got corrupted, so resync from the next start byte
+            self.crc_errors += 1
+            return self._skip_to_next_start(1), None
+
+        payload = self.buffer[3:3 + payload_length]
+        if flags & V2_FLAG_WIDE:
+            run_lengths = list(payload)
+        else:
+            run_lengths = []
+            for byte in payload:
+                run_lengths += [byte >> 4, byte & 0x0F]
+            run_lengths = run_lengths[:count]
+        if 0 in run_lengths:
+            self.bad_frames += 1
+            return self._skip_to_next_start(1), None
+        return frame_length, run_lengths
@@ -0,0 +1,123 @@
+import atexit
+import threading
+import time
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Fixed size buffer of the most recent audio samples (mono), written in place from the audio callback.
+
+    Every sample is stored twice, at i and i + capacity, so the latest n samples are always one contiguous slice and
+    latest() can return a view instead of concatenating chunks. A view stays valid until capacity - n more samples
+    have been written, so make the capacity comfortably larger than the window you analyse.
+
+    create_shared() puts the buffer in multiprocessing shared memory so another process can attach() to it and read
+    the same samples without them being copied or pickled. Only one process should write.
+
+    wait_for() blocks until new audio has been written, woken by write() rather than polling. The wakeup only reaches
+    threads of the writing process, attached processes have to poll written.
+    """
+
+    def __init__(self, capacity, dtype=np.float32, _memory=None):
+        self.capacity = int(capacity)
+        self._memory = _memory
+        self._arrived = threading.Event()
+        if _memory is None:
+            self._state = np.zeros(1, dtype=np.int64)
+            self._data = np.zeros(2 * self.capacity, dtype=dtype)
+        else:
+            # First 8 bytes hold the write count, the samples follow
+            self._state = np.ndarray((1,), dtype=np.int64, buffer=_memory.buf)
+            self._data = np.ndarray((2 * self.capacity,), dtype=dtype, buffer=_memory.buf, offset=8)
+
+    @classmethod
+    def create_shared(cls, capacity, dtype=np.float32):
+        from multiprocessing import shared_memory
+        size = 8 + 2 * int(capacity) * np.dtype(dtype).itemsize
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        buffer = cls(capacity, dtype, _memory=memory)
+        buffer._state[0] = 0
+        atexit.register(buffer.unlink)
+        return buffer
+
+    @classmethod
+    def attach(cls, name, capacity, dtype=np.float32):
+        from multiprocessing import shared_memory
+        return cls(capacity, dtype, _memory=shared_memory.SharedMemory(name=name))
+
+    @property
+    def shared_name(self):
+        return self._memory.name if self._memory is not None else None
+
+    def unlink(self):
+        # Called by the creating process when it's done with shared memory (automatically at exit)
+        if self._memory is not None:
+            self._state = self._data = None
+            self._memory.close()
+            try:
+                self._memory.unlink()
+            except FileNotFoundError:
+                pass
+            self._memory = None
+
+    @property
+    def written(self):
+        # Total samples ever written, also usable as a watermark to tell whether new audio arrived
+        return int(self._state[0])
+
+    def write(self, samples):
+        # samples can be the (frames, channels) array sounddevice passes to the callback, only channel 0 is kept
+        if samples.ndim == 2:
+            samples = samples[:, 0]
+        count = len(samples)
+        written = self.written
+        if count > self.capacity:
+            samples = samples[-self.capacity:]
+        n = len(samples)
+
+        # The newest sample always lands at (written - 1) % capacity, so readers only need the write count
+        capacity = self.capacity
+        position = (written + count - n) % capacity
+        first = min(n, capacity - position)
+        self._data[position:position + first] = samples[:first]
+        self._data[position + capacity:position + capacity + first] = samples[:first]
+        rest = n - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[capacity:capacity + rest] = samples[first:]
+
+        # Published after the samples, so a reader never sees a count ahead of the data
+        self._state[0] = written + count
+        self._arrived.set()
+
+    def wait_for(self, count, timeout=None):
+        """
+        Block until count samples have been written in total (pass a watermark from written plus however much new
+        audio you need), or timeout seconds have passed. Returns written either way.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Cleared before checking, so a write() landing in between still wakes the wait below
+            self._arrived.clear()
+            written = self.written
+            if written >= count:
+                return written
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return written
+            self._arrived.wait(remaining)
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def latest(self, n, end=None):
+        # Read-only view of the most recent n samples (fewer if that many haven't been written yet), oldest first.
+        # end is a write count read earlier, to get the n samples before it: the callback can write between a caller
+        # reading written and calling this, which would shift the window by a block.
+        written = self.written if end is None else int(end)
+        n = min(int(n), written, self.capacity)
+        end = written % self.capacity + self.capacity
+        view = self._data[end - n:end]
+        view.flags.writeable = False
+        return view
@@ -0,0 +1,51 @@
+import wave
+import numpy as np
+
+
+def read_audio_blocks(path, block_size=65536):
+    """
+    Read an audio file as mono float32 blocks without loading it all into memory.
+    Returns (sample rate, generator of blocks). Uses soundfile (installed with librosa) for WAV, FLAC and the other
+    formats it knows, and falls back to the wave module for plain PCM WAV files if soundfile isn't available.
+    """
+    try:
+        import soundfile
+    except ImportError:
+        return _read_wav_blocks(path, block_size)
+
+    info = soundfile.info(path)
+
+    def blocks():
+        with soundfile.SoundFile(path) as f:
+            for block in f.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+                yield block.mean(axis=1)
+
+    return info.samplerate, blocks()
+
+
+def _read_wav_blocks(path, block_size):
+    with wave.open(path, "rb") as f:
+        sample_rate = f.getframerate()
+
+    def blocks():
+        with wave.open(path, "rb") as f:
+            channels, width = f.getnchannels(), f.getsampwidth()
+            while True:
+                data = f.readframes(block_size)
+                if not data:
+                    return
+                if width == 1:
+                    samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+                elif width == 2:
+                    samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+                elif width == 3:
+                    # 24 bit: put each sample in the top three bytes of an int32
+                    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+                    padded = np.zeros((len(raw), 4), dtype=np.uint8)
+                    padded[:, 1:] = raw
+                    samples = padded.view("<i4").ravel().astype(np.float32) / 2 ** 31
+                else:
+                    samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2 ** 31
+                yield samples.reshape(-1, channels).mean(axis=1)
+
+    return sample_rate, blocks()
@@ -0,0 +1,59 @@
+from functools import lru_cache
+import numpy as np
+from configs.streaming_stft import periodic_hann
+
+
+# Bass / mid / treble band energies from the magnitude spectrum, with everything that only depends on the window size
+# and sample rate (the window function and which FFT bins fall in each band) worked out once and reused.
+
+# (low Hz, high Hz), both ends included, same ranges the analyzers have always used
+DEFAULT_BANDS = ((20, 250), (250, 2000), (2000, 20000))
+
+
+@lru_cache(maxsize=None)
+def band_bin_slices(n_fft, sample_rate, bands=DEFAULT_BANDS):
+    # Slices of rfft bins whose frequency is within each band. Uses the same frequencies as np.fft.fftfreq, so it picks
+    # exactly the bins that masking with (freqs >= low) & (freqs <= high) would.
+    freqs = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    slices = []
+    for low, high in bands:
+        in_band = np.flatnonzero((freqs >= low) & (freqs <= high))
+        slices.append(slice(in_band[0], in_band[-1] + 1) if in_band.size else slice(0, 0))
+    return tuple(slices)
+
+
+class BandEnergyExtractor:
+    """
+    Sums of rfft magnitudes in each band for windows of a fixed size. Get one with get_band_extractor so the window
+    and bin slices are shared between calls.
+
+    window=None leaves the audio unwindowed, which is what test.py's full np.fft.fft version did, and gives the same
+    numbers as it. window="hann" applies a periodic Hann window.
+    """
+
+    def __init__(self, window_size, sample_rate, bands=DEFAULT_BANDS, window=None):
+        self.window_size = window_size
+        self.sample_rate = sample_rate
+        self.slices = band_bin_slices(window_size, sample_rate, bands)
+        if window is None:
+            self.window = None
+        elif window == "hann":
+            self.window = periodic_hann(window_size).astype(np.float32)
+        else:
+            raise ValueError(f"Unknown window {window!r}, expected None or 'hann'")
+
+    def energies(self, windows):
+        # windows: one window of audio (window_size samples) -> array of band energies
+        #          or a 2D array of windows, one per row -> array with one row of band energies per window
+        samples = np.asarray(windows, dtype=np.float32)
+        if samples.shape[-1] != self.window_size:
+            raise ValueError(f"Expected windows of {self.window_size} samples, got {samples.shape[-1]}")
+        if self.window is not None:
+            samples = samples * self.window
+        magnitudes = np.abs(np.fft.rfft(samples, axis=-1))
+        return np.stack([magnitudes[..., band].sum(axis=-1) for band in self.slices], axis=-1)
+
+
+@lru_cache(maxsize=16)
+def get_band_extractor(window_size, sample_rate, bands=DEFAULT_BANDS, window=None):
+    return BandEnergyExtractor(window_size, sample_rate, bands, window)
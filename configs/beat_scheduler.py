@@ -0,0 +1,114 @@
+import time
+import numpy as np
+import configs.config as cfg
+
+
+class CaptureClock:
+    """
+    Maps positions in the captured audio stream (AudioRingBuffer.written counts) to time.monotonic_ns(), so a beat
+    found in the audio can be placed on the same clock the sends are scheduled on.
+
+    Call mark_callback(written, frames, time_info) from the audio callback right after writing the block. It uses
+    the ADC timestamp sounddevice passes in (time_info.inputBufferAdcTime) when the host API provides one, otherwise
+    the callback time less input_latency, the stream's input latency in seconds (sd.InputStream.latency).
+    """
+
+    def __init__(self, sample_rate, input_latency=0.0):
+        self.sample_rate = sample_rate
+        self.input_latency_ns = int(input_latency * 1e9)
+        # (samples written, monotonic_ns when the last of them reached the ADC), replaced in one assignment so readers
+        # never see half of it
+        self._mark = None
+
+    def mark(self, written, now_ns=None):
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        self._mark = (written, now_ns - self.input_latency_ns)
+
+    def mark_callback(self, written, frames, time_info):
+        now_ns = time.monotonic_ns()
+        adc_time, current_time = time_info.inputBufferAdcTime, time_info.currentTime
+        if not (adc_time and current_time):
+            # Some host APIs leave the timestamps at 0
+            self.mark(written, now_ns)
+            return
+        # Both are on the stream's clock, so their difference says how long ago the block's first sample was taken
+        last_sample_age = current_time - adc_time - (frames - 1) / self.sample_rate
+        self._mark = (written, now_ns - int(last_sample_age * 1e9))
+
+    def sample_to_ns(self, sample):
+        # When the sound at stream position `sample` reached the microphone, or None before the first mark
+        mark = self._mark
+        if mark is None:
+            return None
+        written, marked_ns = mark
+        return marked_ns + int((sample - written) * 1e9 / self.sample_rate)
+
+
+class BeatScheduler:
+    """
+    Works out when to send a packet so the bracelets light up on the next beat instead of after it.
+
+    The beat tracker predicts the beats ahead of the audio it has seen. From the moment of the next one this subtracts
+    everything that happens after the send decision: the serial writer's measured submit-to-write latency, the IR
+    transmission of the packet itself (its airtime, bits x PULSE_LENGTH) and BEAT_LEAD_EXTRA from config.py for what
+    can't be measured from here (the Arduino and the bracelets reacting). Capture and analysis time are already
+    behind us by the time a packet is scheduled, so predicting forward cancels them.
+
+    Given the packet, it also allows for the serial writer's pacer holding it back while the previous packet (and the
+    IR_PACKET_GAP after it) is still being transmitted: beats that can't be hit once the transmitter is free are
+    skipped, instead of the packet going out late for them.
+
+    Each beat is only given out once, and beats whose send time has already passed are skipped.
+    """
+
+    def __init__(self, beat_tracker, capture_clock, serial_writer=None, extra_lead=None):
+        self.beat_tracker = beat_tracker
+        self.capture_clock = capture_clock
+        self.serial_writer = serial_writer
+        self.extra_lead = cfg.BEAT_LEAD_EXTRA if extra_lead is None else extra_lead
+        self._last_beat_ns = None
+
+        self.scheduled = 0
+        self.skipped_beats = 0
+
+    def lead_time(self, airtime):
+        # Seconds between submitting a packet and the bracelets having received all of it
+        write_latency = self.serial_writer.write_latency if self.serial_writer is not None else 0.0
+        return write_latency + airtime + self.extra_lead
+
+    def pacer_delay_ns(self, packet, now_ns):
+        # How long the serial writer's pacer would hold the packet if it were submitted at now_ns
+        if packet is None or self.serial_writer is None:
+            return 0
+        return max(self.serial_writer.pacer.next_write_ns(packet) - now_ns, 0)
+
+    def next_send(self, airtime, now_ns=None, packet=None):
+        """
+        Returns (send_ns, beat_ns) on the time.monotonic_ns() clock for the next beat that can still be hit, or None
+        while there's no beat phase or capture mark yet. Pass the packet to also wait out the pacer (see above).
+        """
+        tracker = self.beat_tracker
+        if tracker.last_beat_frame is None:
+            return None
+        last_beat_ns = self.capture_clock.sample_to_ns(tracker.frame_to_sample(tracker.last_beat_frame))
+        if last_beat_ns is None:
+            return None
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        period_ns = tracker.beat_period_samples * 1e9 / tracker.sample_rate
+        lead_ns = int(self.lead_time(airtime) * 1e9)
+        # The packet can't be written before the transmitter is free, whatever the send time
+        earliest_ns = now_ns + self.pacer_delay_ns(packet, now_ns)
+
+        # First beat whose send time is still ahead
+        beats_ahead = max(np.ceil((earliest_ns + lead_ns - last_beat_ns) / period_ns), 0)
+        beat_ns = last_beat_ns + beats_ahead * period_ns
+        # Don't hand out the same beat twice when the phase estimate moves a little between calls
+        if self._last_beat_ns is not None and beat_ns < self._last_beat_ns + period_ns / 2:
+            beat_ns += period_ns
+        if self._last_beat_ns is not None:
+            self.skipped_beats += max(int(round((beat_ns - self._last_beat_ns) / period_ns)) - 1, 0)
+
+        self._last_beat_ns = beat_ns
+        self.scheduled += 1
+        beat_ns = int(beat_ns)
+        return beat_ns - lead_ns, beat_ns
@@ -0,0 +1,181 @@
+import numpy as np
+
+
+def mel_band_weights(n_fft, sample_rate, n_bands=40, fmin=30.0, fmax=None):
+    # (frequency bins, bands) matrix averaging rfft magnitudes into triangular bands evenly spaced on the mel scale,
+    # like librosa's mel filter bank. Bands too narrow to cover a bin at low frequencies are left out.
+    fmax = sample_rate / 2 if fmax is None else fmax
+    mel_edges = np.linspace(*(2595 * np.log10(1 + np.array([fmin, fmax]) / 700)), n_bands + 2)
+    hz_edges = 700 * (10 ** (mel_edges / 2595) - 1)
+    freqs = np.arange(n_fft // 2 + 1) * sample_rate / n_fft
+    lower, centre, upper = hz_edges[:-2, None], hz_edges[1:-1, None], hz_edges[2:, None]
+    weights = np.maximum(0, np.minimum((freqs - lower) / (centre - lower), (upper - freqs) / (upper - centre)))
+    weights = weights[weights.sum(axis=1) > 0]
+    return (weights / weights.sum(axis=1, keepdims=True)).T.astype(np.float32)
+
+
+class OnlineBeatTracker:
+    """
+    Tempo and beat tracker that keeps its state across calls instead of re-running librosa.beat.beat_track on a
+    fraction of a second of audio every loop.
+
+    Feed it new spectrogram frames (from StreamingSTFT) or onset strength values as they're produced:
+    - tempo: a decaying autocorrelation of the onset envelope, updated one value at a time and weighted towards
+      start_bpm the same way librosa's tempo estimate is (log-normal prior, one octave wide)
+    - beat phase: the offset at which a pulse train at that tempo best lines up with the last few seconds of onsets
+
+    Positions are in stream samples (the same count as AudioRingBuffer.written), so asking how long until the next beat
+    is O(1) arithmetic.
+    """
+
+    def __init__(self, sample_rate, hop_length=512, n_fft=2048, min_bpm=60, max_bpm=200, start_bpm=120,
+                 decay_seconds=8.0, history_seconds=6.0, octave_ratio=0.9):
+        self.sample_rate = sample_rate
+        self.hop_length = hop_length
+        # A frame's onset is placed at its centre
+        self.frame_offset = n_fft // 2
+        self.frame_rate = sample_rate / hop_length
+        self.start_bpm = start_bpm
+        self.octave_ratio = octave_ratio
+        self.band_weights = mel_band_weights(n_fft, sample_rate)
+
+        self.lags = np.arange(int(self.frame_rate * 60 / max_bpm), int(np.ceil(self.frame_rate * 60 / min_bpm)) + 1)
+        lag_bpm = 60 * self.frame_rate / self.lags
+        self.prior = np.exp(-0.5 * np.log2(lag_bpm / start_bpm) ** 2)
+        self.autocorrelation = np.zeros(len(self.lags))
+        self.decay = np.exp(-1 / (decay_seconds * self.frame_rate))
+
+        # Mean-removed onset history, stored twice so the newest values are one contiguous slice
+        self.history_length = max(int(history_seconds * self.frame_rate), self.lags[-1] + 1)
+        self._history = np.zeros(2 * self.history_length)
+        self._position = 0
+        self._onset_mean = 0.0
+        self._previous_log_frame = None
+
+        self.frames = 0
+        self.period_frames = self.frame_rate * 60 / start_bpm
+        self.last_beat_frame = None
+
+    # Input
+
+    def update(self, spectrogram_frames):
+        # spectrogram_frames: (frequency bins, new frames) magnitudes. Onset strength is the mean positive change in
+        # log magnitude (spectral flux) from one frame to the next.
+        if spectrogram_frames.shape[1] == 0:
+            return
+        log_frames = np.log1p(spectrogram_frames.T @ self.band_weights)
+        previous = log_frames[0] if self._previous_log_frame is None else self._previous_log_frame
+        flux = np.diff(np.vstack([previous, log_frames]), axis=0)
+        self._previous_log_frame = log_frames[-1].copy()
+        self.push_onsets(np.maximum(flux, 0).mean(axis=1))
+
+    def push_onsets(self, onset_values):
+        for value in onset_values:
+            self._push_onset(float(value))
+        self._estimate_tempo()
+        self._estimate_phase()
+
+    def _push_onset(self, value):
+        self._onset_mean += (value - self._onset_mean) * (1 - self.decay)
+        centred = value - self._onset_mean
+
+        # Autocorrelation at every candidate lag, against the values already in the history
+        end = self._position + self.history_length
+        available = min(self.frames, self.history_length)
+        usable = self.lags <= available
+        if np.any(usable):
+            past = self._history[end - self.lags[usable]]
+            self.autocorrelation *= self.decay
+            self.autocorrelation[usable] += centred * past
+
+        self._history[self._position] = centred
+        self._history[self._position + self.history_length] = centred
+        self._position = (self._position + 1) % self.history_length
+        self.frames += 1
+
+    def _estimate_tempo(self):
+        if self.frames <= self.lags[-1]:
+            return
+        score = np.maximum(self.autocorrelation, 0) * self.prior
+        best = int(np.argmax(score))
+        if score[best] <= 0:
+            return
+        best = self._octave_up(best, score)
+        period = float(self.lags[best])
+        # Parabolic interpolation between neighbouring lags for a sub-frame period
+        if 0 < best < len(score) - 1:
+            left, middle, right = score[best - 1], score[best], score[best + 1]
+            curvature = left - 2 * middle + right
+            if curvature < 0:
+                period += 0.5 * (left - right) / curvature
+        self.period_frames = period
+
+    def _octave_up(self, best, score):
+        # The prior alone can't tell a sparse pattern (a kick on every beat and nothing else) from the same pattern at
+        # half the tempo: lags P and 2P both line up every onset and sit about as far from start_bpm, and a period
+        # that falls between two whole lags splits its peak across both. An off-beat hi-hat also lines up with the
+        # kicks at 1.5P. So a half or two thirds of the chosen lag is taken instead whenever its peak is nearly as
+        # strong (octave_ratio), each measured over the best pair of neighbouring lags. At a genuinely slower tempo
+        # nothing, or only something weaker like that hi-hat, happens at the shorter lag.
+        positive = np.maximum(self.autocorrelation, 0)
+        pairs = positive[:-1] + positive[1:]
+        # Strongest pair including each lag
+        peaks = np.maximum(np.append(pairs, 0), np.insert(pairs, 0, 0))
+        changed = True
+        while changed:
+            changed = False
+            for divisor in (2, 1.5):
+                shorter = int(round(self.lags[best] / divisor)) - self.lags[0]
+                if shorter >= 1 and peaks[shorter] >= self.octave_ratio * peaks[best]:
+                    best = shorter - 1 + int(np.argmax(score[shorter - 1:shorter + 2]))
+                    changed = True
+                    break
+        return best
+
+    def _estimate_phase(self):
+        available = min(self.frames, self.history_length)
+        pulses = int(available // self.period_frames)
+        if pulses < 2:
+            return
+        pulses = min(pulses, 4)
+        period = self.period_frames
+        end = self._position + self.history_length
+        phases = np.arange(int(round(period)))
+        offsets = np.round(np.arange(pulses) * period).astype(int)
+        indexes = end - 1 - (phases[:, None] + offsets[None, :])
+        comb = self._history[indexes].sum(axis=1)
+        self.last_beat_frame = self.frames - 1 - int(phases[np.argmax(comb)])
+
+    # Output
+
+    @property
+    def tempo(self):
+        return 60 * self.frame_rate / self.period_frames
+
+    @property
+    def beat_period_samples(self):
+        return self.period_frames * self.hop_length
+
+    def frame_to_sample(self, frame):
+        return frame * self.hop_length + self.frame_offset
+
+    def next_beat_sample(self, current_sample):
+        # First predicted beat at or after current_sample, or None before there's enough audio to place beats
+        if self.last_beat_frame is None:
+            return None
+        last_beat = self.frame_to_sample(self.last_beat_frame)
+        period = self.beat_period_samples
+        beats_ahead = max(np.ceil((current_sample - last_beat) / period), 0)
+        return last_beat + beats_ahead * period
+
+    def seconds_until_next_beat(self, current_sample, minimum=0.0):
+        # Beats closer than minimum seconds are skipped in favour of the one after. Falls back to one beat period at
+        # the current tempo estimate while the phase is still unknown.
+        period = self.beat_period_samples / self.sample_rate
+        next_beat = self.next_beat_sample(current_sample)
+        if next_beat is None:
+            return max(period, minimum)
+        wait = (next_beat - current_sample) / self.sample_rate
+        if wait < minimum:
+            wait += np.ceil((minimum - wait) / period) * period
+        return wait
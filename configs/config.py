@@ -7,9 +7,50 @@ ARDUINO_SERIAL_PORT = "/dev/cu.usbmodemDC5475C4CA882"  # This will be "COM<some
 # Baud rate of the serial connection set up on the Arduino. It is 115200 in the included sketches.
 ARDUINO_BAUD_RATE = 115200
 
-# Set to True if using a lower power microcontroller (like an Arduino Nano instead of ESP board) and you have issues
+# Set to True if using a lower power microcontroller (like an Arduino Nano instead of ESP board) and you have issues.
+# Packets are then only written once the previous one has finished transmitting, instead of being sent ahead into the
+# Arduino's receive buffer (see tx_pacing.py).
 WAIT_BEFORE_SEND = True
 
+# Size of the Arduino's serial receive buffer in bytes (64 on AVR boards). A packet is only sent ahead while the
+# previous one transmits if it fits.
+ARDUINO_RX_BUFFER = 64
+
+# Seconds of silence left between two IR packets so the bracelets see them as separate commands
+IR_PACKET_GAP = 0.01
+
 # Experimentally determined to be 700 microseconds, now we think it's 694.44. It needs to be an integer for this
 # codebase to function, though, which is why 694 is the default here
 PULSE_LENGTH = 694
+
+# Format of the packets sent over serial. 1 is the ASCII "[<runs>]<run lengths>," format the included sketches
+# understand. 2 is a smaller binary format without the 9-pulse limit (see pixmob_conversion_funcs.py); the sketch on
+# the Arduino has to be updated to parse it before switching.
+SERIAL_PROTOCOL_VERSION = 1
+
+# Append a CRC-8 to version 2 packets so the Arduino can drop corrupted frames
+SERIAL_PROTOCOL_CRC = True
+
+# Where packets are sent: "serial" for the Arduino on ARDUINO_SERIAL_PORT, "fake" for a simulated Arduino on a pseudo
+# terminal that logs every frame it receives, or "null" to discard them. The last two don't need any hardware.
+ARDUINO_TRANSPORT = "serial"
+
+# Seconds the Arduino needs after the serial port is opened (opening it resets the board) before it listens
+ARDUINO_RESET_DELAY = 2.5
+
+# Run the audio analysis in a separate process (main.py), reading the captured audio through shared memory. Uses a
+# second CPU core and keeps heavy analysis from starving the audio callback of the GIL.
+ANALYSIS_IN_WORKER_PROCESS = False
+
+# Seconds to send beat-synced effects early on top of the measured serial latency and the packet's IR airtime, for the
+# time the Arduino and the bracelets take to react (main.py). Raise it if the lights still land after the beat.
+BEAT_LEAD_EXTRA = 0.005
+
+# Record how long each step from audio capture to serial write takes (main.py), printed as p50/p99 every few seconds
+# and written to LATENCY_TRACE_FILE on exit. Off, it costs nothing measurable.
+LATENCY_TRACE = False
+LATENCY_TRACE_FILE = "latency_trace.csv"
+
+# Audio quieter than this RMS (full scale is 1.0) always counts as silence. Above it, the silence gate opens when the
+# sound rises clearly above the noise floor it measures in the room (see silence_gate.py).
+SILENCE_MIN_LEVEL = 0.002
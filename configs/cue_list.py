@@ -0,0 +1,22 @@
+import csv
+
+
+# A cue list is a show worked out ahead of time: (timestamp in seconds, effect name, tail code name or None), sorted
+# by time. Stored as CSV with a "time,effect,tail" header, the tail left empty when there isn't one.
+
+
+def write_cue_list(path, cues):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time", "effect", "tail"])
+        for timestamp, effect, tail_code in cues:
+            writer.writerow([f"{timestamp:.4f}", effect, tail_code or ""])
+
+
+def read_cue_list(path):
+    cues = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            cues.append((float(row["time"]), row["effect"], row["tail"] or None))
+    cues.sort(key=lambda cue: cue[0])
+    return cues
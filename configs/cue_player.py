@@ -0,0 +1,96 @@
+import sys
+import time
+import numpy as np
+from configs.packet_cache import PACKETS, packet_key
+from configs.transport import wait_until_ready
+
+# How long before a deadline to stop sleeping and busy-wait instead. time.sleep can overshoot by around a millisecond
+# on Linux and macOS and by a whole scheduler tick (~15 ms) on Windows, spinning covers the difference.
+SPIN_MARGIN_NS = 16_000_000 if sys.platform == "win32" else 2_000_000
+
+
+def wait_until(deadline_ns, spin_margin_ns=SPIN_MARGIN_NS):
+    # Sleep until shortly before the time.monotonic_ns() deadline, then spin the rest. Returns the time it woke at.
+    remaining = deadline_ns - time.monotonic_ns()
+    if remaining > spin_margin_ns:
+        time.sleep((remaining - spin_margin_ns) / 1e9)
+    now = time.monotonic_ns()
+    while now < deadline_ns:
+        now = time.monotonic_ns()
+    return now
+
+
+class CuePlayer:
+    """
+    Plays a cue list (see cue_list.py) by writing each cue's precompiled packet at its timestamp.
+
+    Every deadline is computed from the moment playback started (start + timestamp), never from the previous cue, so a
+    late cue doesn't push back the ones after it and a show stays on time however long it runs. Cues that are already
+    more than max_late seconds late when their turn comes are skipped rather than sent in a burst.
+
+    After playback, stats() has how late each cue was written: mean, p50, p99 and max in milliseconds. They depend on
+    the machine and what else it's running, so measure on the machine that plays the show. The spin in wait_until holds
+    the GIL: with the fake Arduino (transport.py) its reader thread competes for it from the same process, and a cue
+    can be written up to a thread switch interval (sys.getswitchinterval(), 5 ms by default) late while the reader is
+    decoding the previous packet. The null transport has no thread but is still subject to the OS scheduler.
+    """
+
+    def __init__(self, arduino, cues, max_late=0.25, flush=True, spin_margin_ns=SPIN_MARGIN_NS):
+        self.arduino = arduino
+        self.flush = flush
+        self.max_late_ns = int(max_late * 1e9)
+        self.spin_margin_ns = spin_margin_ns
+
+        # Resolve every cue to its bytes up front, so nothing between waking up and writing has to look anything up
+        self.cues = []
+        self.unknown = []
+        for timestamp, effect, tail_code in cues:
+            key = packet_key(effect, tail_code)
+            if key is None:
+                self.unknown.append((timestamp, effect, tail_code))
+                continue
+            self.cues.append((int(round(timestamp * 1e9)), PACKETS[key], key))
+
+        self.lateness_ns = []
+        self.skipped = 0
+        self._stopping = False
+
+    def stop(self):
+        # Can be called from another thread, playback ends before the next cue
+        self._stopping = True
+
+    def play(self, start_offset=0.0, on_cue=None):
+        """
+        Blocks until the last cue has been written (or stop() is called). start_offset skips into the show by that
+        many seconds. on_cue(key, lateness in seconds) is called after every write, keep it quick.
+        """
+        wait_until_ready(self.arduino)
+        offset_ns = int(start_offset * 1e9)
+        start_ns = time.monotonic_ns() - offset_ns
+        for cue_ns, packet, key in self.cues:
+            if cue_ns < offset_ns:
+                continue
+            if self._stopping:
+                break
+            deadline = start_ns + cue_ns
+            if time.monotonic_ns() - deadline > self.max_late_ns:
+                self.skipped += 1
+                continue
+
+            wait_until(deadline, self.spin_margin_ns)
+            self.arduino.write(packet)
+            if self.flush:
+                self.arduino.flush()
+            lateness = time.monotonic_ns() - deadline
+            self.lateness_ns.append(lateness)
+            if on_cue is not None:
+                on_cue(key, lateness / 1e9)
+
+    def stats(self):
+        lateness = np.array(self.lateness_ns, dtype=np.float64) / 1e6
+        stats = {"played": len(lateness), "skipped": self.skipped, "unknown": len(self.unknown)}
+        if len(lateness):
+            p50, p99 = np.percentile(lateness, [50, 99])
+            stats.update({"mean_ms": float(lateness.mean()), "p50_ms": float(p50), "p99_ms": float(p99),
+                          "max_ms": float(lateness.max())})
+        return stats
@@ -0,0 +1,265 @@
+import difflib
+import re
+from collections import namedtuple
+from configs.effect_table import DEFINITIONS_PATH
+from configs.packet_cache import PACKETS, EFFECTS
+
+
+# Lookup tables over every effect we can send, built once at import time from the effect table and the comments in
+# effect_definitions.py, so the analyzers can pick "a dim red effect for old bracelets that takes a fade tail" with a
+# dictionary lookup instead of keeping their own hand written lists.
+#
+# Every name in the index has a compiled packet (see packet_cache.py). Effects whose bits don't fit the serial format
+# are left out, so anything picked from the index is guaranteed to be sent.
+#
+# The scripts still name a few effects themselves. Pass those lists through checked_effects() / checked_tails() when
+# they're defined: unknown names are reported (with the closest real name), and so are names that are defined but have
+# no packet. Both are dropped at startup, instead of send_effect() quietly skipping them and wasting the beat.
+
+# name:          effect name
+# kind:          "base" (takes tail codes) or "special"
+# family:        main color (see FAMILIES), "multi" for effects going from one color to another, "random" for random
+#                colors or unknown behaviour (the WEIRD_ effects), None when the name doesn't say
+# generation:    "old" or "new" for effects that only work on older or newer bracelets, "both" otherwise
+# brightness:    "dim", "normal" or "bright"
+# tails:         tail codes that can be sent with it, as a tuple (empty for special effects)
+# long_duration: True for effects known to stay on for several seconds
+# note:          comments from effect_definitions.py about the effect
+EffectInfo = namedtuple("EffectInfo", "name kind family generation brightness tails long_duration note")
+
+FAMILIES = ("red", "orange", "yellow", "green", "turquoise", "blue", "magenta", "pink", "white")
+
+# Name token (without trailing digits) -> color family. Compound names are listed as their dominant color.
+_COLOR_TOKENS = {
+    "RED": "red",
+    "REDORANGE": "orange", "ORANGE": "orange", "YELLOWORANGE": "orange",
+    "YELLOW": "yellow",
+    "GREEN": "green", "YELLOWGREEN": "green", "GREENISH": "green", "GREENBRIGHT": "green",
+    "TURQUOISE": "turquoise",
+    "BLUE": "blue",
+    "MAGENTA": "magenta", "PURPLE": "magenta",
+    "PINK": "pink",
+    "WHITE": "white", "WHITISH": "white", "WHITEISH": "white",
+}
+_RANDOM_TOKENS = {"RANDOM", "RAINBOW", "WEIRD", "PRESET"}
+_TRANSITION_TOKENS = {"THEN", "TO"}
+
+# A note saying the effect lasts this many seconds or more counts as long
+LONG_DURATION_SECONDS = 5
+_LONG_NOTE = re.compile(r"\blong(er)?\b(?! as)", re.IGNORECASE)
+_SECONDS_NOTE = re.compile(r"(\d+(?:\.\d+)?)\s*s(?:ec)?\b", re.IGNORECASE)
+
+
+def _tokens(name):
+    # "OLD_DIM_RED_BLINK_2" -> ["OLD", "DIM", "RED", "BLINK"], "VSTYLE_GREENISH2_IO1" -> [..., "GREENISH", "IO"]
+    return [token.rstrip("0123456789") for token in name.split("_")]
+
+
+def effect_family(name):
+    tokens = _tokens(name)
+    if _RANDOM_TOKENS.intersection(tokens):
+        return "random"
+    families = [_COLOR_TOKENS[token] for token in tokens if token in _COLOR_TOKENS]
+    if not families:
+        return None
+    if _TRANSITION_TOKENS.intersection(tokens) and "OFF" not in tokens:
+        return "multi"
+    # "Whitish blue" is a blue, white only counts when it's the only color named
+    distinct = list(dict.fromkeys(family for family in families if family != "white")) or ["white"]
+    return distinct[0] if len(distinct) == 1 else "multi"
+
+
+def effect_generation(name):
+    tokens = _tokens(name)
+    if "OLD" in tokens:
+        return "old"
+    if "NEW" in tokens:
+        return "new"
+    return "both"
+
+
+def effect_brightness(name):
+    tokens = _tokens(name)
+    if "DIM" in tokens:
+        return "dim"
+    if "BRIGHT" in tokens or any(token.endswith("BRIGHT") for token in tokens):
+        return "bright"
+    return "normal"
+
+
+def is_long_duration(name, note):
+    tokens = _tokens(name)
+    if "LONG" in tokens or ("VERY" in tokens and "SLOW" in tokens) or "60SEC" in name:
+        return True
+    if _LONG_NOTE.search(note):
+        return True
+    return any(float(seconds) >= LONG_DURATION_SECONDS for seconds in _SECONDS_NOTE.findall(note))
+
+
+_TABLE_START = re.compile(r"^(\w+)\s*=\s*\{")
+_ENTRY_START = re.compile(r"^\s*\"(\w+)\"\s*:")
+_COMMENT = re.compile(r"^([^#]*)#\s*(.*?)\s*$")
+
+
+def read_definition_notes(path=DEFINITIONS_PATH):
+    """
+    Comments attached to each effect in effect_definitions.py: the comment at the end of its entry, and a comment on
+    the line right above it. {(table name, effect name): "comment; comment"}, empty if the source isn't there.
+    Reads the file line by line rather than tokenizing it, the tables only hold lists of bits so nothing else can
+    contain a #.
+    """
+    notes = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return notes
+
+    table = None
+    key = None  # Entry being read
+    pending = None  # Comment on the line before
+    for line in lines:
+        match = _TABLE_START.match(line)
+        if match:
+            table, key, pending = match.group(1), None, None
+            continue
+        if table is None:
+            continue
+        if line.startswith("}"):
+            table = key = pending = None
+            continue
+        match = _ENTRY_START.match(line)
+        if match:
+            key = (table, match.group(1))
+            if pending:
+                notes.setdefault(key, []).append(pending)
+        comment = _COMMENT.match(line)
+        if comment and comment.group(1).strip():
+            # At the end of a line of code, belongs to the entry being read
+            if key is not None:
+                notes.setdefault(key, []).append(comment.group(2))
+            pending = None
+        elif comment and not comment.group(2).endswith(":"):
+            pending = comment.group(2)
+        else:
+            # Headings like "# May impact future effects:" describe a whole group, not the entry below them
+            pending = None
+    return {key: "; ".join(texts) for key, texts in notes.items()}
+
+
+class EffectIndex:
+    """
+    Every sendable effect grouped by color family, bracelet generation, brightness and tail code, with all the groups
+    built up front. Lookups return tuples, ready for random.choice().
+    """
+
+    def __init__(self, effects=None, packets=None, notes=None):
+        # The table packet_cache already mapped, rather than mapping and checking it again
+        effects = EFFECTS if effects is None else effects
+        packets = PACKETS if packets is None else packets
+        notes = read_definition_notes() if notes is None else notes
+
+        self.tail_codes = tuple(effects.tail_codes)
+        self.info = {}
+        # Same order as the effect table, base color effects win for names in both tables like packet_cache does
+        for kind, table_name in (("base", "base_color_effects"), ("special", "special_effects")):
+            for name in getattr(effects, table_name):
+                if name in self.info or (name, None) not in packets:
+                    continue
+                tails = tuple(tail for tail in self.tail_codes if (name, tail) in packets) if kind == "base" else ()
+                note = notes.get((table_name, name), "")
+                self.info[name] = EffectInfo(name, kind, effect_family(name), effect_generation(name),
+                                             effect_brightness(name), tails, is_long_duration(name, note), note)
+
+        self.sendable = tuple(self.info)
+        # Defined in the effect table but left out above for not having a packet
+        self.unsendable = frozenset(name for table_name in ("base_color_effects", "special_effects")
+                                    for name in getattr(effects, table_name) if name not in self.info)
+        self._order = {name: i for i, name in enumerate(self.sendable)}
+        self.by_family = self._group(lambda info: info.family)
+        self.by_generation = self._group(lambda info: info.generation)
+        self.by_brightness = self._group(lambda info: info.brightness)
+        self.long_duration = tuple(name for name, info in self.info.items() if info.long_duration)
+        # Tail code -> effects it can be sent with
+        self.effects_for_tail = {tail: tuple(name for name, info in self.info.items() if tail in info.tails)
+                                 for tail in self.tail_codes}
+        # Sets of the groups above for select(), and its results so far
+        self._family_sets = {family: frozenset(names) for family, names in self.by_family.items()}
+        self._generation_sets = {generation: frozenset(names + self.by_generation.get("both", ()))
+                                 for generation, names in self.by_generation.items()}
+        self._brightness_sets = {brightness: frozenset(names) for brightness, names in self.by_brightness.items()}
+        self._tail_sets = {tail: frozenset(names) for tail, names in self.effects_for_tail.items()}
+        long_duration = frozenset(self.long_duration)
+        self._long_duration_sets = {True: long_duration, False: frozenset(self.info) - long_duration}
+        self._selections = {}
+
+    def _group(self, key):
+        groups = {}
+        for name, info in self.info.items():
+            groups.setdefault(key(info), []).append(name)
+        return {value: tuple(names) for value, names in groups.items()}
+
+    def tails_for(self, name):
+        info = self.info.get(name)
+        return info.tails if info is not None else ()
+
+    def select(self, family=None, generation=None, brightness=None, tail=None, long_duration=None):
+        """
+        Effects matching every given criterion, e.g. select("red", brightness="dim", tail="FADE_2"), in table order.
+        generation="old" also includes effects that work on both generations. Intersects the groups built up front
+        instead of scanning every effect, and results are kept, so calling this from the analysis loop is a lookup
+        after the first time.
+        """
+        criteria = (family, generation, brightness, tail, long_duration)
+        names = self._selections.get(criteria)
+        if names is not None:
+            return names
+        groups = [sets.get(value, frozenset()) for sets, value in (
+            (self._family_sets, family), (self._generation_sets, generation), (self._brightness_sets, brightness),
+            (self._tail_sets, tail), (self._long_duration_sets, long_duration)) if value is not None]
+        if groups:
+            matches = frozenset.intersection(*sorted(groups, key=len))
+            names = tuple(sorted(matches, key=self._order.get))
+        else:
+            names = self.sendable
+        self._selections[criteria] = names
+        return names
+
+    def checked_effects(self, names, where="", fallback=None):
+        """
+        The names that can be sent, in order. Unknown ones are reported and left out. If none are left, fallback (a
+        list of names, checked the same way) is used instead. Raises ValueError if that doesn't leave anything either.
+        """
+        return self._checked(names, self.info, "effect", where, fallback, self.unsendable)
+
+    def checked_tails(self, names, where="", fallback=None):
+        # Same as checked_effects for tail codes. None (no tail) is always valid.
+        return self._checked(names, set(self.tail_codes) | {None}, "tail code", where, fallback)
+
+    def _checked(self, names, valid, what, where, fallback, unsendable=frozenset()):
+        checked = []
+        for name in names:
+            if name in valid:
+                checked.append(name)
+                continue
+            if name in unsendable:
+                # Spelled right, so don't suggest another name
+                print(f"Warning: {where + ': ' if where else ''}{name} has no packet, its bits don't fit the serial "
+                      f"format")
+                continue
+            close = difflib.get_close_matches(str(name), [v for v in valid if v is not None], n=1)
+            print(f"Warning: {where + ': ' if where else ''}{name} isn't a known {what}"
+                  f"{', did you mean ' + close[0] + '?' if close else ''}")
+        if not checked and fallback is not None:
+            return self._checked(fallback, valid, what, where, None, unsendable)
+        if not checked:
+            raise ValueError(f"{where + ': ' if where else ''}none of {list(names)} can be sent")
+        return tuple(checked)
+
+
+EFFECT_INDEX = EffectIndex()
+# Tails the analyzers pick for high contrast: none, a hard cut instead of a fade. They used to list SLOW_WHITE,
+# SLOW_TURQUOISE, SLOW_ORANGE and SLOW_YELLOW, which are effects rather than tail codes, so no tail was sent anyway.
+STROBE_TAILS = (None,)
+checked_effects = EFFECT_INDEX.checked_effects
+checked_tails = EFFECT_INDEX.checked_tails
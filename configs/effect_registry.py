@@ -0,0 +1,123 @@
+from configs.effect_table import TABLE_NAMES
+from configs.packet import Packet
+from configs.packet_cache import EFFECTS
+
+
+# Every effect and tail code keyed by its bits, for going from bits back to names: naming the packets a capture or the
+# emulator decoded, and finding effects that are the same command under different names (RED_2, RED_5 and
+# REDORANGE_3 are identical, for example).
+#
+# The key is the bits packed into one integer behind a leading 1 (Packet.key), so [0, 1] and [1] get different keys.
+# Hashing an int is a single cached operation, unlike hashing a 39 element list, and effects with the same bits share
+# one interned Packet.
+#
+# A captured packet is either an effect on its own or a base color effect followed by a tail code. decode() tries the
+# whole packet and then every tail code length, so it's a handful of dictionary lookups whatever the table size.
+
+
+def bits_key(bits):
+    # Example: [1, 0, 1] -> 0b1101. Takes a bit list or a Packet.
+    if isinstance(bits, Packet):
+        return bits.key
+    return int("1" + "".join("1" if bit else "0" for bit in bits), 2)
+
+
+def key_bits(key):
+    # Inverse of bits_key
+    return Packet.from_key(key).bits()
+
+
+class EffectRegistry:
+    def __init__(self, effects=None):
+        # The table packet_cache already mapped, rather than mapping and checking it again
+        effects = EFFECTS if effects is None else effects
+        # key -> interned Packet, and key -> [(table name, effect name)] in definition order
+        self._patterns = {}
+        self._entries = {}
+        # (table name, effect name) -> key
+        self._keys = {}
+        self._tail_lengths = set()
+        for table_name in TABLE_NAMES:
+            table = getattr(effects, table_name)
+            for name in table:
+                self._add(table_name, name, table.packet(name))
+        self.tail_lengths = tuple(sorted(self._tail_lengths))
+
+    def _add(self, table_name, name, packet):
+        key = packet.key
+        self._patterns.setdefault(key, packet)
+        self._entries.setdefault(key, []).append((table_name, name))
+        self._keys[(table_name, name)] = key
+        if table_name == "tail_codes":
+            self._tail_lengths.add(len(packet))
+
+    def key(self, name, table_name=None):
+        # Key of an effect's bits. Without a table the base color version wins, like packet_cache.
+        if table_name is not None:
+            return self._keys.get((table_name, name))
+        for table_name in TABLE_NAMES:
+            key = self._keys.get((table_name, name))
+            if key is not None:
+                return key
+        return None
+
+    def packet(self, name, table_name=None):
+        # The effect as a Packet shared with every effect that has the same bits, None if unknown
+        key = self.key(name, table_name)
+        return self._patterns[key] if key is not None else None
+
+    def entries(self, bits):
+        # Every (table name, effect name) with exactly these bits. Takes a bit list, a Packet or a key from bits_key.
+        key = bits if isinstance(bits, int) else bits_key(bits)
+        return tuple(self._entries.get(key, ()))
+
+    def names(self, bits):
+        return tuple(name for _, name in self.entries(bits))
+
+    def decode(self, bits):
+        """
+        Name a complete packet: (effect name, tail code name), with a tail of None when there isn't one. Effects come
+        before tail codes and base colors before special effects when several names match. None if nothing does.
+        """
+        key = bits if isinstance(bits, int) else bits_key(bits)
+        for table_name, name in self._entries.get(key, ()):
+            if table_name != "tail_codes":
+                return name, None
+
+        length = key.bit_length() - 1
+        for tail_length in self.tail_lengths:
+            if length <= tail_length:
+                continue
+            # Split the key itself: the top bits are the head's key, the low bits plus a leading 1 the tail's
+            head = self._entries.get(key >> tail_length, ())
+            tail = self._entries.get((1 << tail_length) | (key & ((1 << tail_length) - 1)), ())
+            bases = [name for table_name, name in head if table_name == "base_color_effects"]
+            tails = [name for table_name, name in tail if table_name == "tail_codes"]
+            if bases and tails:
+                return bases[0], tails[0]
+        return None
+
+    def aliases(self):
+        # {first name: (other names with the same bits)} for every pattern defined more than once
+        aliases = {}
+        for entries in self._entries.values():
+            if len(entries) > 1:
+                aliases[entries[0][1]] = tuple(name for _, name in entries[1:])
+        return aliases
+
+    def alias_report(self):
+        lines = [f"{len(self._keys)} definitions, {len(self._patterns)} distinct bit patterns"]
+        for key, entries in self._entries.items():
+            if len(entries) > 1:
+                lines.append(f"{key.bit_length() - 1:>4} bits: " + ", ".join(name for _, name in entries))
+        return "\n".join(lines)
+
+    def __len__(self):
+        return len(self._patterns)
+
+
+EFFECT_REGISTRY = EffectRegistry()
+
+
+if __name__ == "__main__":
+    print(EFFECT_REGISTRY.alias_report())
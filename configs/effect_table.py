@@ -0,0 +1,183 @@
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
+from configs.packet import Packet
+
+
+# This file compiles the effect tables from effect_definitions.py into a compact binary file that can be memory mapped
+# at startup instead of importing ~700 lines of nested lists. effect_definitions.py stays the source of truth: the
+# compiled file records the size and modification time of the .py it was built from and gets rebuilt when they change.
+#
+# Build it ahead of time with:
+#     python -m configs.effect_table
+#
+# File layout (all integers little endian):
+#     header:   magic "PXMT", format version (u16), entry count (u32), source size (u64), source mtime in ns (u64)
+#     entries:  one per effect, in definition order:
+#               table (u8), bit count (u16), name length (u8), name offset (u32), bits offset (u32)
+#     names:    all effect names, UTF-8, back to back
+#     bits:     each effect's bits packed 8 per byte, most significant bit first, padded with zeroes to a whole byte.
+#               Entries with identical bits share one copy.
+
+MAGIC = b"PXMT"
+FORMAT_VERSION = 1
+TABLE_NAMES = ("base_color_effects", "tail_codes", "special_effects")
+
+DEFINITIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "effect_definitions.py")
+COMPILED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "effect_definitions.bin")
+
+_HEADER = struct.Struct("<4sHIQQ")
+_ENTRY = struct.Struct("<BHBII")
+
+
+def _source_stamp(source_path):
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _pack_bits(bit_list):
+    # Example: [1, 0, 1] -> b"\xa0"
+    if not bit_list:
+        return b""
+    n_bytes = (len(bit_list) + 7) // 8
+    value = int("".join(str(bit) for bit in bit_list), 2) << (n_bytes * 8 - len(bit_list))
+    return value.to_bytes(n_bytes, "big")
+
+
+def _unpack_bits(data, bit_count):
+    # Inverse of _pack_bits
+    if not bit_count:
+        return []
+    binary = format(int.from_bytes(data, "big"), f"0{len(data) * 8}b")
+    return [1 if char == "1" else 0 for char in binary[:bit_count]]
+
+
+def build_table_bytes(tables, source_stamp=(0, 0)):
+    # tables is a sequence of dicts in the same order as TABLE_NAMES
+    entries = []
+    names = bytearray()
+    bits = bytearray()
+    # Effects with identical bits point at the same bytes (a few dozen entries are duplicates of another one)
+    bits_offsets = {}
+    for table_id, table in enumerate(tables):
+        for name, bit_list in table.items():
+            encoded_name = name.encode("utf-8")
+            packed = (len(bit_list), _pack_bits(bit_list))
+            offset = bits_offsets.get(packed)
+            if offset is None:
+                offset = bits_offsets[packed] = len(bits)
+                bits += packed[1]
+            entries.append(_ENTRY.pack(table_id, len(bit_list), len(encoded_name), len(names), offset))
+            names += encoded_name
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(entries), *source_stamp)
+    return header + b"".join(entries) + bytes(names) + bytes(bits)
+
+
+def compile_effect_table(output_path=COMPILED_PATH, source_path=DEFINITIONS_PATH):
+    # Importing here on purpose, the whole point of the compiled file is to not need this at runtime
+    from configs import effect_definitions
+    data = build_table_bytes([getattr(effect_definitions, table) for table in TABLE_NAMES], _source_stamp(source_path))
+    # A temp file of its own (two entry points, or main.py and its analysis worker, can rebuild a stale table at the
+    # same time), then replaced atomically so a controller starting at the same moment never maps a half written file
+    fd, temp_path = tempfile.mkstemp(prefix=".effect_table.", suffix=".tmp", dir=os.path.dirname(output_path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp makes the file readable by its owner only
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return output_path
+
+
+class EffectTable(Mapping):
+    """
+    One of the compiled tables (base_color_effects, tail_codes or special_effects), readable like the original dict.
+    Bits are decoded from the packed data each time an effect is looked up, nothing is decoded up front.
+    """
+
+    def __init__(self, data, entries):
+        self._data = data
+        # name -> (bit count, bits offset)
+        self._entries = entries
+
+    def __getitem__(self, name):
+        bit_count, offset = self._entries[name]
+        return _unpack_bits(self._data[offset:offset + (bit_count + 7) // 8], bit_count)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bit_count(self, name):
+        return self._entries[name][0]
+
+    def packet(self, name):
+        # The effect as a Packet, read straight from the packed bytes without making a bit list
+        bit_count, offset = self._entries[name]
+        n_bytes = (bit_count + 7) // 8
+        value = int.from_bytes(self._data[offset:offset + n_bytes], "big") >> (n_bytes * 8 - bit_count)
+        return Packet(value, bit_count)
+
+
+class CompiledEffects:
+    # All three tables from one compiled buffer (a memory map, or bytes when the file couldn't be used)
+
+    def __init__(self, data):
+        magic, version, entry_count, source_size, source_mtime = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"Not a compiled effect table (format version {FORMAT_VERSION})")
+        self.data = data
+        self.source_stamp = (source_size, source_mtime)
+
+        names_start = _HEADER.size + entry_count * _ENTRY.size
+        raw_entries = list(_ENTRY.iter_unpack(data[_HEADER.size:names_start]))
+        bits_start = names_start + sum(entry[2] for entry in raw_entries)
+
+        tables = [{} for _ in TABLE_NAMES]
+        for table_id, bit_count, name_length, name_offset, bits_offset in raw_entries:
+            name = bytes(data[names_start + name_offset:names_start + name_offset + name_length]).decode("utf-8")
+            tables[table_id][name] = (bit_count, bits_start + bits_offset)
+        for table_name, entries in zip(TABLE_NAMES, tables):
+            setattr(self, table_name, EffectTable(data, entries))
+
+
+def _map_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_effect_table(path=COMPILED_PATH, source_path=DEFINITIONS_PATH):
+    """
+    Memory map the compiled effect table, compiling it first if it's missing or older than effect_definitions.py.
+    If the file can't be written (read-only install, for example) the table is built in memory instead.
+    """
+    try:
+        effects = CompiledEffects(_map_file(path))
+        if effects.source_stamp == _source_stamp(source_path):
+            return effects
+    except (OSError, ValueError, struct.error):
+        pass
+
+    try:
+        return CompiledEffects(_map_file(compile_effect_table(path, source_path)))
+    except OSError:
+        from configs import effect_definitions
+        tables = [getattr(effect_definitions, table) for table in TABLE_NAMES]
+        return CompiledEffects(build_table_bytes(tables, _source_stamp(source_path)))
+
+
+if __name__ == "__main__":
+    print(f"Compiled effect table written to {compile_effect_table()}")
@@ -0,0 +1,300 @@
+import argparse
+import re
+from collections import Counter, namedtuple
+import numpy as np
+from configs import config as cfg
+from configs.effect_registry import EFFECT_REGISTRY
+
+
+# Decoder for IR timing captures: what a logic analyser or an IR receiver sketch recorded while the bracelets'
+# transmitter (or a show) was running. Captures can run to millions of edges, so they are read and decoded a chunk at
+# a time and packets come out of a generator as they complete. Memory stays the same whatever the capture length.
+#
+# Accepted formats:
+# - raw:  microsecond durations separated by whitespace, commas or semicolons, alternating IR on / IR off starting
+#         with on. Signed durations ("+694 -2082", as many receiver sketches print them) give the level explicitly.
+# - CSV:  a header row, then either a duration column ("duration", "duration_us", "us") or a timestamp column ("time",
+#         "timestamp", "time [s]" from logic analyser exports) with the time of each edge. An optional "level",
+#         "state", "value" or "channel" column gives the IR level from that edge on.
+#
+# Packets are split on the silence between them. Inside an effect IR is never off for more than 5 pulses, and the
+# separator between commands (SEPARATOR_BITS in packet_cache.py) is off for 9, so anything off for GAP_PULSES or more
+# ends a packet.
+#
+# Runs that aren't close to a whole number of pulses are counted as timing errors and rounded anyway, rather than
+# raising like run_lengths_to_bits does, so one noisy edge only spoils the packet it's in.
+
+GAP_PULSES = 7
+# Largest distance from a whole number of pulses that doesn't count as a timing error, as a fraction of a pulse.
+# IR receivers stretch the on time and shorten the off time by up to ~100 us, so this is looser than you might expect.
+TIMING_TOLERANCE = 0.3
+# Longest run of the same bit in any packet
+MAX_RUN_PULSES = 9
+# Packets longer than this are noise (IR never switched off for long enough), they're cut here and counted as overlong
+MAX_PACKET_PULSES = 4096
+
+# start_us:      capture time of the packet's first edge, in microseconds
+# key:           the packet's bits packed like effect_registry.bits_key (see key_bits to unpack them)
+# effect, tail:  names from the effect registry, both None for packets that aren't a known effect
+# timing_errors: runs in the packet that were out of tolerance
+CapturedPacket = namedtuple("CapturedPacket", "start_us key effect tail timing_errors")
+
+_UNITS = {"s": 1e6, "ms": 1e3, "us": 1.0, "µs": 1.0, "ns": 1e-3}
+_DURATION_COLUMNS = ("duration", "duration_us", "us", "length")
+_TIME_COLUMNS = ("time", "time_us", "timestamp", "timestamp_us", "t")
+_LEVEL_COLUMNS = ("level", "state", "value", "channel", "channel 0")
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def _column(header, candidates):
+    # Index and unit multiplier of the first column named like one of the candidates, "time [s]" style units allowed
+    for i, name in enumerate(header):
+        match = re.fullmatch(r"\s*([^\[(]*?)\s*(?:[\[(]\s*(\w+)\s*[\])])?\s*", name.lower())
+        if match and match.group(1) in candidates:
+            return i, _UNITS.get(match.group(2) or "us", 1.0)
+    return None, None
+
+
+def read_capture(path, chunk_lines=65536, active_low=False):
+    """
+    Yield the capture as (durations in microseconds, levels) numpy arrays of up to chunk_lines runs each. levels is
+    1 for IR on and 0 for off, or None when the capture doesn't say and they alternate. active_low is for captures
+    of an IR receiver's output, which is low while IR is on.
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        first = ""
+        while not first.strip() or first.lstrip().startswith("#"):
+            first = f.readline()
+            if not first:
+                return
+        if re.search(r"[a-zA-Z]", first):
+            yield from _read_csv(f, first, chunk_lines, active_low)
+        else:
+            yield from _read_raw(f, first, chunk_lines, active_low)
+
+
+def _read_raw(f, first, chunk_lines, active_low):
+    signed = "-" in first or "+" in first
+    pending = [first]
+    while True:
+        lines = f.readlines(chunk_lines * 8) if pending is None else pending
+        pending = None
+        if not lines:
+            return
+        tokens = [token for line in lines if not line.lstrip().startswith("#")
+                  for token in _SEPARATORS.split(line) if token]
+        if not tokens:
+            continue
+        values = np.array(tokens, dtype=np.float64)
+        durations = np.abs(values)
+        levels = None
+        if signed:
+            levels = (values > 0).astype(np.int8)
+            if active_low:
+                levels = 1 - levels
+        yield durations, levels
+
+
+def _read_csv(f, header_line, chunk_lines, active_low):
+    header = [name.strip() for name in header_line.strip().split(",")]
+    duration_index, duration_unit = _column(header, _DURATION_COLUMNS)
+    time_index, time_unit = _column(header, _TIME_COLUMNS)
+    level_index, _ = _column(header, _LEVEL_COLUMNS)
+    if duration_index is None and time_index is None:
+        raise ValueError(f"No duration or time column in {header}")
+
+    last_time = None
+    last_level = None
+    while True:
+        lines = f.readlines(chunk_lines * 16)
+        if not lines:
+            return
+        rows = [line.split(",") for line in lines if line.strip() and not line.lstrip().startswith("#")]
+        if not rows:
+            continue
+        levels = None
+        if level_index is not None:
+            levels = np.array([float(row[level_index]) for row in rows]) > 0
+            levels = (levels != active_low).astype(np.int8)
+        if duration_index is not None:
+            yield np.array([float(row[duration_index]) for row in rows]) * duration_unit, levels
+            continue
+
+        # Timestamps of edges: each run lasts until the next edge, and takes the level set at its start
+        times = np.array([float(row[time_index]) for row in rows]) * time_unit
+        if last_time is not None:
+            times = np.concatenate(([last_time], times))
+            if levels is not None:
+                levels = np.concatenate(([last_level], levels))
+        last_time = times[-1]
+        if levels is not None:
+            last_level = levels[-1]
+            levels = levels[:-1]
+        yield np.diff(times), levels
+
+
+class CaptureDecoder:
+    """
+    Turns runs into packets. feed() takes one chunk of (durations, levels) and returns the packets completed in it, the
+    unfinished packet at the end of a chunk is carried over to the next one. Call finish() after the last chunk.
+    """
+
+    def __init__(self, pulse_length=cfg.PULSE_LENGTH, tolerance=TIMING_TOLERANCE, gap_pulses=GAP_PULSES,
+                 max_packet_pulses=MAX_PACKET_PULSES, registry=EFFECT_REGISTRY):
+        self.pulse_length = pulse_length
+        self.tolerance = tolerance
+        self.gap_us = (gap_pulses - 0.5) * pulse_length
+        # Nothing in a packet lasts longer than 9 pulses, on or off (the limit of the version 1 serial format)
+        self.resync_us = (MAX_RUN_PULSES + 0.5) * pulse_length
+        self.max_packet_pulses = max_packet_pulses
+        self.registry = registry
+
+        # Unfinished packet: lists of (levels, pulses) array pieces, its start time and timing errors so far
+        self._pieces = []
+        self._pending_pulses = 0
+        self._start_us = None
+        self._errors = 0
+        # Level of the next run when the capture doesn't give levels
+        self._next_level = 1
+        self._time_us = 0.0
+
+        self.runs = 0
+        self.timing_errors = 0
+        self.level_errors = 0
+        self.packets = 0
+        self.unknown_packets = 0
+        self.overlong_packets = 0
+        self.damaged_packets = 0
+
+    def feed(self, durations, levels=None):
+        durations = np.asarray(durations, dtype=np.float64)
+        count = len(durations)
+        if not count:
+            return []
+        self.runs += count
+        long_runs = durations >= self.gap_us
+        if levels is None:
+            levels = self._infer_levels(durations >= self.resync_us)
+        else:
+            levels = np.asarray(levels, dtype=np.int8)
+            self.level_errors += int(np.count_nonzero(levels[1:] == levels[:-1]))
+        gaps = long_runs & (levels == 0)
+
+        pulses = np.rint(durations / self.pulse_length).astype(np.int64)
+        bad = (np.abs(durations - pulses * self.pulse_length) > self.tolerance * self.pulse_length) | (pulses == 0)
+        bad &= ~gaps
+        self.timing_errors += int(np.count_nonzero(bad))
+        starts = self._time_us + np.concatenate(([0.0], np.cumsum(durations[:-1])))
+        self._time_us += float(durations.sum())
+
+        packets = []
+        start = 0
+        for gap in np.flatnonzero(gaps):
+            self._add(levels, pulses, bad, starts, start, gap, packets)
+            self._emit(packets)
+            start = gap + 1
+        self._add(levels, pulses, bad, starts, start, count, packets)
+        return packets
+
+    def finish(self):
+        # The packet still open at the end of the capture
+        packets = []
+        self._emit(packets)
+        return packets
+
+    def _infer_levels(self, long_runs):
+        # Alternating on/off. A run longer than any in a packet can only be the silence between packets, so it's off
+        # and the run after it on, which resynchronises the levels after a glitch.
+        index = np.arange(len(long_runs))
+        last_long = np.maximum.accumulate(np.where(long_runs, index, -1))
+        levels = np.where(last_long >= 0, (index - last_long) % 2, (index + self._next_level) % 2)
+        levels[long_runs] = 0
+        levels = levels.astype(np.int8)
+        self._next_level = 1 - int(levels[-1])
+        return levels
+
+    def _add(self, levels, pulses, bad, starts, start, end, packets):
+        if end <= start:
+            return
+        if self._start_us is None:
+            # Packets start when IR switches on, drop leading off time
+            on = np.flatnonzero(levels[start:end])
+            if not len(on):
+                return
+            start += int(on[0])
+            self._start_us = float(starts[start])
+        self._pieces.append((levels[start:end], pulses[start:end]))
+        self._pending_pulses += int(pulses[start:end].sum())
+        self._errors += int(np.count_nonzero(bad[start:end]))
+        if self._pending_pulses > self.max_packet_pulses:
+            self.overlong_packets += 1
+            self._reset()
+
+    def _emit(self, packets):
+        if not self._pieces:
+            return
+        levels = np.concatenate([piece[0] for piece in self._pieces])
+        pulses = np.concatenate([piece[1] for piece in self._pieces])
+        bits = np.repeat(levels, pulses).astype(np.uint8)
+        # Trailing off time isn't part of the packet
+        on = np.flatnonzero(bits)
+        bits = bits[:on[-1] + 1] if len(on) else bits[:0]
+        if len(bits):
+            key = int(b"1" + (bits + 48).tobytes(), 2)
+            decoded = self.registry.decode(key)
+            if decoded is None and len(bits) > 1 and bits[-2]:
+                # Commands sent as one sequence end in the separator's first bit, try without it
+                decoded = self.registry.decode(key >> 1)
+            effect, tail_code = decoded or (None, None)
+            self.packets += 1
+            self.unknown_packets += decoded is None
+            self.damaged_packets += self._errors > 0
+            packets.append(CapturedPacket(self._start_us, key, effect, tail_code, self._errors))
+        self._reset()
+
+    def _reset(self):
+        self._pieces = []
+        self._pending_pulses = 0
+        self._start_us = None
+        self._errors = 0
+
+    def stats(self):
+        return {"runs": self.runs, "packets": self.packets, "unknown_packets": self.unknown_packets,
+                "damaged_packets": self.damaged_packets, "overlong_packets": self.overlong_packets,
+                "timing_errors": self.timing_errors, "level_errors": self.level_errors}
+
+
+def decode_capture(path, decoder=None, chunk_lines=65536, active_low=False):
+    # Generator of CapturedPacket for a whole capture file. Pass a decoder in to read its stats() afterwards.
+    decoder = decoder or CaptureDecoder()
+    for durations, levels in read_capture(path, chunk_lines, active_low):
+        yield from decoder.feed(durations, levels)
+    yield from decoder.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode an IR timing capture into effect names")
+    parser.add_argument("capture", help="CSV or raw microsecond timing file")
+    parser.add_argument("--pulse-length", type=float, default=cfg.PULSE_LENGTH, help="Microseconds per bit")
+    parser.add_argument("--tolerance", type=float, default=TIMING_TOLERANCE,
+                        help="Largest timing error that's accepted, as a fraction of a pulse")
+    parser.add_argument("--active-low", action="store_true", help="Levels are an IR receiver's output (low = IR on)")
+    parser.add_argument("--list", action="store_true", help="Print every packet, not just the totals")
+    args = parser.parse_args()
+
+    decoder = CaptureDecoder(pulse_length=args.pulse_length, tolerance=args.tolerance)
+    counts = Counter()
+    for packet in decode_capture(args.capture, decoder, active_low=args.active_low):
+        name = packet.effect if packet.tail is None else f"{packet.effect} + {packet.tail}"
+        name = name or f"unknown ({packet.key.bit_length() - 1} bits)"
+        counts[name] += 1
+        if args.list:
+            print(f"{packet.start_us / 1e6:12.6f}  {name}{'  (timing errors)' if packet.timing_errors else ''}")
+
+    for name, count in counts.most_common():
+        print(f"{count:>8}  {name}")
+    print(", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in decoder.stats().items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import csv
+import threading
+import time
+from collections import deque
+import numpy as np
+import configs.config as cfg
+
+# Where the time goes between a sound reaching the microphone and the packet for it leaving over serial. Each send
+# decision gets an event, a list of time.monotonic_ns() stamps indexed by the stage constants below:
+#     CAPTURE         the newest sample in the analysed audio reached the ADC
+#     ANALYSIS_START  analysis started
+#     ANALYSIS_END    analysis finished
+#     ENQUEUE         packet handed to the serial writer
+#     WRITE_DONE      write and flush to the Arduino returned
+#
+# With tracing disabled begin() returns None and every other call is skipped behind an `if event is not None`, so it
+# costs one attribute check per decision.
+
+CAPTURE, ANALYSIS_START, ANALYSIS_END, ENQUEUE, WRITE_DONE = range(5)
+STAGES = ("capture", "analysis_start", "analysis_end", "enqueue", "write_done")
+
+# Histograms kept for these spans between stages
+SPANS = {
+    "capture_to_analysis": (CAPTURE, ANALYSIS_START),
+    "analysis": (ANALYSIS_START, ANALYSIS_END),
+    "decision_to_enqueue": (ANALYSIS_END, ENQUEUE),
+    "queue_and_write": (ENQUEUE, WRITE_DONE),
+    "total": (CAPTURE, WRITE_DONE),
+}
+
+
+class LatencyHistogram:
+    """
+    Fixed buckets, spaced logarithmically from 1 microsecond to 100 seconds (48 per decade, so a percentile read from
+    it is within 5%), so recording is O(1) and memory doesn't grow over a long show.
+    """
+
+    BUCKETS_PER_DECADE = 48
+    MIN_NS = 1_000
+
+    def __init__(self):
+        self.edges = self.MIN_NS * 10 ** (np.arange(8 * self.BUCKETS_PER_DECADE + 1) / self.BUCKETS_PER_DECADE)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.max_ns = 0
+
+    def add(self, value_ns):
+        self.counts[np.searchsorted(self.edges, value_ns, side="right")] += 1
+        self.count += 1
+        self.max_ns = max(self.max_ns, value_ns)
+
+    def percentile(self, q):
+        # Upper edge of the bucket holding the q-th percentile (capped at the largest value seen), in nanoseconds
+        if not self.count:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * q / 100))
+        return float(min(self.edges[min(index, len(self.edges) - 1)], self.max_ns))
+
+
+class LatencyTracer:
+    def __init__(self, enabled=None, keep_events=100_000):
+        self.enabled = cfg.LATENCY_TRACE if enabled is None else enabled
+        self.histograms = {name: LatencyHistogram() for name in SPANS}
+        # The most recent finished events, for dump()
+        self.events = deque(maxlen=keep_events)
+        self._lock = threading.Lock()
+
+    def begin(self, capture_ns=None):
+        # New event for a send decision about to be analysed, or None when tracing is off
+        if not self.enabled:
+            return None
+        event = [None] * len(STAGES)
+        now = time.monotonic_ns()
+        event[CAPTURE] = now if capture_ns is None else capture_ns
+        event[ANALYSIS_START] = now
+        return event
+
+    @staticmethod
+    def stamp(event, stage):
+        event[stage] = time.monotonic_ns()
+
+    def finish(self, event):
+        # Called by the serial writer once the packet is out. Spans with a missing stage are left out.
+        with self._lock:
+            for name, (start, end) in SPANS.items():
+                if event[start] is not None and event[end] is not None:
+                    self.histograms[name].add(event[end] - event[start])
+            self.events.append(tuple(event))
+
+    def summary(self):
+        # {span: {"count", "p50_ms", "p99_ms", "max_ms"}}
+        with self._lock:
+            summary = {}
+            for name, histogram in self.histograms.items():
+                if histogram.count:
+                    summary[name] = {"count": histogram.count, "p50_ms": histogram.percentile(50) / 1e6,
+                                     "p99_ms": histogram.percentile(99) / 1e6, "max_ms": histogram.max_ns / 1e6}
+            return summary
+
+    def report(self):
+        lines = [f"{'span':<22}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<22}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                         f"{stats['max_ms']:>10.2f}")
+        return "\n".join(lines)
+
+    def dump(self, path=None):
+        # Every kept event as CSV, stamps in nanoseconds relative to the event's capture time
+        path = path or cfg.LATENCY_TRACE_FILE
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["capture_monotonic_ns"] + [f"{stage}_ns" for stage in STAGES[1:]])
+            for event in events:
+                # Events from before the capture clock had a mark have no capture time, relative to analysis start then
+                start = event[CAPTURE] if event[CAPTURE] is not None else event[ANALYSIS_START]
+                writer.writerow([event[CAPTURE] or ""] +
+                                [stamp - start if stamp is not None else "" for stamp in event[1:]])
+        return path
@@ -0,0 +1,43 @@
+import importlib
+import threading
+
+
+# librosa alone takes seconds to import on a Raspberry Pi class machine. These helpers let a script name it at the top
+# like a normal import but only pay for it when it's first used, or load it on a background thread while other
+# startup work (like waiting for the Arduino to reset) happens.
+
+
+class LazyModule:
+    # Stands in for a module and imports it the first time one of its attributes is used
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # import_module takes the import lock, so racing a background preload is safe
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded yet"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def preload(*names):
+    # Import the modules on a daemon thread. Returns the thread, join() it to wait for them.
+    def load():
+        for name in names:
+            importlib.import_module(name)
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,90 @@
+import numpy as np
+from scipy.signal import find_peaks
+from configs.band_energy import get_band_extractor
+from configs.effect_index import EFFECT_INDEX, STROBE_TAILS, checked_effects, checked_tails
+from configs.streaming_stft import periodic_hann
+from configs.lazy_import import lazy_import
+
+# Only analyze_audio_batch needs it, for the onset envelope
+librosa = lazy_import("librosa")
+
+
+# Batch versions of the live analyzers, for rendering a recording into a cue list ahead of a show. Each takes a 2D
+# array with one analysis window per row and makes the same decision the live function would for every row at once.
+# Random choices come from the numpy Generator passed in, so a render can be repeated exactly with the same seed.
+#
+# Both return two lists, the effect and tail code for each window (None, None for windows judged silent).
+
+COLOR_EFFECTS = EFFECT_INDEX.sendable
+FADE_EFFECTS = checked_tails(['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5'], "offline_analysis FADE_EFFECTS")
+
+# Colors analyze_audio picks from by dominant frequency band
+BASS_EFFECTS = checked_effects(["RED_3", "YELLOW_4", "RED_2"], "offline_analysis BASS_EFFECTS")
+MID_EFFECTS = checked_effects(["GREEN", "SLOW_GREEN", "YELLOWGREEN"], "offline_analysis MID_EFFECTS")
+TREBLE_EFFECTS = checked_effects(["BLUE", "LIGHT_BLUE", "MAGENTA_2"], "offline_analysis TREBLE_EFFECTS")
+
+
+def _pick(rng, choices, count):
+    return [choices[i] for i in rng.integers(len(choices), size=count)]
+
+
+def analyze_audio_batch(windows, sample_rate, rng, silence_threshold=0.003):
+    # analyze_audio from pixmob.py / test.py: RMS silence gate, then the color family of the dominant band, and a
+    # fade tail when pixmob.py's beat test passes (a peak in the window's onset envelope above its mean), no tail
+    # otherwise. Cues aren't always on a beat, render_cues.py --every places them at fixed intervals.
+    windows = np.asarray(windows, dtype=np.float32)
+    silent = np.sqrt(np.mean(windows ** 2, axis=1)) < silence_threshold
+    bass, mid, treble = get_band_extractor(windows.shape[1], sample_rate).energies(windows).T
+
+    effects = []
+    random_colors = _pick(rng, COLOR_EFFECTS, len(windows))
+    bass_colors, mid_colors, treble_colors = (_pick(rng, family, len(windows))
+                                              for family in (BASS_EFFECTS, MID_EFFECTS, TREBLE_EFFECTS))
+    for i in range(len(windows)):
+        if bass[i] > mid[i] and bass[i] > treble[i]:
+            effects.append(bass_colors[i])
+        elif mid[i] > bass[i] and mid[i] > treble[i]:
+            effects.append(mid_colors[i])
+        elif treble[i] > bass[i] and treble[i] > mid[i]:
+            effects.append(treble_colors[i])
+        else:
+            effects.append(random_colors[i])
+    # One onset envelope per row, the same as calling onset_strength on each window
+    onset_envs = librosa.onset.onset_strength(y=windows, sr=sample_rate)
+    fade_tails = _pick(rng, FADE_EFFECTS, len(windows))
+    tails = [fade_tails[i] if len(find_peaks(onset_env, height=np.mean(onset_env))[0]) else None
+             for i, onset_env in enumerate(onset_envs)]
+    return _blank_silent(effects, tails, silent)
+
+
+def advanced_audio_analysis_batch(windows, sample_rate, rng, n_fft=2048, hop_length=512):
+    # advanced_audio_analysis from pixmob3.1.py: median-based silence gate, a random color, and a strobe tail when the
+    # upper STFT bins outweigh the lower ones
+    windows = np.asarray(windows, dtype=np.float32)
+    rms = np.sqrt(np.mean(windows ** 2, axis=1))
+    silent = rms < np.median(np.abs(windows), axis=1) * 1.5
+
+    segments = np.lib.stride_tricks.sliding_window_view(windows, n_fft, axis=1)[:, ::hop_length]
+    stft = np.abs(np.fft.rfft(segments * periodic_hann(n_fft).astype(np.float32), axis=2))
+    low_energy = stft[:, :, :512].mean(axis=(1, 2))
+    mid_energy = stft[:, :, 512:1024].mean(axis=(1, 2))
+    high_energy = stft[:, :, 1024:].mean(axis=(1, 2))
+
+    effects = _pick(rng, COLOR_EFFECTS, len(windows))
+    strobe = high_energy > (low_energy + mid_energy)
+    strobe_tails = _pick(rng, STROBE_TAILS, len(windows))
+    fade_tails = _pick(rng, FADE_EFFECTS, len(windows))
+    tails = [strobe_tails[i] if strobe[i] else fade_tails[i] for i in range(len(windows))]
+    return _blank_silent(effects, tails, silent)
+
+
+def _blank_silent(effects, tails, silent):
+    for i in np.flatnonzero(silent):
+        effects[i] = tails[i] = None
+    return effects, tails
+
+
+ANALYZERS = {
+    "analyze_audio": analyze_audio_batch,
+    "advanced_audio_analysis": advanced_audio_analysis_batch,
+}
@@ -0,0 +1,134 @@
+from configs import config as cfg
+
+
+class Packet:
+    """
+    The bits of an IR packet as one integer and a bit count, instead of a list of 0/1 ints.
+    The first bit is the most significant one: Packet.from_bits([1, 1, 0]) has value 0b110 and length 3.
+
+    Packets are immutable and hashable. Joining two (an effect and its tail code, say) is a shift and an or:
+        Packet.from_bits(base_color_effects["RED"]) + Packet.from_bits(tail_codes["FADE_2"])
+    They iterate and index like the bit lists, so anything that only reads the bits takes either. They only compare
+    equal to other Packets though, compare packet.bits() against a list. The conversion functions in
+    pixmob_conversion_funcs.py take Packets too and skip the list handling when given one.
+
+    Joining two short packets takes about three times as long as joining the lists (packets/compose_* in
+    benchmarks/micro.py), since building the immutable result costs more than a list copy. It pays off as soon as the
+    result is converted: run lengths come out about four times faster than from the list.
+    """
+
+    __slots__ = ("value", "length")
+
+    def __init__(self, value=0, length=0):
+        if value < 0 or value >> length:
+            raise ValueError(f"{value:#x} doesn't fit in {length} bits")
+        object.__setattr__(self, "value", value)
+        object.__setattr__(self, "length", length)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Packets can't be changed, build a new one")
+
+    @classmethod
+    def from_bits(cls, bit_list):
+        # Example: [1, 0, 1] -> Packet(0b101, 3)
+        if isinstance(bit_list, Packet):
+            return bit_list
+        bit_string = "".join("1" if bit else "0" for bit in bit_list)
+        return cls(int(bit_string, 2) if bit_string else 0, len(bit_string))
+
+    @classmethod
+    def from_key(cls, key):
+        # Inverse of the key property
+        length = key.bit_length() - 1
+        return _make(key ^ (1 << length), length)
+
+    @property
+    def key(self):
+        # The bits behind a leading 1, a single int that tells [0, 1] and [1] apart (see effect_registry.py)
+        return (1 << self.length) | self.value
+
+    def __add__(self, other):
+        if other.__class__ is not Packet:
+            other = Packet.from_bits(other)
+        return _make((self.value << other.length) | other.value, self.length + other.length)
+
+    def __radd__(self, other):
+        # bit list + Packet
+        return Packet.from_bits(other) + self
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (1 if char == "1" else 0 for char in self.bit_string())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return Packet.from_bits(self.bits()[index])
+            length = max(stop - start, 0)
+            return _make((self.value >> (self.length - start - length)) & ((1 << length) - 1), length)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Packet index out of range")
+        return (self.value >> (self.length - 1 - index)) & 1
+
+    def __eq__(self, other):
+        if isinstance(other, Packet):
+            return self.value == other.value and self.length == other.length
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.value, self.length))
+
+    def __repr__(self):
+        return f"Packet('{self.bit_string()}')"
+
+    def bit_string(self):
+        # Example: Packet(0b101, 3) -> "101"
+        return format(self.value, f"0{self.length}b") if self.length else ""
+
+    def bits(self):
+        return list(self)
+
+    def run_lengths(self):
+        # Same as bits_to_run_lengths_pulses, without building the list of bits
+        # Example: Packet(0b11100001, 8) -> [3, 4, 1]
+        # Splitting the string at every change is several times faster than grouping
+        runs = self.bit_string().replace("10", "1 0").replace("01", "0 1").split()
+        return [len(run) for run in runs]
+
+    def run_lengths_microseconds(self, pulse_length=cfg.PULSE_LENGTH):
+        return [pulses * pulse_length for pulses in self.run_lengths()]
+
+    def hex(self):
+        # Same as bits_to_hex
+        return hex(self.value)
+
+    def airtime(self, pulse_length=cfg.PULSE_LENGTH):
+        # Seconds the IR transmitter takes to send it, one pulse per bit
+        return self.length * pulse_length / 1e6
+
+    def to_arduino(self, protocol_version=None, with_crc=None):
+        # Bytes to write to the Arduino, in the serial format from config.py unless given
+        # Imported here since pixmob_conversion_funcs imports this module
+        from configs.pixmob_conversion_funcs import bits_to_arduino_packet
+        protocol_version = cfg.SERIAL_PROTOCOL_VERSION if protocol_version is None else protocol_version
+        with_crc = cfg.SERIAL_PROTOCOL_CRC if with_crc is None else with_crc
+        return bits_to_arduino_packet(self, protocol_version, with_crc)
+
+
+_new_packet = object.__new__
+_set_value = Packet.value.__set__
+_set_length = Packet.length.__set__
+
+
+def _make(value, length):
+    # Packet(value, length) without the range check, for results that are known to fit. Joining packets is the hot
+    # path, this takes a third off it.
+    packet = _new_packet(Packet)
+    _set_value(packet, value)
+    _set_length(packet, length)
+    return packet
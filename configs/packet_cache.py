@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+from configs.effect_table import load_effect_table
+from configs.pixmob_conversion_funcs import bits_to_arduino_packet
+from configs.arduino_emulator import ArduinoEmulator
+from configs.packet import Packet
+import configs.config as cfg
+
+
+# This file compiles every packet we know how to send into the exact bytes written to the Arduino, once, at import
+# time. Sending an effect is then a dictionary lookup plus a serial write instead of rebuilding the bit list and
+# re-running the string conversion on every beat.
+#
+# Keys are (effect name, tail code name) tuples. Base color effects get one entry with a tail code of None and one
+# entry for every tail code. Special effects don't take tail codes, so they only get the None entry.
+#
+# The effects come from the compiled effect table (see effect_table.py) rather than importing effect_definitions.py.
+#
+# compile_sequence() builds frames holding several effects at once, for bursts that have to go out back to back.
+
+
+def compile_packet(bit_list):
+    # Bit list or Packet -> ready to write bytes, in the serial format set in config.py
+    # Example: [1, 1, 1, 0, 0, 0, 0, 1] -> b"[3]341," (version 1)
+    return bits_to_arduino_packet(bit_list)
+
+
+def build_packet_cache(effects=None):
+    # Returns two read-only mappings with the same keys: the compiled bytes, and the number of bits in each packet
+    # (used for pacing, since the byte length of the string says nothing about how long the IR transmission takes)
+    effects = effects or load_effect_table()
+    # Tail codes get appended to every base color, so read them once
+    tail_codes = {name: effects.tail_codes.packet(name) for name in effects.tail_codes}
+    packets = {}
+    bit_lengths = {}
+    # Bits -> compiled bytes. Effects with identical bits (see effect_registry.py) are compiled once and share the
+    # same bytes object.
+    compiled = {}
+    for name in effects.base_color_effects:
+        effect = effects.base_color_effects.packet(name)
+        _add_packet(packets, bit_lengths, compiled, (name, None), effect)
+        for tail_name, tail in tail_codes.items():
+            _add_packet(packets, bit_lengths, compiled, (name, tail_name), effect + tail)
+    for name in effects.special_effects:
+        # A few names exist in both tables. send_effect has always preferred the base color version.
+        if (name, None) not in packets:
+            _add_packet(packets, bit_lengths, compiled, (name, None), effects.special_effects.packet(name))
+    return MappingProxyType(packets), MappingProxyType(bit_lengths)
+
+
+def _add_packet(packets, bit_lengths, compiled, key, bits):
+    packet = compiled.get(bits)
+    if packet is None:
+        try:
+            packet = compile_packet(bits)
+        except ValueError:
+            # The serial format can't hold this combination (over 9 of the same bit in a row in version 1)
+            packet = False
+        compiled[bits] = packet
+    if packet is False:
+        return  # Left out
+    packets[key] = packet
+    bit_lengths[key] = len(bits)
+
+
+def packet_key(main_effect, tail_code=None):
+    """
+    Resolve an effect and optional tail code to its key in PACKETS.
+    Unknown tail codes fall back to the effect without a tail, and special effects ignore the tail code, which is
+    what send_effect has always done. Returns None for unknown effects.
+    """
+    key = (main_effect, tail_code)
+    if key in PACKETS:
+        return key
+    key = (main_effect, None)
+    if key in PACKETS:
+        return key
+    return None
+
+
+def get_packet(main_effect, tail_code=None):
+    # Compiled bytes for the effect, or None if it doesn't exist. Same fallbacks as packet_key, inlined since this is
+    # called for every send.
+    packet = PACKETS.get((main_effect, tail_code))
+    if packet is None:
+        packet = PACKETS.get((main_effect, None))
+    return packet
+
+
+def get_bit_length(main_effect, tail_code=None):
+    # Number of bits in the effect's packet, or 0 if it doesn't exist
+    key = packet_key(main_effect, tail_code)
+    return PACKET_BIT_LENGTHS[key] if key is not None else 0
+
+
+def get_airtime(main_effect, tail_code=None):
+    # Seconds the IR transmitter takes to send the effect's packet, one PULSE_LENGTH per bit
+    return get_bit_length(main_effect, tail_code) * cfg.PULSE_LENGTH / 1e6
+
+
+def packet_airtime(packet):
+    # Seconds of IR transmission for compiled bytes. Packets from the cache are looked up, anything else is decoded
+    # the way the Arduino would.
+    airtime = PACKET_AIRTIMES.get(packet) or _sequence_airtimes.get(packet)
+    if airtime is None:
+        pulses = sum(sum(run_lengths) for run_lengths in ArduinoEmulator().feed(packet))
+        airtime = pulses * cfg.PULSE_LENGTH / 1e6
+    return airtime
+
+
+# Goes between commands sent in one IR transmission (see the notes at the bottom of effect_definitions.py)
+SEPARATOR_BITS = [1, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+SEPARATOR = Packet.from_bits(SEPARATOR_BITS)
+
+# Sequences compile_sequence keeps compiled
+SEQUENCE_CACHE_SIZE = 256
+# Airtimes of the frames compile_sequence returned most recently, which aren't in PACKET_AIRTIMES. Bounded like the
+# sequence cache, older frames are decoded again by packet_airtime if they're ever sent.
+_sequence_airtimes = OrderedDict()
+
+# The compiled effect table PACKETS is built from. effect_packet, EffectIndex and EffectRegistry all read this one
+# instead of mapping and checking the file again.
+EFFECTS = load_effect_table()
+
+
+def effect_packet(main_effect, tail_code=None):
+    # The effect's bits as a Packet, with the same fallbacks as packet_key. None for unknown effects.
+    key = packet_key(main_effect, tail_code)
+    if key is None:
+        return None
+    name, tail_name = key
+    effects = EFFECTS
+    if name not in effects.base_color_effects:
+        return effects.special_effects.packet(name)
+    effect = effects.base_color_effects.packet(name)
+    return effect + effects.tail_codes.packet(tail_name) if tail_name is not None else effect
+
+
+def packet_bits(main_effect, tail_code=None):
+    # Bit list behind the effect's packet, with the same fallbacks as packet_key. None for unknown effects.
+    packet = effect_packet(main_effect, tail_code)
+    return packet.bits() if packet is not None else None
+
+
+@lru_cache(maxsize=SEQUENCE_CACHE_SIZE)
+def _compile_sequence(keys):
+    # (frame, airtime)
+    bits = effect_packet(*keys[0])
+    for key in keys[1:]:
+        bits = bits + SEPARATOR + effect_packet(*key)
+    frame = compile_packet(bits)
+    if len(frame) > cfg.ARDUINO_RX_BUFFER:
+        # The Arduino would lose the end of the frame
+        raise ValueError(f"A {len(frame)} byte frame doesn't fit the Arduino's {cfg.ARDUINO_RX_BUFFER} byte receive "
+                         f"buffer (ARDUINO_RX_BUFFER), send fewer effects at once or use serial protocol version 2")
+    return frame, bits.airtime()
+
+
+def compile_sequence(effects):
+    """
+    One frame that sends several effects back to back:
+        compile_sequence(["OLD_GREEN_THEN_OFF", ("RED", "FADE_2")])
+    Each item is an effect name or an (effect name, tail code) tuple. The commands are joined with SEPARATOR_BITS into a
+    single IR transmission, so the whole burst is one write and one flush instead of one per effect, and nothing can
+    get between the commands. Sequences are cached, so building the same one again is a lookup.
+    Raises KeyError for unknown effects and ValueError if the result doesn't fit the serial format or is longer than
+    the Arduino's receive buffer (ARDUINO_RX_BUFFER in config.py).
+    """
+    keys = []
+    for effect in effects:
+        main_effect, tail_code = (effect, None) if isinstance(effect, str) else effect
+        key = packet_key(main_effect, tail_code)
+        if key is None:
+            raise KeyError(f"Unknown effect {main_effect}")
+        keys.append(key)
+    if not keys:
+        raise ValueError("A sequence needs at least one effect")
+    frame, airtime = _compile_sequence(tuple(keys))
+    _sequence_airtimes[frame] = airtime
+    _sequence_airtimes.move_to_end(frame)
+    if len(_sequence_airtimes) > SEQUENCE_CACHE_SIZE:
+        _sequence_airtimes.popitem(last=False)
+    return frame
+
+
+PACKETS, PACKET_BIT_LENGTHS = build_packet_cache(EFFECTS)
+# Compiled bytes -> seconds of IR transmission, for code that only has the bytes (the serial writer)
+PACKET_AIRTIMES = MappingProxyType({PACKETS[key]: PACKET_BIT_LENGTHS[key] * cfg.PULSE_LENGTH / 1e6 for key in PACKETS})
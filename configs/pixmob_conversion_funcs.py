@@ -1,5 +1,6 @@
 import itertools
 from configs import config as cfg
+from configs.packet import Packet
 
 
 # This file contains functions used for converting between different representations of the PixMob data
@@ -10,9 +11,13 @@ from configs import config as cfg
 # - "bits" (high/low IR light value at each unit of 694.44 microseconds)
 # - hexadecimal
 # - string representations parsed by the Arduino to send the IR signals.
+#
+# Anywhere a bit list is taken, a Packet (see packet.py) works as well.
 
 def bits_to_hex(bit_list):
     # Example: [1, 1, 1, 1, 0, 0, 0, 0] -> 0xf0
+    if isinstance(bit_list, Packet):
+        return bit_list.hex()
     return hex(int(("".join([str(i) for i in bit_list])), 2))
 
 
@@ -21,6 +26,8 @@ def bits_to_run_lengths_pulses(bit_list):
     # Example: [1, 1, 1, 0, 0, 0, 0, 1] -> [3, 4, 1]
     # TODO: Throw an exception if the bit list isn't just ones and zeroes?
     # TODO: Combine this with the other bit to run length function and let this one be the case where pulse length is 1
+    if isinstance(bit_list, Packet):
+        return bit_list.run_lengths()
     run_lengths = []
     # groupby returns groups of adjacent matching things
     for _, group in itertools.groupby(bit_list):
@@ -67,8 +74,7 @@ def bits_to_arduino_string(bit_list):
     # String to send to the arduino in the format "[<length>]NumberNumberNumber,"
     # "Number"s are the run length in pulses.
     # Example: [1, 1, 1, 0, 0, 0, 0, 1] -> "[3]341,"
-    # TODO "Number"s have to be one digit, so I might make a v2 without that limitation?
-    #  For now raise an exception if the bit list would cause a problem
+    # "Number"s have to be one digit, so bit lists with longer runs raise (version 2 below doesn't have the limit)
     run_lengths = bits_to_run_lengths_pulses(bit_list)
     if max(run_lengths) > 9:
         raise ValueError(f"Arduino can't accept over 9 of the same bit in a row.\n{bit_list}")
@@ -77,3 +83,54 @@ def bits_to_arduino_string(bit_list):
     return out + ","
 
 
+# Version 2 of the serial format. Binary instead of ASCII and without the 9 pulse limit:
+#
+#   0xA5, flags, <number of runs>, <run lengths>, [crc]
+#
+# flags bit 0 (V2_FLAG_WIDE): run lengths are one byte each (1-255). Otherwise they're packed two per byte as
+#                             nibbles (1-15), high nibble first, with a zero nibble padding an odd count.
+# flags bit 1 (V2_FLAG_CRC):  a CRC-8 (polynomial 0x07) of everything before it is appended.
+# The narrowest encoding that fits is picked automatically, so normal packets cost about half as many bytes as v1.
+V2_START_BYTE = 0xA5
+V2_FLAG_WIDE = 0x01
+V2_FLAG_CRC = 0x02
+
+
+def crc8(data):
+    # CRC-8 with polynomial 0x07, initial value 0, as used by the v2 frames
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def bits_to_arduino_bytes_v2(bit_list, with_crc=True):
+    # Example: [1, 1, 1, 0, 0, 0, 0, 1] -> runs [3, 4, 1] -> b"\xa5\x02\x03\x34\x10" + crc
+    run_lengths = bits_to_run_lengths_pulses(bit_list)
+    if len(run_lengths) > 255:
+        raise ValueError(f"Version 2 frames can't hold more than 255 runs, got {len(run_lengths)}")
+    if max(run_lengths) > 255:
+        raise ValueError(f"Version 2 frames can't hold over 255 of the same bit in a row.\n{bit_list}")
+
+    flags = V2_FLAG_CRC if with_crc else 0
+    if max(run_lengths) > 15:
+        flags |= V2_FLAG_WIDE
+        payload = bytes(run_lengths)
+    else:
+        padded = run_lengths + [0] * (len(run_lengths) % 2)
+        payload = bytes((high << 4) | low for high, low in zip(padded[::2], padded[1::2]))
+    out = bytes([V2_START_BYTE, flags, len(run_lengths)]) + payload
+    if with_crc:
+        out += bytes([crc8(out)])
+    return out
+
+
+def bits_to_arduino_packet(bit_list, protocol_version=cfg.SERIAL_PROTOCOL_VERSION, with_crc=cfg.SERIAL_PROTOCOL_CRC):
+    # Bytes to write to the Arduino in whichever serial format is configured
+    if protocol_version == 1:
+        return bits_to_arduino_string(bit_list).encode("utf-8")
+    if protocol_version == 2:
+        return bits_to_arduino_bytes_v2(bit_list, with_crc)
+    raise ValueError(f"Unknown serial protocol version {protocol_version}")
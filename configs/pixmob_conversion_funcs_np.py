@@ -0,0 +1,101 @@
+import numpy as np
+from configs import config as cfg
+from configs.packet import Packet
+
+
+# NumPy versions of the converters in pixmob_conversion_funcs.py. They give the same results as the originals, but
+# also accept a 2D batch (one packet per row) so whole captures or effect tables can be converted in one call.
+#
+# 1D input -> one result, like the original function (numpy array instead of a list)
+# 2D input -> list with one result per row. Packets have different numbers of runs, so results can't share one array.
+
+
+def _as_bit_array(bit_list):
+    if isinstance(bit_list, Packet):
+        # Straight from the bit string, not element by element
+        return np.frombuffer(bit_list.bit_string().encode("ascii"), dtype=np.uint8) - ord("0")
+    bits = np.asarray(bit_list, dtype=np.uint8)
+    if bits.ndim not in (1, 2):
+        raise ValueError(f"Expected a bit list or a 2D batch of bit lists, got {bits.ndim} dimensions")
+    if np.any(bits > 1):
+        raise ValueError("Bit lists can only contain ones and zeroes")
+    return bits
+
+
+def bits_to_hex_np(bit_list):
+    # Example: [1, 1, 1, 1, 0, 0, 0, 0] -> "0xf0"
+    # Pad on the left up to whole bytes so packbits doesn't change the value, then strip leading zeroes like hex() does
+    bits = _as_bit_array(bit_list)
+    batch = bits if bits.ndim == 2 else bits[np.newaxis, :]
+    padding = -batch.shape[1] % 8
+    packed = np.packbits(np.pad(batch, ((0, 0), (padding, 0))), axis=1)
+    hex_strings = ["0x" + (row.tobytes().hex().lstrip("0") or "0") for row in packed]
+    return hex_strings if bits.ndim == 2 else hex_strings[0]
+
+
+def _run_lengths_batch(batch):
+    # Runs end wherever a bit differs from the next one, plus at the end of each row. Mark both, then flatten so
+    # one flatnonzero finds the boundaries of every row at once.
+    rows, width = batch.shape
+    boundaries = np.ones((rows, width + 1), dtype=bool)
+    boundaries[:, 1:width] = batch[:, 1:] != batch[:, :-1]
+    positions = np.flatnonzero(boundaries)
+    row_of_position = positions // (width + 1)
+    lengths = np.diff(positions)
+    # Drop the gaps between the end of one row and the start of the next
+    lengths = lengths[row_of_position[1:] == row_of_position[:-1]]
+    runs_per_row = np.bincount(row_of_position, minlength=rows) - 1
+    return np.split(lengths, np.cumsum(runs_per_row)[:-1])
+
+
+def bits_to_run_lengths_pulses_np(bit_list):
+    # Example: [1, 1, 1, 0, 0, 0, 0, 1] -> [3, 4, 1]
+    bits = _as_bit_array(bit_list)
+    if bits.ndim == 1:
+        return _run_lengths_batch(bits[np.newaxis, :])[0]
+    return _run_lengths_batch(bits)
+
+
+def bits_to_run_lengths_microseconds_np(bit_list, pulse_length=cfg.PULSE_LENGTH):
+    # Example: [1, 0, 0, 0, 0, 1, 1] -> [1, 4, 2] -> [694, 2776, 1388]
+    run_lengths = bits_to_run_lengths_pulses_np(bit_list)
+    if isinstance(run_lengths, list):
+        return [row * pulse_length for row in run_lengths]
+    return run_lengths * pulse_length
+
+
+def run_lengths_to_bits_np(run_length_list, pulse_length=cfg.PULSE_LENGTH, acceptable_error=1):
+    """
+    Same as run_lengths_to_bits, including the acceptable_error check and the ValueError it raises.
+    Accepts a single list of run lengths, or a list of them (any lengths) / a 2D array to convert a batch.
+    """
+    if len(run_length_list) and np.ndim(run_length_list[0]) == 1:
+        rows = [np.asarray(row, dtype=np.float64).ravel() for row in run_length_list]
+        single = False
+    else:
+        rows = [np.asarray(run_length_list, dtype=np.float64).ravel()]
+        single = True
+    run_lengths = np.concatenate(rows) if rows else np.zeros(0)
+    runs_per_row = np.array([row.size for row in rows], dtype=np.intp)
+
+    difference = run_lengths % pulse_length
+    error = np.minimum(difference, np.abs(pulse_length - difference))
+    too_far = np.flatnonzero(error > acceptable_error * pulse_length)
+    if too_far.size:
+        first = too_far[0]
+        raise ValueError(
+            f"Error too large: {run_lengths[first]:g} is {error[first]:g} away from nearest possible value, must be "
+            f"within {acceptable_error * pulse_length}")
+    # np.rint rounds halves to even, same as round()
+    pulses = np.rint(run_lengths / pulse_length).astype(np.intp)
+
+    # Each row starts with a 1 and alternates, so the bit for each run is the parity of its index within its row
+    row_starts = np.repeat(np.cumsum(runs_per_row) - runs_per_row, runs_per_row)
+    run_bits = (1 - (np.arange(run_lengths.size) - row_starts) % 2).astype(np.uint8)
+    bits = np.repeat(run_bits, pulses)
+
+    if single:
+        return bits
+    row_of_run = np.repeat(np.arange(len(rows)), runs_per_row)
+    pulses_per_row = np.bincount(row_of_run, weights=pulses, minlength=len(rows)).astype(np.intp)
+    return np.split(bits, np.cumsum(pulses_per_row)[:-1])
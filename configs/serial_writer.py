@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from configs.latency_trace import ENQUEUE, WRITE_DONE
+from configs.transport import wait_until_ready
+from configs.tx_pacing import TransmitPacer
+
+
+class SerialWriter(threading.Thread):
+    """
+    Writes packets to the Arduino from its own thread so the audio analysis never waits on the serial port.
+
+    Packets go into a bounded queue. A packet submitted with supersede=True replaces everything still waiting (the
+    lights should show the newest decision, not catch up on old ones). Otherwise, when the queue is full the oldest
+    waiting packet is dropped. Both cases are counted, along with the deepest the queue has been.
+
+    The first write waits for the transport's ready_at (see open_transport), so the caller doesn't have to sleep
+    through the Arduino's reset. After that every write waits for the pacer (see tx_pacing.py) to say the IR
+    transmitter can take it, and a packet superseded during that wait is never written.
+
+    If a write fails (the USB cable was pulled, say) the thread reports it and stops. submit() then raises
+    RuntimeError instead of queueing packets nobody will write, and stats() includes the error.
+
+    write_latency is a running average of the seconds from when a packet is taken off the queue, after the pacer's
+    wait, until the write and flush have returned, which the beat scheduler sends ahead by. Time spent waiting for
+    the transmitter is left out of it, since the scheduler already adds the packet's airtime, and averaged separately
+    in queue_latency. Packets submitted with a latency trace event get it stamped when they're queued and written,
+    and passed to tracer.finish().
+    """
+
+    def __init__(self, arduino, max_queue=8, flush=True, tracer=None, pacer=None):
+        super().__init__(daemon=True)
+        self.arduino = arduino
+        self.flush = flush
+        self.max_queue = max_queue
+        self.tracer = tracer
+        self.pacer = TransmitPacer() if pacer is None else pacer
+        # (packet, time.monotonic_ns() when submitted, trace event or None)
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        # Exception that ended the thread, if one did
+        self.error = None
+
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.max_depth = 0
+        self.write_latency = 0.0
+        self.last_write_latency = 0.0
+        self.queue_latency = 0.0
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def submit(self, packet, supersede=True, trace=None):
+        # Never blocks. Raises RuntimeError once the writer has stopped on an error.
+        if self.error is not None:
+            raise RuntimeError(f"The serial writer stopped: {self.error!r}") from self.error
+        if trace is not None:
+            self.tracer.stamp(trace, ENQUEUE)
+        with self._condition:
+            if supersede:
+                self.superseded += len(self._queue)
+                self._queue.clear()
+            elif len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((packet, time.monotonic_ns(), trace))
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._condition.notify()
+
+    def stop(self, timeout=None):
+        # Finish the packet being written, drop the rest and end the thread
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.join(timeout)
+
+    def stats(self):
+        return {"sent": self.sent, "bytes_sent": self.bytes_sent, "dropped": self.dropped,
+                "superseded": self.superseded, "depth": self.depth, "max_depth": self.max_depth,
+                "write_latency_ms": self.write_latency * 1000,
+                "queue_latency_ms": self.queue_latency * 1000, "error": repr(self.error) if self.error else None,
+                **self.pacer.stats()}
+
+    def run(self):
+        try:
+            self._write_packets()
+        except Exception as e:
+            self.error = e
+            with self._condition:
+                self._queue.clear()
+            print(f"Serial writer stopped, nothing more will be sent: {e!r}")
+
+    def _write_packets(self):
+        # Packets submitted while the Arduino is still resetting wait in the queue
+        wait_until_ready(self.arduino)
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                next_packet = self._queue[0][0]
+
+            # Wait for the transmitter outside the lock. The wait depends on the packet's length, so if another one
+            # superseded it in the meantime, go round again and wait for that one instead.
+            self.pacer.wait(next_packet)
+            with self._condition:
+                if self._stopping or not self._queue or self._queue[0][0] != next_packet:
+                    continue
+                packet, submitted_ns, trace = self._queue.popleft()
+            # The write latency is timed from here, the time before it (in the queue and waiting for the pacer) is
+            # queue latency
+            start_ns = time.monotonic_ns()
+            self.pacer.reserve(packet, start_ns)
+            queued = (start_ns - submitted_ns) / 1e9
+
+            self.arduino.write(packet)
+            if self.flush:
+                self.arduino.flush()
+            if trace is not None:
+                self.tracer.stamp(trace, WRITE_DONE)
+                self.tracer.finish(trace)
+            latency = (time.monotonic_ns() - start_ns) / 1e9
+            self.last_write_latency = latency
+            # Exponential averages, quick to follow a change in the link but not thrown off by one slow write. The
+            # first packet may have sat in the queue while the Arduino reset, so it only seeds the write latency.
+            if self.sent:
+                self.write_latency += (latency - self.write_latency) * 0.2
+                self.queue_latency += (queued - self.queue_latency) * 0.2
+            else:
+                self.write_latency = min(latency, 0.05)
+            self.sent += 1
+            self.bytes_sent += len(packet)
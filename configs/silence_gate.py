@@ -0,0 +1,182 @@
+import argparse
+import math
+import numpy as np
+import configs.config as cfg
+
+
+class SilenceGate:
+    """
+    Decides whether there's any sound worth analysing, from running statistics updated one hop at a time. The control
+    loops check it before computing any features, so a silent room costs a few operations per hop instead of a full
+    analysis every beat.
+
+    level is an exponentially weighted RMS over roughly the last time_constant seconds.
+
+    noise_floor follows a low quantile of the per hop RMS without storing any history: every hop it moves up by
+    step_db * quantile decibels if the hop was louder and down by step_db * (1 - quantile) if it was quieter, which
+    settles where that fraction of hops is quieter. It drops within a second when the room goes quiet and creeps up
+    (about 2 dB/s with the defaults) under sustained noise, so the threshold follows the venue instead of being fixed.
+    While the gate is open it only keeps rising if the sound is steady from hop to hop (deviation, the average distance
+    in dB between a hop and level over about steady_time_constant seconds, below steady_db), like a fan or hiss, so
+    noise that starts after a quiet spell is still learned. Anything with a beat or a swell in it moves around more
+    than that, and while it plays the floor never rises far enough to bring the threshold within open_margin_db of
+    level, so dense or heavily compressed music can't be learned as noise however long it plays. A sustained pad with
+    no transients counts as steady.
+
+    The gate is open while level is more than ratio times the noise floor, and above min_level (SILENCE_MIN_LEVEL in
+    config.py) whatever the floor.
+
+    Call update() with an AudioRingBuffer after audio arrives, or feed() with the samples for audio that isn't in one.
+    """
+
+    def __init__(self, sample_rate, hop_length=512, time_constant=0.3, quantile=0.05, step_db=0.5, ratio=1.5,
+                 open_margin_db=6.0, steady_db=0.5, steady_time_constant=3.0,
+                 min_level=None):
+        self.hop_length = hop_length
+        # Weight of the newest hop in level
+        self.smoothing = 1 - np.exp(-hop_length / (sample_rate * time_constant))
+        # Weight of the newest hop in deviation
+        self.steady_smoothing = 1 - np.exp(-hop_length / (sample_rate * steady_time_constant))
+        self.up_db = step_db * quantile
+        self.down_db = step_db * (1 - quantile)
+        self.ratio = ratio
+        self.open_margin_db = open_margin_db
+        self.steady_db = steady_db
+        self.min_level = cfg.SILENCE_MIN_LEVEL if min_level is None else min_level
+
+        self._mean_square = None
+        self._floor_db = None
+        self.deviation = 0.0
+        # Stream sample index where the next hop starts (update), or samples left over from the last feed()
+        self._next_start = 0
+        self._remainder = np.zeros(0, dtype=np.float32)
+        self.hops = 0
+
+    @property
+    def level(self):
+        return float(np.sqrt(self._mean_square)) if self._mean_square is not None else 0.0
+
+    @property
+    def noise_floor(self):
+        return float(10 ** (self._floor_db / 20)) if self._floor_db is not None else 0.0
+
+    @property
+    def threshold(self):
+        return max(self.noise_floor * self.ratio, self.min_level)
+
+    @property
+    def open(self):
+        return self._mean_square is not None and self.level > self.threshold
+
+    def update(self, audio_buffer):
+        # Take in every whole hop written since the last call. Returns whether the gate is open.
+        written = audio_buffer.written
+        oldest_available = written - len(audio_buffer)
+        if self._next_start < oldest_available:
+            # Fell behind further than the ring buffer reaches, carry on from the oldest whole hop still there
+            skipped_hops = -(-(oldest_available - self._next_start) // self.hop_length)
+            self._next_start += skipped_hops * self.hop_length
+        count = (written - self._next_start) // self.hop_length
+        if count > 0:
+            # Up to the write count read above, so the hops start at _next_start even if the callback writes now
+            samples = audio_buffer.latest(written - self._next_start, end=written)[:count * self.hop_length]
+            self._add_hops(samples.reshape(count, self.hop_length))
+            self._next_start += count * self.hop_length
+        return self.open
+
+    def feed(self, samples):
+        # Same as update() for an array of samples (a recording, say). A partial hop at the end is kept for next time.
+        samples = np.concatenate((self._remainder, np.ravel(samples)))
+        count = len(samples) // self.hop_length
+        self._remainder = samples[count * self.hop_length:]
+        if count:
+            self._add_hops(samples[:count * self.hop_length].reshape(count, self.hop_length))
+        return self.open
+
+    def _add_hops(self, hops):
+        hops = hops.astype(np.float64, copy=False)
+        mean_squares = np.einsum("ij,ij->i", hops, hops) / self.hop_length
+        levels_db = 10 * np.log10(mean_squares + 1e-20)
+
+        mean_square, floor_db = self._mean_square, self._floor_db
+        if mean_square is None:
+            mean_square, floor_db = mean_squares[0], levels_db[0]
+        smoothing, steady_smoothing = self.smoothing, self.steady_smoothing
+        up_db, down_db = self.up_db, self.down_db
+        ratio_db = 20 * math.log10(self.ratio)
+        min_db = 20 * math.log10(self.min_level) if self.min_level > 0 else -math.inf
+        deviation = self.deviation
+        for hop_mean_square, hop_db in zip(mean_squares.tolist(), levels_db.tolist()):
+            mean_square += smoothing * (hop_mean_square - mean_square)
+            level_db = 10 * math.log10(mean_square + 1e-20)
+            deviation += steady_smoothing * (abs(hop_db - level_db) - deviation)
+            if hop_db > floor_db:
+                is_open = level_db > max(floor_db + ratio_db, min_db)
+                if (not is_open or deviation < self.steady_db
+                        or floor_db + up_db + ratio_db < level_db - self.open_margin_db):
+                    floor_db += up_db
+            else:
+                floor_db = max(floor_db - down_db, hop_db)
+        self._mean_square, self._floor_db, self.deviation = mean_square, floor_db, deviation
+        self.hops += len(hops)
+
+    def stats(self):
+        return {"level": self.level, "noise_floor": self.noise_floor, "threshold": self.threshold, "open": self.open}
+
+
+def main():
+    # Checks the gate on synthetic audio, run with: python -m configs.silence_gate
+    # - it stays open through minutes of continuous dense music (a kick over a loud, steady bed) and closes again
+    #   once it stops
+    # - steady noise arriving after a quiet start is learned as the floor and closes the gate
+    parser = argparse.ArgumentParser(description="Run the silence gate over synthetic audio and report when it's open")
+    parser.add_argument("--minutes", type=float, default=5.0, help="Minutes of music")
+    args = parser.parse_args()
+
+    sample_rate, block = 44100, 1024
+    rng = np.random.default_rng(0)
+    kick = np.sin(2 * np.pi * 60 * np.arange(4000) / sample_rate) * np.exp(-np.arange(4000) / 800)
+
+    def run(gate, seconds, bed_level, kicks):
+        samples = int(seconds * sample_rate)
+        opened = []
+        for start in range(0, samples - block + 1, block):
+            y = bed_level * rng.standard_normal(block)
+            if kicks:
+                # 128 BPM, blocks starting in the first 4000 samples of a beat get that part of the kick
+                offset = (start % int(sample_rate * 60 / 128))
+                if offset < 4000:
+                    y[:min(block, 4000 - offset)] += 0.8 * kick[offset:offset + block]
+            opened.append(gate.feed(y.astype(np.float32)))
+        return np.array(opened)
+
+    failures = []
+    gate = SilenceGate(sample_rate)
+    run(gate, 5, 0.001, False)
+    music = run(gate, args.minutes * 60, 0.1, True)
+    after = run(gate, 10, 0.001, False)
+    # Blocks per 30 s slice of music the gate was open for
+    slices = np.array_split(music, max(int(args.minutes * 2), 1))
+    print("open per 30 s of music: " + " ".join(f"{part.mean():.0%}" for part in slices))
+    print(f"closed {np.argmin(after) * block / sample_rate:.1f} s after the music stopped" if not after[-1]
+          else "still open 10 s after the music stopped")
+    # The first seconds of music are allowed to settle
+    if not music[int(len(music) * 0.05):].all():
+        failures.append("closed on music")
+    if after[-1]:
+        failures.append("stayed open after the music stopped")
+
+    gate = SilenceGate(sample_rate)
+    run(gate, 5, 0.001, False)
+    noise = run(gate, 60, 0.02, False)
+    print(f"noise after a quiet start: closed after {np.argmin(noise) * block / sample_rate:.1f} s" if not noise[-1]
+          else "noise after a quiet start: still open after 60 s")
+    if noise[-len(noise) // 2:].any():
+        failures.append("stayed open on steady noise")
+
+    if failures:
+        raise SystemExit("The gate " + ", ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
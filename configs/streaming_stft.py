@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def periodic_hann(n_fft):
+    # Same window librosa.stft uses by default (scipy.signal.get_window("hann", n_fft))
+    return 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)
+
+
+def periodic_tukey(n_fft, alpha=0.5):
+    # Same as scipy.signal.get_window(("tukey", alpha), n_fft): flat in the middle, alpha of it tapered with a cosine
+    n = np.arange(n_fft)
+    taper = alpha * n_fft / 2
+    window = np.ones(n_fft)
+    if taper <= 0:
+        return window
+    rising = n < taper
+    falling = n > n_fft - taper
+    window[rising] = 0.5 * (1 + np.cos(np.pi * (n[rising] / taper - 1)))
+    window[falling] = 0.5 * (1 + np.cos(np.pi * ((n[falling] - n_fft) / taper + 1)))
+    return window
+
+
+class StreamingSTFT:
+    """
+    Rolling magnitude spectrogram that only computes the frames new audio makes possible.
+
+    Call update() with an AudioRingBuffer after audio arrives. Frames are taken every hop_length samples of the
+    stream (not re-aligned to whatever window is being analysed), so each one is computed exactly once. latest()
+    returns the newest frames as a (frequency bins, frames) view, the same layout as np.abs(librosa.stft(...)).
+
+    window can be an array of n_fft values; power=2 gives a power spectrogram; detrend=True removes each frame's mean
+    first, like scipy.signal.spectrogram does.
+    """
+
+    def __init__(self, n_fft=2048, hop_length=512, max_frames=256, window=None, power=1, detrend=False):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.max_frames = max_frames
+        self.window = (periodic_hann(n_fft) if window is None else np.asarray(window, dtype=np.float64)).astype(
+            np.float32)
+        self.power = power
+        self.detrend = detrend
+        self.n_bins = n_fft // 2 + 1
+
+        # Frames stored twice (like AudioRingBuffer) so the newest ones are always one contiguous block
+        self._frames = np.zeros((2 * max_frames, self.n_bins), dtype=np.float32)
+        self._position = 0
+        self.frames_computed = 0
+        # Stream sample index where the next frame starts
+        self._next_start = 0
+
+    def frequencies(self, sample_rate):
+        return np.arange(self.n_bins) * (sample_rate / self.n_fft)
+
+    def update(self, audio_buffer, end=None):
+        # Compute every frame that fits in the audio written so far, or up to the write count end. Returns how many new
+        # frames there are.
+        written = audio_buffer.written if end is None else end
+        oldest_available = written - len(audio_buffer)
+        if self._next_start < oldest_available:
+            # Fell behind further than the ring buffer reaches, skip to the oldest whole hop still there
+            skipped_hops = -(-(oldest_available - self._next_start) // self.hop_length)
+            self._next_start += skipped_hops * self.hop_length
+        if self._next_start + self.n_fft > written:
+            return 0
+
+        samples = audio_buffer.latest(written - self._next_start, end=written)
+        segments = np.lib.stride_tricks.sliding_window_view(samples, self.n_fft)[::self.hop_length]
+        if self.detrend:
+            segments = segments - segments.mean(axis=1, keepdims=True)
+        magnitudes = np.abs(np.fft.rfft(segments * self.window, axis=1))
+        if self.power != 1:
+            magnitudes **= self.power
+
+        self._append(magnitudes[-self.max_frames:])
+        self._next_start += len(segments) * self.hop_length
+        return len(segments)
+
+    def _append(self, frames):
+        count = len(frames)
+        position, capacity = self._position, self.max_frames
+        first = min(count, capacity - position)
+        self._frames[position:position + first] = frames[:first]
+        self._frames[position + capacity:position + capacity + first] = frames[:first]
+        rest = count - first
+        if rest:
+            self._frames[:rest] = frames[first:]
+            self._frames[capacity:capacity + rest] = frames[first:]
+        self._position = (position + count) % capacity
+        self.frames_computed += count
+
+    def latest(self, n_frames):
+        # (n_bins, frames) view of the newest n_frames (fewer if not that many have been computed yet)
+        n_frames = min(int(n_frames), self.max_frames, self.frames_computed)
+        end = self._position + self.max_frames
+        view = self._frames[end - n_frames:end]
+        view.flags.writeable = False
+        return view.T
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from configs import config as cfg
+from configs.arduino_emulator import ArduinoEmulator, run_lengths_pulses_to_bits
+
+
+# Where packets go. open_transport() returns something with write(bytes), flush() and close(), like serial.Serial:
+#
+# - "serial": the real Arduino, using the port and baud rate in config.py
+# - "fake":   a pseudo terminal with a fake Arduino on the other end that decodes the frames and records when each one
+#             arrived. Runs the whole send path, tty included, without hardware (Linux and macOS only).
+# - "null":   throws everything away, only counts bytes. For measuring the host side on its own.
+
+
+class NullTransport:
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        self.writes += 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeArduino:
+    """
+    Pseudo terminal pair: the controller writes to the port end, a thread reads the other end and decodes frames
+    with ArduinoEmulator. Each decoded frame is recorded as (time.monotonic_ns() when it was decoded, run lengths).
+    """
+
+    def __init__(self):
+        import tty
+        self._master, self._slave = os.openpty()
+        # Raw mode, otherwise the terminal line discipline echoes and rewrites bytes (v2 frames are binary)
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        self.port_name = os.ttyname(self._slave)
+        self.emulator = ArduinoEmulator()
+        self.frame_log = []
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            received = time.monotonic_ns()
+            for run_lengths in self.emulator.feed(data):
+                self.frame_log.append((received, run_lengths))
+
+    # Port side, used by the controller
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._slave, view)
+            view = view[written:]
+        return len(data)
+
+    def flush(self):
+        import termios
+        termios.tcdrain(self._slave)
+
+    def close(self):
+        self._closed = True
+        os.close(self._slave)
+        os.close(self._master)
+
+    def effect_log(self):
+        # frame_log with the packets named: (time decoded, (effect, tail code)), None for packets that aren't a known
+        # effect (sequences from compile_sequence, for one)
+        from configs.effect_registry import EFFECT_REGISTRY
+        return [(received, EFFECT_REGISTRY.decode(run_lengths_pulses_to_bits(run_lengths)))
+                for received, run_lengths in self.frame_log]
+
+    def stats(self):
+        return {"bytes_received": self.emulator.bytes_received, "frames": self.emulator.frames,
+                "bad_frames": self.emulator.bad_frames, "crc_errors": self.emulator.crc_errors}
+
+
+def open_transport(kind=cfg.ARDUINO_TRANSPORT, reset_delay=None):
+    """
+    reset_delay is how long the device needs after opening before it can receive (the Arduino resets when the port is
+    opened). It defaults to ARDUINO_RESET_DELAY for the real port and 0 otherwise. Instead of sleeping here, the time it
+    becomes ready is stored on the transport as ready_at so other startup work can happen in the meantime; call
+    wait_until_ready() before the first write (SerialWriter does this itself).
+    """
+    if kind == "serial":
+        import serial
+        transport = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=.1)
+        default_delay = cfg.ARDUINO_RESET_DELAY
+    elif kind == "fake":
+        transport, default_delay = FakeArduino(), 0
+    elif kind == "null":
+        transport, default_delay = NullTransport(), 0
+    else:
+        raise ValueError(f"Unknown transport {kind!r}, expected 'serial', 'fake' or 'null'")
+    transport.ready_at = time.monotonic() + (default_delay if reset_delay is None else reset_delay)
+    return transport
+
+
+def wait_until_ready(transport):
+    # Sleep for whatever is left of the reset delay, if anything
+    remaining = getattr(transport, "ready_at", 0) - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
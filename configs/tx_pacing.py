@@ -0,0 +1,68 @@
+import time
+from configs.cue_player import wait_until
+from configs.packet_cache import packet_airtime
+import configs.config as cfg
+
+
+class TransmitPacer:
+    """
+    Decides when the next packet can be written to the Arduino, from how long the packets before it keep the IR
+    transmitter busy, instead of sleeping a guessed amount after every write.
+
+    A packet's airtime is exact: the number of pulses it contains times PULSE_LENGTH (see packet_airtime). The pacer
+    keeps track of when the transmitter will be free again. A packet is written early enough that its bytes finish
+    arriving over serial just as the transmitter frees up. It then waits in the Arduino's receive buffer in the
+    meantime, which is only allowed when it fits (ARDUINO_RX_BUFFER bytes). With WAIT_BEFORE_SEND on, nothing is
+    written until the transmitter is idle, for boards that can't receive and transmit at the same time. IR_PACKET_GAP
+    is left between packets so the bracelets see them as separate.
+
+    Call pace(packet) right before writing a packet. It blocks until the write can go out, then books the
+    transmitter for it.
+    """
+
+    def __init__(self, baud_rate=None, gap=None, rx_buffer=None, overlap=None):
+        self.baud_rate = cfg.ARDUINO_BAUD_RATE if baud_rate is None else baud_rate
+        self.gap_ns = int((cfg.IR_PACKET_GAP if gap is None else gap) * 1e9)
+        self.rx_buffer = cfg.ARDUINO_RX_BUFFER if rx_buffer is None else rx_buffer
+        self.overlap = (not cfg.WAIT_BEFORE_SEND) if overlap is None else overlap
+        # time.monotonic_ns() at which the transmitter will have finished everything booked so far
+        self.free_at_ns = 0
+
+        self.packets = 0
+        self.airtime_ns = 0
+        self.waited_ns = 0
+
+    def transfer_ns(self, packet):
+        # Serial time for the packet's bytes: 8 data bits plus start and stop bit each
+        return int(len(packet) * 10 * 1e9 / self.baud_rate)
+
+    def next_write_ns(self, packet):
+        # Earliest time the packet can be written without overrunning the transmitter or the receive buffer
+        if self.overlap and len(packet) <= self.rx_buffer:
+            return self.free_at_ns - self.transfer_ns(packet)
+        return self.free_at_ns
+
+    def reserve(self, packet, write_ns, airtime=None):
+        # Book the transmitter for a packet written at write_ns. Returns when it will be transmitted in full.
+        airtime_ns = int((packet_airtime(packet) if airtime is None else airtime) * 1e9)
+        start = max(write_ns + self.transfer_ns(packet), self.free_at_ns)
+        self.free_at_ns = start + airtime_ns + self.gap_ns
+        self.packets += 1
+        self.airtime_ns += airtime_ns
+        return start + airtime_ns
+
+    def wait(self, packet):
+        # Block until the packet can be written, without booking it
+        now = time.monotonic_ns()
+        write_ns = self.next_write_ns(packet)
+        if write_ns > now:
+            self.waited_ns += write_ns - now
+            wait_until(write_ns)
+
+    def pace(self, packet, airtime=None):
+        # Block until the packet can be written, then book it. Returns the time it will have been transmitted by.
+        self.wait(packet)
+        return self.reserve(packet, time.monotonic_ns(), airtime)
+
+    def stats(self):
+        return {"packets": self.packets, "airtime_s": self.airtime_ns / 1e9, "waited_s": self.waited_ns / 1e9}
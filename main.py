@@ -1,56 +1,75 @@
-import serial
 import time
 import numpy as np
 import sounddevice as sd
-import librosa
 import random
 import threading
 from collections import deque
-from configs.pixmob_conversion_funcs import bits_to_arduino_string
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
+from configs.audio_buffer import AudioRingBuffer
+from configs.streaming_stft import StreamingSTFT
+from configs.silence_gate import SilenceGate
+from configs.beat_tracker import OnlineBeatTracker
+from configs.beat_scheduler import BeatScheduler, CaptureClock
+from configs.cue_player import wait_until
+from configs.packet_cache import get_packet, get_airtime
+from configs.serial_writer import SerialWriter
+from configs.effect_index import EFFECT_INDEX, checked_tails, STROBE_TAILS
+from configs.transport import open_transport
+from configs.lazy_import import lazy_import, preload
+from configs.analysis_worker import AnalysisWorker
+from configs.latency_trace import LatencyTracer, CAPTURE, ANALYSIS_END
 import configs.config as cfg
 
-# Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=0.1)
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
 
 # Parameters for real-time audio analysis
 SAMPLE_RATE = 44100
 CHUNK_DURATION = 0.2
+BUFFER_DURATION = 2.0  # Ring buffer length, leaves room for audio arriving while a window is analysed
 FRAME_SIZE = 1024
 HISTORY_SIZE = 15
+N_FFT = 2048
+HOP_LENGTH = 512
 
-audio_buffer = deque(maxlen=int(SAMPLE_RATE * CHUNK_DURATION))
 beat_history = deque(maxlen=HISTORY_SIZE)
+# Input overflow/underflow flags from the audio callback, printed by the control loop instead of in the callback
+capture_status = deque(maxlen=100)
 
-color_effects = list(base_color_effects.keys()) + list(special_effects.keys())
-fade_effects = ['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5']
-strobe_effects = ['SLOW_WHITE', 'SLOW_TURQUOISE', 'SLOW_ORANGE', 'SLOW_YELLOW']
+# Every effect with a packet, so a random pick is always sent
+color_effects = EFFECT_INDEX.sendable
+fade_effects = checked_tails(['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5'], "main.py fade_effects")
 
 
-def send_effect(main_effect, tail_code=None):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect] + tail_codes.get(tail_code, '')
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+def send_effect(main_effect, tail_code=None, trace=None):
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return
 
-    arduino_string = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string, 'utf-8'))
-    print(f"Sent Effect: {main_effect} | Tail: {tail_code}")
+    serial_writer.submit(packet, trace=trace)
+    print(f"Queued Effect: {main_effect} | Tail: {tail_code} | Queue depth: {serial_writer.depth}")
+
 
+def send_on_next_beat(main_effect, tail_code=None, trace=None):
+    # Wait until the packet has to go out to land on the next beat, then send it. Sends straight away while the beat
+    # tracker hasn't placed any beats yet.
+    timing = beat_scheduler.next_send(get_airtime(main_effect, tail_code), packet=get_packet(main_effect, tail_code))
+    if timing is None:
+        send_effect(main_effect, tail_code, trace)
+        return False
+    send_ns, _ = timing
+    wait_until(send_ns)
+    send_effect(main_effect, tail_code, trace)
+    return True
 
-def analyze_audio(audio_data):
-    y = audio_data.flatten()
-    rms_energy = np.sqrt(np.mean(y ** 2))
-    silence_threshold = np.median(np.abs(y)) * 1.5
 
-    # Silence detection
-    if rms_energy < silence_threshold:
-        return None, None, 0
+def analyze_audio(audio_data, tempo=None):
+    y = audio_data.ravel()
+    # Silence is gated before this gets called (silence_gate in led_control_loop), so there's always sound here
 
     # Compute spectral features
-    tempo, _ = librosa.beat.beat_track(y=y, sr=SAMPLE_RATE)
+    # Pass tempo in (from beat_tracker) to skip beat tracking on this short window
+    if tempo is None:
+        tempo, _ = librosa.beat.beat_track(y=y, sr=SAMPLE_RATE)
     spectral_centroid = np.mean(librosa.feature.spectral_centroid(y=y, sr=SAMPLE_RATE))
     spectral_contrast = np.mean(librosa.feature.spectral_contrast(y=y, sr=SAMPLE_RATE))
 
@@ -59,38 +78,101 @@ def analyze_audio(audio_data):
 
     # Dynamic tail effect based on contrast (energy fluctuations)
     if spectral_contrast > 50:
-        tail_code = random.choice(strobe_effects)
+        tail_code = random.choice(STROBE_TAILS)
     else:
         tail_code = random.choice(fade_effects)
 
     return effect, tail_code, tempo
 
 
-def audio_callback(indata, frames, time, status):
+def audio_callback(indata, frames, time_info, status):
     if status:
-        print(status)
-    audio_buffer.append(indata.copy())
+        capture_status.append(status)
+    audio_buffer.write(indata)
+    capture_clock.mark_callback(audio_buffer.written, frames, time_info)
 
 
 def led_control_loop():
+    # audio_buffer.written when the last analysis ran. Analysis only runs again once at least a hop of new audio has
+    # arrived, the audio callback wakes the loop for it instead of it polling the buffer.
+    analyzed_up_to = 0
     while True:
-        if len(audio_buffer) > 0:
-            audio_data = np.concatenate(list(audio_buffer))
-            effect, tail_code, tempo = analyze_audio(audio_data)
-
-            if effect:
-                send_effect(effect, tail_code)
-
-            tempo = tempo.item() if isinstance(tempo, np.ndarray) else tempo
-            beat_interval = 60.0 / float(tempo) if tempo > 0 else 0.5
-            time.sleep(max(beat_interval * 0.5, 0.1))
+        written = audio_buffer.wait_for(analyzed_up_to + HOP_LENGTH)
+        while capture_status:
+            print(capture_status.popleft())
+        # The spectrogram and beat tracker keep running through silence: skipping audio would leave the beat tracker's
+        # frame count behind the stream and every predicted beat late by the length of the gap
+        new_frames = stft_engine.update(audio_buffer)
+        beat_tracker.update(stft_engine.latest(new_frames))
+        # Checked before any features are extracted, so silence costs one pass over the new samples on top of that
+        if not silence_gate.update(audio_buffer):
+            analyzed_up_to = written
+            continue
+
+        # The window to analyse ends at the write count read here, before the trace starts, so the newest analysed
+        # sample was always captured before ANALYSIS_START (the worker would otherwise read a later one)
+        written = audio_buffer.written
+        trace = tracer.begin()
+        if analysis_worker is not None:
+            _, (effect, tail_code, tempo) = analysis_worker.submit(beat_tracker.tempo, end=written).result()
         else:
-            time.sleep(0.05)
-
-
-stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=SAMPLE_RATE, blocksize=FRAME_SIZE)
-stream.start()
-threading.Thread(target=led_control_loop, daemon=True).start()
+            audio_data = audio_buffer.latest(SAMPLE_RATE * CHUNK_DURATION, end=written)
+            effect, tail_code, tempo = analyze_audio(audio_data, beat_tracker.tempo)
+        analyzed_up_to = written
+        if trace is not None:
+            # Capture time of the newest sample that was analysed
+            trace[CAPTURE] = capture_clock.sample_to_ns(written)
+            tracer.stamp(trace, ANALYSIS_END)
+
+        # Sent ahead of the next beat by the measured latency, so it shows on the beat. Otherwise wait for the next
+        # predicted beat, skipping any that are less than 0.1 s away.
+        if not (effect and send_on_next_beat(effect, tail_code, trace)):
+            time.sleep(beat_tracker.seconds_until_next_beat(audio_buffer.written, minimum=0.1))
+
+
+# Everything with side effects stays under here, the analysis worker process imports this file when it starts
+if __name__ == "__main__":
+    # Setup for Arduino connection
+    # Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+    arduino = open_transport()
+    # Per-decision timings from capture to serial write, when LATENCY_TRACE is on in config.py
+    tracer = LatencyTracer()
+    # Serial writes happen on their own thread so a slow link never holds up the analysis. It also waits out the
+    # Arduino's reset before the first write, so startup carries on in the meantime.
+    serial_writer = SerialWriter(arduino, tracer=tracer)
+    serial_writer.start()
+
+    # Rolling spectrogram feeding the beat tracker, only frames for newly arrived audio get computed
+    stft_engine = StreamingSTFT(n_fft=N_FFT, hop_length=HOP_LENGTH)
+    # Running level and noise floor, skips the analysis while it's quiet
+    silence_gate = SilenceGate(SAMPLE_RATE, hop_length=HOP_LENGTH)
+    # Tempo and beat phase estimated over the last several seconds, not just the analysis window
+    beat_tracker = OnlineBeatTracker(SAMPLE_RATE, hop_length=HOP_LENGTH, n_fft=N_FFT)
+
+    if cfg.ANALYSIS_IN_WORKER_PROCESS:
+        # The worker reads the capture buffer through shared memory and loads librosa itself
+        audio_buffer = AudioRingBuffer.create_shared(SAMPLE_RATE * BUFFER_DURATION)
+        analysis_worker = AnalysisWorker(audio_buffer, analyze_audio, SAMPLE_RATE * CHUNK_DURATION,
+                                         preload_modules=("librosa",))
+    else:
+        audio_buffer = AudioRingBuffer(SAMPLE_RATE * BUFFER_DURATION)
+        analysis_worker = None
+        # Load librosa in the background while the Arduino resets and the audio stream starts
+        preload("librosa")
+
+    stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=SAMPLE_RATE, blocksize=FRAME_SIZE)
+    # Puts beats found in the audio on the monotonic clock, counting the time audio takes to reach the callback
+    capture_clock = CaptureClock(SAMPLE_RATE, stream.latency)
+    beat_scheduler = BeatScheduler(beat_tracker, capture_clock, serial_writer)
+    stream.start()
+    threading.Thread(target=led_control_loop, daemon=True).start()
+
+    try:
+        while True:
+            time.sleep(10)
+            if tracer.enabled:
+                print(tracer.report())
+    except KeyboardInterrupt:
+        if tracer.enabled:
+            print(f"Latency trace written to {tracer.dump()}")
 
-while True:
-    time.sleep(1)
@@ -1,77 +1,79 @@
-import serial
 import time
 import numpy as np
 import sounddevice as sd
-import librosa
 import random
 from collections import deque
-from scipy.signal import find_peaks, spectrogram
-from configs.pixmob_conversion_funcs import bits_to_arduino_string
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
-import configs.config as cfg
-
-# Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=.1)
-time.sleep(2.5)
+from configs.audio_buffer import AudioRingBuffer
+from configs.streaming_stft import StreamingSTFT, periodic_tukey
+from configs.silence_gate import SilenceGate
+from configs.band_energy import band_bin_slices
+from configs.packet_cache import get_packet
+from configs.serial_writer import SerialWriter
+from configs.effect_index import EFFECT_INDEX, checked_effects, checked_tails
+from configs.transport import open_transport
+from configs.lazy_import import lazy_import, preload
+
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
+# Same for scipy.signal, only used for the peak picking and the fallback spectrogram in analyze_audio
+scipy_signal = lazy_import("scipy.signal")
 
 # Parameters for beat tracking
 sample_rate = 44100  # Standard audio sampling rate
 chunk_size = 0.2  # Reduced for lower latency
+buffer_duration = 2.0  # Ring buffer length, the most audio that can pile up between two analyses
+min_new_audio = 0.05  # Seconds of new audio to wait for before analysing again
 frame_size = 1024  # Buffer size
 history_size = 10  # Rolling buffer for beat detection
 
 # Effect categories for variety
-base_effects = list(base_color_effects.keys())
-spec_effects = list(special_effects.keys())
-color_effects = base_effects + spec_effects
-fade_effects = ['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5']
+# Every effect with a packet, so a random pick is always sent
+color_effects = EFFECT_INDEX.sendable
+fade_effects = checked_tails(['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5'], "pixmob.py fade_effects")
+# Picked by the dominant frequency band
+bass_effects = checked_effects(["RED_3", "YELLOW_4", "RED_2"], "pixmob.py bass_effects")
+mid_effects = checked_effects(["GREEN", "SLOW_GREEN", "YELLOWGREEN"], "pixmob.py mid_effects")
+treble_effects = checked_effects(["BLUE", "LIGHT_BLUE", "MAGENTA_2"], "pixmob.py treble_effects")
 
 # Rolling buffers
 beat_history = deque(maxlen=history_size)
-audio_buffer = deque(maxlen=int(sample_rate * chunk_size))
-
-
-def send_effect(main_effect, tail_code, sleep_after_send=False):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect]
-        if tail_code in tail_codes:
-            effect_bits += tail_codes[tail_code]
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+audio_buffer = AudioRingBuffer(sample_rate * buffer_duration)
+# Rolling spectrogram with the same segments, window and scaling (up to a constant) as scipy.signal.spectrogram's
+# defaults, but only computing segments for newly arrived audio
+spec_engine = StreamingSTFT(n_fft=256, hop_length=256 - 256 // 8, window=periodic_tukey(256, .25), power=2,
+                            detrend=True)
+# Running level and noise floor, skips the analysis while it's quiet
+silence_gate = SilenceGate(sample_rate)
+# Frequency bins in the bass, mid and treble bands, the same for the engine and spectrogram()'s 256 sample segments
+spec_bands = band_bin_slices(256, sample_rate)
+
+
+def send_effect(main_effect, tail_code):
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return
 
-    arduino_string_ver = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string_ver, 'utf-8'))
-    arduino.flush()
-
-    if sleep_after_send:
-        time.sleep(0.01 + 0.0005 * len(effect_bits))
+    # The writer thread does the write and flush once the transmitter is free, this returns right away
+    serial_writer.submit(packet)
 
-    print(f"Sent Effect: {main_effect}, {'No Tail' if not tail_code else 'Tail: ' + tail_code}")
+    print(f"Queued Effect: {main_effect}, {'No Tail' if not tail_code else 'Tail: ' + tail_code}")
 
 
 # Advanced Audio Analysis
-def analyze_audio(audio_data):
-    y = audio_data.flatten()
-
-    # Compute RMS Energy
-    rms_energy = np.sqrt(np.mean(y ** 2))
-    silence_threshold = 0.003  # Adjusted for better sensitivity
-
-    if rms_energy < silence_threshold:
-        return None, None, 0, None
+def analyze_audio(audio_data, spec=None):
+    y = audio_data.ravel()
+    # Silence is gated before this gets called (silence_gate in the main loop), so there's always sound here
 
     # Compute beat detection using peaks
     onset_env = librosa.onset.onset_strength(y=y, sr=sample_rate)
-    peaks, _ = find_peaks(onset_env, height=np.mean(onset_env))
+    peaks, _ = scipy_signal.find_peaks(onset_env, height=np.mean(onset_env))
     beat_detected = len(peaks) > 0
 
     # Frequency Analysis via Spectrogram
-    freqs, times, spec = spectrogram(y, sample_rate)
-    bass = np.sum(spec[(freqs >= 20) & (freqs <= 250)])
-    mid = np.sum(spec[(freqs >= 250) & (freqs <= 2000)])
-    treble = np.sum(spec[(freqs >= 2000) & (freqs <= 20000)])
+    # Pass spec in (from spec_engine) to skip recomputing it
+    if spec is None or spec.shape[1] == 0:
+        _, _, spec = scipy_signal.spectrogram(y, sample_rate)
+    bass, mid, treble = (np.sum(spec[band]) for band in spec_bands)
 
     total_energy = bass + mid + treble
     bass_ratio = bass / total_energy if total_energy > 0 else 0
@@ -80,11 +82,11 @@ def analyze_audio(audio_data):
 
     # Dynamic Effect Selection
     if bass_ratio > mid_ratio and bass_ratio > treble_ratio:
-        effect = random.choice(["RED_3", "YELLOW_4", "RED_2"])
+        effect = random.choice(bass_effects)
     elif mid_ratio > bass_ratio and mid_ratio > treble_ratio:
-        effect = random.choice(["GREEN", "SLOW_GREEN", "YELLOWkGREEN"])
+        effect = random.choice(mid_effects)
     elif treble_ratio > bass_ratio and treble_ratio > mid_ratio:
-        effect = random.choice(["BLUE", "LIGHT_BLUE", "MAGENTA_2"])
+        effect = random.choice(treble_effects)
     else:
         effect = random.choice(color_effects)
 
@@ -96,26 +98,46 @@ def analyze_audio(audio_data):
 def audio_callback(indata, frames, time, status):
     if status:
         print(status)
-    audio_buffer.append(indata.copy())
-
-
-# Start Audio Stream
-stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=sample_rate, blocksize=frame_size)
-stream.start()
-
-# Main Loop
-while True:
-    if len(audio_buffer) > 0:
-        audio_data = np.concatenate(list(audio_buffer))
-        audio_buffer.clear()
-
-        effect, tail_code, beat_count, beat_detected = analyze_audio(audio_data)
+    audio_buffer.write(indata)
+
+
+# Everything with side effects stays under here, so the analysis can be imported (by the benchmarks) on its own
+if __name__ == "__main__":
+    # Setup for Arduino connection
+    # Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+    arduino = open_transport()
+    # Serial writes happen on their own thread so a slow link never holds up the analysis. It also waits out the
+    # Arduino's reset before the first write, so startup carries on in the meantime.
+    serial_writer = SerialWriter(arduino)
+    serial_writer.start()
+    # Load librosa and scipy.signal in the background while the Arduino resets and the audio stream starts
+    preload("librosa", "scipy.signal")
+
+    # Start Audio Stream
+    stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=sample_rate, blocksize=frame_size)
+    stream.start()
+
+    # Main Loop
+    analyzed_up_to = 0  # audio_buffer.written at the last analysis
+    while True:
+        # The audio callback wakes this up as soon as enough new audio is in, instead of polling every 0.05 s
+        written = audio_buffer.wait_for(analyzed_up_to + int(sample_rate * min_new_audio))
+        # Everything that arrived since the last analysis, up to the write count wait_for returned even if the callback
+        # has written another block since
+        audio_data = audio_buffer.latest(written - analyzed_up_to, end=written)
+        analyzed_up_to = written
+        # Kept running through silence like in the other scripts, so it never has to catch up on a whole buffer
+        new_frames = spec_engine.update(audio_buffer)
+        # Checked before any features are extracted, so silence costs one pass over the new samples on top of that
+        if not silence_gate.update(audio_buffer):
+            continue
+
+        effect, tail_code, beat_count, beat_detected = analyze_audio(audio_data, spec_engine.latest(new_frames))
 
         print(f"Beats: {beat_count} | Effect: {effect} | Tail: {tail_code}")
 
         if effect:
             send_effect(effect, tail_code=tail_code)
 
-        time.sleep(0.3 if beat_detected else 0.05)
-    else:
-        time.sleep(0.05)
+        if beat_detected:
+            time.sleep(0.3)
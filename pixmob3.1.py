@@ -1,58 +1,64 @@
-import serial
 import time
 import numpy as np
 import sounddevice as sd
-import librosa
 import random
 import threading
 from collections import deque
-from configs.pixmob_conversion_funcs import bits_to_arduino_string
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
-import configs.config as cfg
-
-# Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=0.1)
+from configs.audio_buffer import AudioRingBuffer
+from configs.streaming_stft import StreamingSTFT
+from configs.silence_gate import SilenceGate
+from configs.beat_tracker import OnlineBeatTracker
+from configs.packet_cache import get_packet
+from configs.effect_index import EFFECT_INDEX, checked_tails, STROBE_TAILS
+from configs.transport import open_transport
+from configs.lazy_import import lazy_import, preload
+
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
 
 # Parameters for real-time audio analysis
 SAMPLE_RATE = 44100
 CHUNK_DURATION = 0.2
+BUFFER_DURATION = 2.0  # Ring buffer length, leaves room for audio arriving while a window is analysed
 FRAME_SIZE = 1024
 HISTORY_SIZE = 15
+N_FFT = 2048
+HOP_LENGTH = 512
+STFT_FRAMES = int(SAMPLE_RATE * CHUNK_DURATION) // HOP_LENGTH  # Frames covering one analysis window
 
 # Buffers for audio data
-audio_buffer = deque(maxlen=int(SAMPLE_RATE * CHUNK_DURATION))
+audio_buffer = AudioRingBuffer(SAMPLE_RATE * BUFFER_DURATION)
 beat_history = deque(maxlen=HISTORY_SIZE)
+# Rolling spectrogram, only frames for newly arrived audio get computed
+stft_engine = StreamingSTFT(n_fft=N_FFT, hop_length=HOP_LENGTH)
+# Running level and noise floor, skips the analysis while it's quiet
+silence_gate = SilenceGate(SAMPLE_RATE, hop_length=HOP_LENGTH)
+# Tempo and beat phase estimated over the last several seconds, not just the analysis window
+beat_tracker = OnlineBeatTracker(SAMPLE_RATE, hop_length=HOP_LENGTH, n_fft=N_FFT)
 
 # Effect categories
-color_effects = list(base_color_effects.keys()) + list(special_effects.keys())
-fade_effects = ['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5']
-strobe_effects = ['SLOW_WHITE', 'SLOW_TURQUOISE', 'SLOW_ORANGE', 'SLOW_YELLOW']
+# Every effect with a packet, so a random pick is always sent
+color_effects = EFFECT_INDEX.sendable
+fade_effects = checked_tails(['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5'], "pixmob3.1.py fade_effects")
 
 
 def send_effect(main_effect, tail_code=None):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect] + tail_codes.get(tail_code, '')
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return
 
-    arduino_string = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string, 'utf-8'))
+    arduino.write(packet)
     print(f"Sent Effect: {main_effect} | Tail: {tail_code}")
 
 
-def advanced_audio_analysis(audio_data):
-    y = audio_data.flatten()
-    rms_energy = np.sqrt(np.mean(y ** 2))
-    silence_threshold = np.median(np.abs(y)) * 1.5
-
-    # Silence detection
-    if rms_energy < silence_threshold:
-        return None, None, 120
+def advanced_audio_analysis(audio_data, stft=None, tempo=None):
+    y = audio_data.ravel()
+    # Silence is gated before this gets called (silence_gate in led_control_loop), so there's always sound here
 
     # Split frequency bands
-    stft = np.abs(librosa.stft(y, n_fft=2048, hop_length=512))
+    # Pass stft in (from stft_engine) to skip recomputing frames that were already computed last time
+    if stft is None or stft.shape[1] == 0:
+        stft = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
     low_energy = np.mean(stft[:512])
     mid_energy = np.mean(stft[512:1024])
     high_energy = np.mean(stft[1024:])
@@ -61,7 +67,9 @@ def advanced_audio_analysis(audio_data):
     effect = random.choice(color_effects)
 
     # Dynamic intensity and beat detection
-    tempo, _ = librosa.beat.beat_track(y=y, sr=SAMPLE_RATE)
+    # Pass tempo in (from beat_tracker) to skip beat tracking on this short window
+    if tempo is None:
+        tempo, _ = librosa.beat.beat_track(y=y, sr=SAMPLE_RATE)
     if tempo == 0 or np.isnan(tempo):
         tempo = 120  # Fallback tempo
 
@@ -69,7 +77,7 @@ def advanced_audio_analysis(audio_data):
 
     # Switch tail effects based on energy changes
     if high_energy > (low_energy + mid_energy):
-        tail_code = random.choice(strobe_effects)
+        tail_code = random.choice(STROBE_TAILS)
     else:
         tail_code = random.choice(fade_effects)
 
@@ -79,27 +87,46 @@ def advanced_audio_analysis(audio_data):
 def audio_callback(indata, frames, time, status):
     if status:
         print(status)
-    audio_buffer.append(indata.copy())
+    audio_buffer.write(indata)
 
 
 def led_control_loop():
+    # audio_buffer.written when the last analysis ran. The audio callback wakes the loop once a hop of new audio
+    # has arrived, instead of it polling the buffer, and the same samples never get analysed twice.
+    analyzed_up_to = 0
     while True:
-        if len(audio_buffer) > 0:
-            audio_data = np.concatenate(list(audio_buffer))
-            effect, tail_code, tempo = advanced_audio_analysis(audio_data)
-
-            if effect:
-                send_effect(effect, tail_code)
+        analyzed_up_to = audio_buffer.wait_for(analyzed_up_to + HOP_LENGTH)
+        # Everything below stops at this write count, so the window analysed ends where the frames the beat tracker
+        # just took in do, even if the callback writes another block in the meantime
+        # The spectrogram and beat tracker keep running through silence: skipping audio would leave the beat tracker's
+        # frame count behind the stream and every predicted beat late by the length of the gap
+        new_frames = stft_engine.update(audio_buffer, end=analyzed_up_to)
+        beat_tracker.update(stft_engine.latest(new_frames))
+        # Checked before any features are extracted, so silence costs one pass over the new samples on top of that
+        if not silence_gate.update(audio_buffer):
+            continue
+        audio_data = audio_buffer.latest(SAMPLE_RATE * CHUNK_DURATION, end=analyzed_up_to)
+        effect, tail_code, tempo = advanced_audio_analysis(audio_data, stft_engine.latest(STFT_FRAMES),
+                                                           beat_tracker.tempo)
+
+        if effect:
+            send_effect(effect, tail_code)
+
+        # Wait for the next predicted beat, skipping any that are less than 0.1 s away
+        time.sleep(beat_tracker.seconds_until_next_beat(audio_buffer.written, minimum=0.1))
+
+
+# Everything with side effects stays under here, so the analysis can be imported (by the benchmarks) on its own
+if __name__ == "__main__":
+    # Setup for Arduino connection
+    # Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+    arduino = open_transport()
+    # Load librosa in the background while the Arduino resets and the audio stream starts
+    preload("librosa")
+
+    stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=SAMPLE_RATE, blocksize=FRAME_SIZE)
+    stream.start()
+    threading.Thread(target=led_control_loop, daemon=True).start()
 
-            tempo = max(tempo, 1)  # Prevent zero-division
-            time.sleep(max(60.0 / tempo * 0.5, 0.1))
-        else:
-            time.sleep(0.05)
-
-
-stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=SAMPLE_RATE, blocksize=FRAME_SIZE)
-stream.start()
-threading.Thread(target=led_control_loop, daemon=True).start()
-
-while True:
-    time.sleep(1)
\ No newline at end of file
+    while True:
+        time.sleep(1)
\ No newline at end of file
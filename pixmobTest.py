@@ -1,45 +1,51 @@
-import serial
 import time
-import numpy as np
 import sounddevice as sd
-import librosa
-import librosa.display
 import random
-from configs.pixmob_conversion_funcs import bits_to_arduino_string
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
-import configs.config as cfg
+import numpy as np
+from configs.packet_cache import get_packet
+from configs.tx_pacing import TransmitPacer
+from configs.band_energy import get_band_extractor
+from configs.transport import open_transport, wait_until_ready
+from configs.effect_index import checked_effects, checked_tails
+from configs.lazy_import import lazy_import, preload
+
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
 
 # Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=.1)
-time.sleep(2.5)
+# Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+arduino = open_transport()
+# Load librosa in the background while the Arduino resets and the rest of the setup runs
+preload("librosa")
+# Spaces the packets by how long each one takes to transmit over IR
+pacer = TransmitPacer()
 
 # Parameters for beat tracking
 sample_rate = 44100  # Standard audio sampling rate
 chunk_size = 2  # Audio analysis window (seconds)
 
 # Effect categories for variety
-color_effects = ["RED_3", "GREEN", "BLUE", "MAGENTA_2", "YELLOW", "CYAN", "WHITE"]
-pulse_effects = ["PULSE_BLUE", "PULSE_RED", "PULSE_GREEN", "PULSE_WHITE"]
-flash_effects = ["FLASH_WHITE", "FLASH_BLUE", "FLASH_RED"]
-fade_effects = ["FADE_2", "FADE_4", "FADE_6"]
+# There are no CYAN, WHITE, PULSE_ or FLASH_ effects. TURQUOISE and WHITISH are the closest colors, the fade tail
+# codes already pulse, and FAST_WHITE is the nearest thing to a flash.
+color_effects = checked_effects(["RED_3", "GREEN", "BLUE", "MAGENTA_2", "YELLOW", "TURQUOISE", "WHITISH"],
+                                "pixmobTest.py color_effects")
+flash_effects = checked_effects(["FAST_WHITE"], "pixmobTest.py flash_effects")
+fade_effects = checked_tails(["FADE_2", "FADE_4", "FADE_6"], "pixmobTest.py fade_effects")
+# Picked by the dominant frequency band
+bass_effects = checked_effects(["RED_3", "RED_2", "DIM_RED"], "pixmobTest.py bass_effects")
+mid_effects = checked_effects(["GREEN", "SLOW_GREEN", "TURQUOISE"], "pixmobTest.py mid_effects")
+treble_effects = checked_effects(["BLUE", "LIGHT_BLUE", "MAGENTA_2"], "pixmobTest.py treble_effects")
 
 
 # Function to send effects to the wristband
-def send_effect(main_effect, tail_code, sleep_after_send=False):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect]
-        if tail_code and tail_code in tail_codes:
-            effect_bits += tail_codes[tail_code]
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+def send_effect(main_effect, tail_code):
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return  # Skip invalid effects
 
-    arduino_string_ver = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string_ver, 'utf-8'))
-
-    if sleep_after_send:
-        time.sleep(0.01 + 0.0008 * len(effect_bits))
+    # Waits until the bracelets' transmitter has finished the previous packet
+    pacer.pace(packet)
+    arduino.write(packet)
 
     print(f"Sent Effect: {main_effect}, {'No Tail' if not tail_code else 'Tail: ' + tail_code}")
 
@@ -53,18 +59,13 @@ def analyze_audio():
     # Convert to mono and process
     y = audio_data.flatten()
     tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate)
+    # Newer librosa returns the tempo as a one-element array
+    tempo = float(np.atleast_1d(tempo)[0])
     onset_env = librosa.onset.onset_strength(y=y, sr=sample_rate)
     beat_times = librosa.frames_to_time(beat_frames, sr=sample_rate)
 
-    # Perform FFT for frequency analysis
-    fft_data = np.fft.fft(y)
-    freqs = np.fft.fftfreq(len(fft_data), 1 / sample_rate)
-    magnitudes = np.abs(fft_data)
-
-    # Identify bass, mid, and treble ranges with normalized scaling
-    bass = np.sum(magnitudes[(freqs >= 20) & (freqs <= 250)])
-    mid = np.sum(magnitudes[(freqs >= 250) & (freqs <= 2000)])
-    treble = np.sum(magnitudes[(freqs >= 2000) & (freqs <= 20000)])
+    # Frequency analysis: bass, mid and treble magnitude sums, window and band bins are cached per window size
+    bass, mid, treble = get_band_extractor(len(y), sample_rate).energies(y)
 
     total_energy = bass + mid + treble
     bass_ratio = bass / total_energy if total_energy > 0 else 0
@@ -73,11 +74,11 @@ def analyze_audio():
 
     # Select effect based on dominant frequency
     if bass_ratio > mid_ratio and bass_ratio > treble_ratio:
-        effect = random.choice(["RED_3", "PULSE_RED", "FLASH_RED"])
+        effect = random.choice(bass_effects)
     elif mid_ratio > bass_ratio and mid_ratio > treble_ratio:
-        effect = random.choice(["GREEN", "PULSE_GREEN", "CYAN"])
+        effect = random.choice(mid_effects)
     elif treble_ratio > bass_ratio and treble_ratio > mid_ratio:
-        effect = random.choice(["BLUE", "PULSE_BLUE", "MAGENTA_2"])
+        effect = random.choice(treble_effects)
     else:
         effect = random.choice(color_effects)
 
@@ -91,13 +92,15 @@ def analyze_audio():
     return effect, tail_code, tempo, beat_times
 
 
+# The Arduino resets when the port opens, the rest of the setup above overlapped with that
+wait_until_ready(arduino)
 # Main loop to sync lights with beats and audio
 while True:
     effect_to_send, tail_code, tempo, beat_times = analyze_audio()
 
     print(f"Detected Tempo: {tempo} BPM | Effect: {effect_to_send} | Tail: {tail_code}")
 
-    send_effect(effect_to_send, tail_code, sleep_after_send=True)
+    send_effect(effect_to_send, tail_code)
 
     # Adjust timing based on detected tempo
     beat_interval = 60.0 / tempo if tempo > 0 else 0.5  # Default to 0.5 sec if tempo is unknown
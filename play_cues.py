@@ -0,0 +1,47 @@
+import argparse
+from configs.cue_list import read_cue_list
+from configs.cue_player import CuePlayer
+from configs.transport import open_transport
+import configs.config as cfg
+
+# Play a cue list made by render_cues.py (or by hand) on the bracelets, with every cue sent at its exact timestamp.
+# Start the music at the same moment this starts playing. Usage:
+#     python play_cues.py set_cues.csv
+#     python play_cues.py set_cues.csv --start 754.5 --transport fake
+# The lateness printed at the end is for this machine. With --transport fake the fake Arduino's reader thread shares
+# the GIL with the player, which adds to it (see CuePlayer).
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a PixMob cue list")
+    parser.add_argument("cues", help="Cue list CSV")
+    parser.add_argument("--start", type=float, default=0.0, help="Seconds into the show to start from")
+    parser.add_argument("--transport", choices=["serial", "fake", "null"], default=cfg.ARDUINO_TRANSPORT)
+    parser.add_argument("--quiet", action="store_true", help="Don't print every cue")
+    args = parser.parse_args()
+
+    arduino = open_transport(args.transport)
+    player = CuePlayer(arduino, read_cue_list(args.cues))
+    for timestamp, effect, tail_code in player.unknown:
+        print(f"Skipping unknown effect at {timestamp:.3f}s: {effect} {tail_code or ''}")
+
+    def on_cue(key, lateness):
+        print(f"{key[0]} {key[1] or ''} ({lateness * 1000:+.2f} ms)")
+
+    print(f"Playing {len(player.cues)} cues...")
+    try:
+        player.play(args.start, on_cue=None if args.quiet else on_cue)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        arduino.close()
+
+    stats = player.stats()
+    print(f"Played {stats['played']} cues, skipped {stats['skipped']}")
+    if stats["played"]:
+        print(f"Lateness: mean {stats['mean_ms']:.3f} ms, p50 {stats['p50_ms']:.3f} ms, "
+              f"p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
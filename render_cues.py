@@ -0,0 +1,112 @@
+import argparse
+import time
+import numpy as np
+from configs.audio_buffer import AudioRingBuffer
+from configs.audio_file import read_audio_blocks
+from configs.beat_tracker import OnlineBeatTracker
+from configs.cue_list import write_cue_list
+from configs.offline_analysis import ANALYZERS
+from configs.streaming_stft import StreamingSTFT
+
+# Render a recording into a cue list ahead of a show, much faster than realtime. The file is streamed through the same
+# ring buffer, STFT and beat tracker the live controller uses, the audio window before every beat is collected, and
+# the analyzer then runs on whole batches of windows at once. Usage:
+#     python render_cues.py set.wav -o set_cues.csv --analyzer advanced_audio_analysis --seed 1
+
+N_FFT = 2048
+HOP_LENGTH = 512
+BLOCK_SIZE = 8192  # Samples read per step, small enough that the beat tracker keeps up with tempo changes
+BATCH_SIZE = 256  # Windows per analyzer call
+
+
+def beat_samples(tracker, start, end):
+    # Beats the tracker currently places in [start, end), in stream samples
+    if tracker.last_beat_frame is None:
+        return []
+    last_beat = tracker.frame_to_sample(tracker.last_beat_frame)
+    period = tracker.beat_period_samples
+    first = np.ceil((start - last_beat) / period)
+    last = np.ceil((end - last_beat) / period)
+    return [int(last_beat + k * period) for k in np.arange(first, last)]
+
+
+def render_cue_list(path, analyzer="analyze_audio", window_duration=0.2, every=None, seed=None):
+    """
+    Returns (cues, seconds of audio rendered). Cues are placed on tracked beats, or every `every` seconds if given,
+    and silent windows get no cue.
+    """
+    analyze = ANALYZERS[analyzer]
+    rng = np.random.default_rng(seed)
+    sample_rate, blocks = read_audio_blocks(path, BLOCK_SIZE)
+    window = int(sample_rate * window_duration)
+    if analyzer == "advanced_audio_analysis":
+        window = max(window, N_FFT)
+
+    audio_buffer = AudioRingBuffer(BLOCK_SIZE + window + N_FFT)
+    stft = StreamingSTFT(N_FFT, HOP_LENGTH)
+    tracker = OnlineBeatTracker(sample_rate, HOP_LENGTH, N_FFT)
+
+    cues = []
+    positions, windows = [], []
+    # Cues closer than this to the previous one are dropped, so a phase correction can't double up a beat
+    min_gap = int(0.1 * sample_rate)
+    next_cue = window
+
+    def flush():
+        effects, tails = analyze(np.array(windows), sample_rate, rng)
+        for position, effect, tail_code in zip(positions, effects, tails):
+            if effect is not None:
+                cues.append((position / sample_rate, effect, tail_code))
+        positions.clear()
+        windows.clear()
+
+    for block in blocks:
+        previous = audio_buffer.written
+        audio_buffer.write(block)
+        written = audio_buffer.written
+
+        if every is None:
+            tracker.update(stft.latest(stft.update(audio_buffer)))
+            candidates = beat_samples(tracker, max(previous, next_cue), written + 1)
+        else:
+            step = every * sample_rate
+            first = np.ceil(max(previous, next_cue) / step)
+            candidates = [int(round(k * step)) for k in np.arange(first, np.floor(written / step) + 1)]
+
+        for position in candidates:
+            if position < next_cue:
+                continue
+            # Window of audio ending at the cue, the same audio the live loop would have analysed at that moment
+            age = written - position
+            windows.append(audio_buffer.latest(age + window)[:window].copy())
+            positions.append(position)
+            next_cue = position + min_gap
+            if len(windows) == BATCH_SIZE:
+                flush()
+
+    if windows:
+        flush()
+    return cues, audio_buffer.written / sample_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render an audio file into a PixMob cue list")
+    parser.add_argument("input", help="WAV or FLAC file (other formats need soundfile)")
+    parser.add_argument("-o", "--output", help="Cue list CSV (default: next to the input, .csv)")
+    parser.add_argument("--analyzer", choices=sorted(ANALYZERS), default="analyze_audio")
+    parser.add_argument("--window", type=float, default=0.2, help="Seconds of audio analysed per cue")
+    parser.add_argument("--every", type=float, help="Put a cue every N seconds instead of on beats")
+    parser.add_argument("--seed", type=int, help="Random seed, for a render that can be repeated exactly")
+    args = parser.parse_args()
+
+    output = args.output or args.input.rsplit(".", 1)[0] + ".csv"
+    start = time.perf_counter()
+    cues, duration = render_cue_list(args.input, args.analyzer, args.window, args.every, args.seed)
+    elapsed = time.perf_counter() - start
+    write_cue_list(output, cues)
+    print(f"{len(cues)} cues for {duration:.1f}s of audio in {elapsed:.2f}s "
+          f"({duration / max(elapsed, 1e-9):.0f}x realtime) -> {output}")
+
+
+if __name__ == "__main__":
+    main()
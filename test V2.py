@@ -1,17 +1,28 @@
-import serial
 import time
-import numpy as np
 import sounddevice as sd
-import librosa
-import librosa.display
 import random
-from configs.pixmob_conversion_funcs import bits_to_arduino_string
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
-import configs.config as cfg
-from collections import deque
+import numpy as np
+from configs.audio_buffer import AudioRingBuffer
+from configs.streaming_stft import StreamingSTFT
+from configs.beat_tracker import OnlineBeatTracker
+from configs.packet_cache import get_packet
+from configs.tx_pacing import TransmitPacer
+from configs.band_energy import get_band_extractor
+from configs.silence_gate import SilenceGate
+from configs.effect_index import EFFECT_INDEX, checked_effects, checked_tails
+from configs.transport import open_transport
+from configs.lazy_import import lazy_import, preload
+
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
 
 # Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=.1)
+# Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+arduino = open_transport()
+# Load librosa in the background while the Arduino resets and the rest of the setup runs
+preload("librosa")
+# Spaces the packets by how long each one takes to transmit over IR
+pacer = TransmitPacer()
 # time.sleep(2.5)
 
 # Parameters for beat tracking
@@ -19,11 +30,18 @@ sample_rate = 44100  # Standard audio sampling rate
 chunk_size = 0.3  # Audio analysis window (seconds) 0.3
 frame_size = 1024  # Small buffer for lower latency 1024
 history_size = 20  # Store last few beat detections for stability
+buffer_duration = 5  # Seconds of audio kept in the ring buffer
+n_fft = 2048
+hop_length = 512
 
 # Effect categories for variety
-color_effects = list(base_color_effects.keys()) + list(special_effects.keys())
-fade_effects = ['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5']
-strobe_effects = ['SLOW_WHITE', 'SLOW_TURQUOISE', 'SLOW_ORANGE', 'SLOW_YELLOW']
+# Every effect with a packet, so a random pick is always sent
+color_effects = EFFECT_INDEX.sendable
+fade_effects = checked_tails(['FADE_1', 'FADE_2', 'FADE_4', 'FADE_5'], "test V2.py fade_effects")
+# Picked by the dominant frequency band
+bass_effects = checked_effects(["RED_3", "YELLOW_4", "RED_2"], "test V2.py bass_effects")
+mid_effects = checked_effects(["GREEN", "SLOW_GREEN", "YELLOWGREEN"], "test V2.py mid_effects")
+treble_effects = checked_effects(["BLUE", "LIGHT_BLUE", "MAGENTA_2"], "test V2.py treble_effects")
 
 # base_effects = list(base_color_effects.keys())
 # spec_effects = list(
@@ -33,59 +51,53 @@ strobe_effects = ['SLOW_WHITE', 'SLOW_TURQUOISE', 'SLOW_ORANGE', 'SLOW_YELLOW']
 
 # Rolling beat detection buffer
 beat_history = []
-audio_buffer = deque(maxlen=int(sample_rate * chunk_size))  # Using deque to store chunks of audio
+# The audio callback writes into this, the main loop analyses the latest chunk_size seconds of it
+audio_buffer = AudioRingBuffer(sample_rate * buffer_duration)
+window_samples = int(sample_rate * chunk_size)
+# Running level and noise floor, skips the analysis while it's quiet
+silence_gate = SilenceGate(sample_rate)
+# Rolling spectrogram feeding the beat tracker, only frames for newly arrived audio get computed
+stft_engine = StreamingSTFT(n_fft=n_fft, hop_length=hop_length)
+# Tempo and beat phase estimated over the last several seconds, not just the analysis window
+beat_tracker = OnlineBeatTracker(sample_rate, hop_length=hop_length, n_fft=n_fft)
 
 
 # Function to send effects to the wristband
-def send_effect(main_effect, tail_code, sleep_after_send=False):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect]
-        if tail_code in tail_codes:
-            effect_bits += tail_codes[tail_code]
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+def send_effect(main_effect, tail_code):
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return  # Skip invalid effects
 
-    arduino_string_ver = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string_ver, 'utf-8'))
+    # Waits until the bracelets' transmitter has finished the previous packet
+    pacer.pace(packet)
+    arduino.write(packet)
     arduino.flush()
 
-    if sleep_after_send:
-        time.sleep(0.01 + 0.0008 * len(effect_bits))
-
     print(f"Sent Effect: {main_effect}, {'No Tail' if not tail_code else 'Tail: ' + tail_code}")
 
 
+# Times (from the start of the window ending at end) of the beats beat_tracker predicts inside it
+def tracked_beat_times(n_samples, end):
+    start = end - n_samples
+    first_beat = beat_tracker.next_beat_sample(start)
+    if first_beat is None:
+        return []
+    return [(beat - start) / sample_rate for beat in np.arange(first_beat, end, beat_tracker.beat_period_samples)]
+
+
 # Function to analyze audio and detect beat & frequency bands
-def analyze_audio(audio_data):
+def analyze_audio(audio_data, tempo=None, beat_times=None):
     # Convert to mono and process
     y = audio_data.flatten()
+    # Silence is gated before this gets called (silence_gate in the main loop), so there's always sound here
 
-    # Compute audio energy (RMS)
-    rms_energy = np.sqrt(np.mean(y ** 2))
+    # Pass tempo and beat_times in (from beat_tracker) to skip beat tracking on this short window
+    if tempo is None:
+        # tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate)
+        tempo, beat_times = librosa.beat.beat_track(y=y, sr=sample_rate, units='time')
 
-    # Define a silence threshold (tune this value based on testing)
-    silence_threshold = 0.005  # Adjust based on microphone sensitivity
-
-    # If audio is silent, return None to indicate no effect should be sent
-    if rms_energy < silence_threshold:
-        return None, None, 0, None
-
-    # tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate)
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate, units='time')
-    onset_env = librosa.onset.onset_strength(y=y, sr=sample_rate)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sample_rate)
-
-    # Perform FFT for frequency analysis
-    fft_data = np.fft.fft(y)
-    freqs = np.fft.fftfreq(len(fft_data), 1 / sample_rate)
-    magnitudes = np.abs(fft_data)
-
-    # Identify bass, mid, and treble ranges with normalized scaling
-    bass = np.sum(magnitudes[(freqs >= 20) & (freqs <= 250)])
-    mid = np.sum(magnitudes[(freqs >= 250) & (freqs <= 2000)])
-    treble = np.sum(magnitudes[(freqs >= 2000) & (freqs <= 20000)])
+    # Frequency analysis: bass, mid and treble magnitude sums, window and band bins are cached per window size
+    bass, mid, treble = get_band_extractor(len(y), sample_rate).energies(y)
 
     # Instead of simple FFT energy ratios, use MFCC-based frequency band detection:
     # mfcc = librosa.feature.mfcc(y=y, sr=sample_rate, n_mfcc=13)
@@ -104,11 +116,11 @@ def analyze_audio(audio_data):
     #     effect = "RED_3" if bass_ratio > 0.6 else random.choice(["YELLOW_4", "RED_2"])
 
     if bass_ratio > mid_ratio and bass_ratio > treble_ratio:
-        effect = random.choice(["RED_3", "YELLOW_4", "RED_2"])
+        effect = random.choice(bass_effects)
     elif mid_ratio > bass_ratio and mid_ratio > treble_ratio:
-        effect = random.choice(["GREEN", "SLOW_GREEN", "YELLOWkGREEN"])
+        effect = random.choice(mid_effects)
     elif treble_ratio > bass_ratio and treble_ratio > mid_ratio:
-        effect = random.choice(["BLUE", "LIGHT_BLUE", "MAGENTA_2"])
+        effect = random.choice(treble_effects)
     else:
         effect = random.choice(color_effects)
 
@@ -126,7 +138,7 @@ def analyze_audio(audio_data):
 def audio_callback(indata, frames, time, status):
     if status:
         print(status)
-    audio_buffer.append(indata.copy())  # Store incoming audio in the buffer
+    audio_buffer.write(indata)
 
 
 # Set up the audio stream
@@ -134,35 +146,32 @@ stream = sd.InputStream(callback=audio_callback, channels=1, samplerate=sample_r
 stream.start()
 
 # Main loop to sync lights with beats and audio
-# Main loop to sync lights with beats and audio
+analyzed_up_to = 0  # audio_buffer.written at the last analysis
 while True:
-    if len(audio_buffer) > 0:
-        # Get the most recent chunk of audio data from the buffer
-        audio_data = np.concatenate(list(audio_buffer))  # Concatenate the chunks
-        audio_buffer.clear()  # Clear the buffer after processing
-
-        # Now, analyze the audio data
-        effect_to_send, tail_code, tempo, beat_times = analyze_audio(audio_data)
-
-        print(f"Detected Tempo: {tempo} BPM | Effect: {effect_to_send} | Tail: {tail_code}")
-
-        # if effect_to_send in base_color_effects:
-        #     send_effect(effect_to_send, tail_code, sleep_after_send=True)
-        # else:
-        #     send_effect(effect_to_send, None, sleep_after_send=True)
-
-        send_effect(effect_to_send, tail_code=tail_code)
-
-        # Adjust timing based on detected tempo
-        # beat_interval = 60.0 / float(tempo) if tempo > 0 else 0.5
-
-        beat_interval = 60.0 / float(tempo) if tempo and tempo > 0 else 0.5
-
-        # Ensure tempo is a scalar
-        # tempo = tempo.item() if isinstance(tempo, np.ndarray) else tempo
-        # beat_interval = 60.0 / float(tempo) if tempo > 0 else 0.5
-
-        time.sleep(beat_interval)
-
-    else:
-        time.sleep(0.05)  # If buffer is empty, just wait for new data
+    # The audio callback wakes this up once a full window is in and a block has arrived since the last analysis
+    written = audio_buffer.wait_for(max(analyzed_up_to + frame_size, window_samples))
+    analyzed_up_to = written
+    # The spectrogram and beat tracker keep running through silence: skipping audio would leave the beat tracker's
+    # frame count behind the stream and every predicted beat late by the length of the gap
+    new_frames = stft_engine.update(audio_buffer)
+    beat_tracker.update(stft_engine.latest(new_frames))
+    # Checked before any features are computed, nothing is sent while it's quiet
+    if not silence_gate.update(audio_buffer):
+        continue
+
+    # Always the last chunk_size seconds, so the band extractor for that length is built once and stays cached
+    audio_data = audio_buffer.latest(window_samples, end=written)
+    effect_to_send, tail_code, tempo, beat_times = analyze_audio(audio_data, beat_tracker.tempo,
+                                                               tracked_beat_times(window_samples, written))
+
+    print(f"Detected Tempo: {tempo} BPM | Effect: {effect_to_send} | Tail: {tail_code}")
+
+    # if effect_to_send in base_color_effects:
+    #     send_effect(effect_to_send, tail_code)
+    # else:
+    #     send_effect(effect_to_send, None)
+
+    send_effect(effect_to_send, tail_code=tail_code)
+
+    # Wait for the next predicted beat, skipping any that are less than 0.1 s away
+    time.sleep(beat_tracker.seconds_until_next_beat(audio_buffer.written, minimum=0.1))
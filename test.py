@@ -1,77 +1,96 @@
-import serial
 import time
 import numpy as np
 import sounddevice as sd
-import librosa
-import librosa.display
 import random
-from configs.pixmob_conversion_funcs import (bits_to_arduino_string)
-from configs.effect_definitions import base_color_effects, tail_codes, special_effects
-import configs.config as cfg
-
-# Setup for Arduino connection
-arduino = serial.Serial(port=cfg.ARDUINO_SERIAL_PORT, baudrate=cfg.ARDUINO_BAUD_RATE, timeout=.1)
-time.sleep(2.5)
+from configs.audio_buffer import AudioRingBuffer
+from configs.streaming_stft import StreamingSTFT
+from configs.beat_tracker import OnlineBeatTracker
+from configs.packet_cache import get_packet
+from configs.tx_pacing import TransmitPacer
+from configs.band_energy import get_band_extractor
+from configs.silence_gate import SilenceGate
+from configs.effect_index import EFFECT_INDEX, checked_effects, checked_tails
+from configs.transport import open_transport, wait_until_ready
+from configs.lazy_import import lazy_import, preload
+
+# Imported on first use (or by preload below) since it takes seconds to import on small machines
+librosa = lazy_import("librosa")
 
 # Parameters for beat tracking
 sample_rate = 44100  # Standard audio sampling rate
 chunk_size = 0.3  # Audio analysis window (seconds)
 frame_size = 1024  # Small buffer for lower latency
 history_size = 15  # Store last few beat detections for stability
+buffer_duration = 2  # Seconds of recorded audio kept for the spectrogram
+n_fft = 2048
+hop_length = 512
 
 # Effect categories for variety
-color_effects = ['RED_3', 'GREEN', 'BLUE',  'MAGENTA_2',  'YELLOW_4', 'ORANGE', 'WHITISH', 'WHITISH_LONG']
+color_effects = checked_effects(['RED_3', 'GREEN', 'BLUE', 'MAGENTA_2', 'YELLOW_4', 'ORANGE', 'WHITISH', 'WHITISH_LONG'],
+                                "test.py color_effects")
 # list(base_color_effects.keys())  # ["RED_3", "GREEN", "BLUE", "MAGENTA_2", "YELLOW", "CYAN", "WHITE"]
 # pulse_effects = list(special_effects.keys())  # ["PULSE_BLUE", "PULSE_RED", "PULSE_GREEN", "PULSE_WHITE"]
 # flash_effects = list(special_effects.keys())  # ["FLASH_WHITE", "FLASH_BLUE", "FLASH_RED"]
-fade_effects = ['FADE_2']
+fade_effects = checked_tails(['FADE_2'], "test.py fade_effects")
 # ['FADE_1', 'FADE_2', 'FADE_3', 'FADE_4', 'FADE_5', 'FADE_6']
+# Picked by the dominant frequency band
+bass_effects = checked_effects(["RED_3", "YELLOW_4", "RED_2"], "test.py bass_effects")
+mid_effects = checked_effects(["GREEN", "SLOW_GREEN", "YELLOWGREEN"], "test.py mid_effects")
+treble_effects = checked_effects(["BLUE", "LIGHT_BLUE", "MAGENTA_2"], "test.py treble_effects")
 
 # Rolling beat detection buffer
 beat_history = []
+# Running level and noise floor, skips the analysis while it's quiet
+silence_gate = SilenceGate(sample_rate)
+# Each recording is appended here, so the spectrogram and beat tracker see one continuous stream of recorded audio
+audio_buffer = AudioRingBuffer(sample_rate * buffer_duration)
+# Rolling spectrogram feeding the beat tracker, only frames for newly recorded audio get computed
+stft_engine = StreamingSTFT(n_fft=n_fft, hop_length=hop_length)
+# Tempo and beat phase estimated over the last several seconds, not just one recording
+beat_tracker = OnlineBeatTracker(sample_rate, hop_length=hop_length, n_fft=n_fft)
 
 # Function to send effects to the wristband
-def send_effect(main_effect, tail_code, sleep_after_send=False):
-    if main_effect in base_color_effects:
-        effect_bits = base_color_effects[main_effect]
-        if tail_code in tail_codes:
-            effect_bits += tail_codes[tail_code]
-    elif main_effect in special_effects:
-        effect_bits = special_effects[main_effect]
-    else:
+def send_effect(main_effect, tail_code):
+    packet = get_packet(main_effect, tail_code)
+    if packet is None:
         return  # Skip invalid effects
 
-    arduino_string_ver = bits_to_arduino_string(effect_bits)
-    arduino.write(bytes(arduino_string_ver, 'utf-8'))
+    # Waits until the bracelets' transmitter has finished the previous packet
+    pacer.pace(packet)
+    arduino.write(packet)
     # arduino.flush()
 
-    if sleep_after_send:
-        time.sleep(0.01 + 0.0008 * len(effect_bits))
-
     print(f"Sent Effect: {main_effect}, {'No Tail' if not tail_code else 'Tail: ' + tail_code}")
 
 
-# Function to analyze audio and detect beat & frequency bands
-def analyze_audio():
-    # Record short audio sample
+# Record short audio sample
+def record_audio():
     audio_data = sd.rec(int(sample_rate * chunk_size), samplerate=sample_rate, channels=1, dtype='float64')
     sd.wait()
+    return audio_data
+
+
+# Times (from the start of the last recording) of the beats beat_tracker predicts inside it
+def tracked_beat_times(n_samples):
+    end = audio_buffer.written
+    start = end - n_samples
+    first_beat = beat_tracker.next_beat_sample(start)
+    if first_beat is None:
+        return []
+    return [(beat - start) / sample_rate for beat in np.arange(first_beat, end, beat_tracker.beat_period_samples)]
+
 
+# Function to analyze audio and detect beat & frequency bands
+def analyze_audio(audio_data, tempo=None, beat_times=None):
     # Convert to mono and process
     y = audio_data.flatten()
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sample_rate)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sample_rate)
-
-    # Perform FFT for frequency analysis
-    fft_data = np.fft.fft(y)
-    freqs = np.fft.fftfreq(len(fft_data), 1 / sample_rate)
-    magnitudes = np.abs(fft_data)
+    # Pass tempo and beat_times in (from beat_tracker) to skip beat tracking on this short recording
+    if tempo is None:
+        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sample_rate)
+        beat_times = librosa.frames_to_time(beat_frames, sr=sample_rate)
 
-    # Identify bass, mid, and treble ranges with normalized scaling
-    bass = np.sum(magnitudes[(freqs >= 20) & (freqs <= 250)])
-    mid = np.sum(magnitudes[(freqs >= 250) & (freqs <= 2000)])
-    treble = np.sum(magnitudes[(freqs >= 2000) & (freqs <= 20000)])
+    # Frequency analysis: bass, mid and treble magnitude sums, window and band bins are cached per window size
+    bass, mid, treble = get_band_extractor(len(y), sample_rate).energies(y)
 
     total_energy = bass + mid + treble
     bass_ratio = bass / total_energy if total_energy > 0 else 0
@@ -80,11 +99,11 @@ def analyze_audio():
 
     # Select effect based on dominant frequency
     if bass_ratio > mid_ratio and bass_ratio > treble_ratio:
-        effect = random.choice(["RED_3", "YELLOW_4", "RED_2"])
+        effect = random.choice(bass_effects)
     elif mid_ratio > bass_ratio and mid_ratio > treble_ratio:
-        effect = random.choice(["GREEN", "SLOW_GREEN", "YELLOWGREEN"])
+        effect = random.choice(mid_effects)
     elif treble_ratio > bass_ratio and treble_ratio > mid_ratio:
-        effect = random.choice(["BLUE", "LIGHT_BLUE", "MAGENTA_2"])
+        effect = random.choice(treble_effects)
     else:
         effect = random.choice(color_effects)
 
@@ -104,20 +123,39 @@ def analyze_audio():
 #     while True:
 #         time.sleep(0.05)  # Keep main thread alive
 
-# Main loop to sync lights with beats and audio
-while True:
-    effect_to_send, tail_code, tempo, beat_times = analyze_audio()
-
-    print(f"Detected Tempo: {tempo} BPM | Effect: {effect_to_send} | Tail: {tail_code}")
-
-    if effect_to_send in base_color_effects:
-        send_effect(effect_to_send, tail_code, sleep_after_send=True)
-    else:
-        send_effect(effect_to_send, None, sleep_after_send=True)
-
-    # Adjust timing based on detected tempo
-
-    # beat_interval = 60.0 / tempo if tempo > 0 else 0.5  # Default to 0.beat_interval = 60.0 / float(tempo) if tempo > 0 else 0.55 sec if tempo is unknown
-    # beat_interval = 60.0 / float(tempo) if tempo > 0 else 0.5
-    beat_interval = 60.0 / tempo.item() if tempo.size > 0 and tempo.item() > 0 else 0.5
-    time.sleep(beat_interval)
+# Everything with side effects stays under here, so the analysis can be imported (by the benchmarks) on its own
+if __name__ == "__main__":
+    # Setup for Arduino connection
+    # Real serial port, fake Arduino or null sink depending on ARDUINO_TRANSPORT in config.py
+    arduino = open_transport()
+    # Load librosa in the background while the Arduino resets
+    preload("librosa")
+    # Spaces the packets by how long each one takes to transmit over IR
+    pacer = TransmitPacer()
+    # The Arduino resets when the port opens, the rest of the setup above overlapped with that
+    wait_until_ready(arduino)
+    # Main loop to sync lights with beats and audio
+    while True:
+        audio_data = record_audio()
+        # The spectrogram and beat tracker keep running through silence, like in the streaming scripts
+        audio_buffer.write(audio_data)
+        new_frames = stft_engine.update(audio_buffer)
+        beat_tracker.update(stft_engine.latest(new_frames))
+        # Checked before any features are computed, record the next chunk straight away while it's quiet
+        if not silence_gate.feed(audio_data):
+            continue
+        effect_to_send, tail_code, tempo, beat_times = analyze_audio(audio_data, beat_tracker.tempo,
+                                                                   tracked_beat_times(len(audio_data)))
+
+        print(f"Detected Tempo: {tempo} BPM | Effect: {effect_to_send} | Tail: {tail_code}")
+
+        # Only base colors take a tail code
+        if EFFECT_INDEX.info[effect_to_send].kind == "base":
+            send_effect(effect_to_send, tail_code)
+        else:
+            send_effect(effect_to_send, None)
+
+        # Wait for the next predicted beat, skipping any that are less than 0.1 s away. sd.rec doesn't record while
+        # this sleeps, so the beats are predicted from the end of the last recording as if the next one followed on
+        # straight away.
+        time.sleep(beat_tracker.seconds_until_next_beat(audio_buffer.written, minimum=0.1))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from configs.audio_buffer import AudioRingBuffer
+from configs.beat_tracker import OnlineBeatTracker
+from configs.streaming_stft import StreamingSTFT
+
+SAMPLE_RATE = 44100
+
+
+def drum_track(bpm, seconds=16, hihat=False, seed=0):
+    # A kick on every beat over faint noise, optionally with a hi-hat on every off-beat
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    y = 0.005 * rng.standard_normal(n)
+    t = np.arange(8000) / SAMPLE_RATE
+    kick = 0.8 * np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * np.exp(-t * 12)
+    hat = 0.2 * rng.standard_normal(1500) * np.exp(-np.arange(1500) / 200)
+    period = 60 / bpm
+    for beat in np.arange(0, seconds - 0.3, period):
+        start = int(beat * SAMPLE_RATE)
+        y[start:start + len(kick)] += kick[:n - start]
+        if hihat:
+            start = int((beat + period / 2) * SAMPLE_RATE)
+            y[start:start + len(hat)] += hat[:n - start]
+    return y.astype(np.float32)
+
+
+def track(audio, block_size=1024):
+    # Fed block by block through a ring buffer, like the controller's audio callback does
+    audio_buffer = AudioRingBuffer(SAMPLE_RATE * 2)
+    stft = StreamingSTFT()
+    tracker = OnlineBeatTracker(SAMPLE_RATE)
+    for start in range(0, len(audio), block_size):
+        audio_buffer.write(audio[start:start + block_size, None])
+        tracker.update(stft.latest(stft.update(audio_buffer)))
+    return tracker
+
+
+@pytest.mark.parametrize("bpm", [90, 128, 170, 174])
+def test_kick_only_tempo(bpm):
+    assert track(drum_track(bpm)).tempo == pytest.approx(bpm, rel=0.03)
+
+
+@pytest.mark.parametrize("bpm", [90, 150, 180])
+def test_off_beat_hihat_keeps_the_kick_tempo(bpm):
+    assert track(drum_track(bpm, hihat=True)).tempo == pytest.approx(bpm, rel=0.03)
+
+
+def test_next_beat_lands_on_a_kick():
+    bpm = 120
+    tracker = track(drum_track(bpm))
+    period = 60 / bpm * SAMPLE_RATE
+    offset = tracker.next_beat_sample(tracker.frames * tracker.hop_length) % period
+    # Within a couple of hops of a kick
+    assert min(offset, period - offset) < 2 * tracker.hop_length